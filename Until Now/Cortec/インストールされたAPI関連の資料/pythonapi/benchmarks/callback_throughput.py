@@ -0,0 +1,261 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring callback_throughput
+
+    Throughput benchmark of the measurement callback path.
+
+    Drives the bridged onData callback of _ImplantListener through the
+    simulated C library (see pythonapi.simulatedapi) for all 
+    combinations of sampling rates, channel counts and listener modes
+    and writes the results as JSON.
+
+    Each configuration runs in a separate process, so garbage 
+    collector and allocator state do not leak between measurements.
+    The rate "max" delivers samples as fast as the listener accepts 
+    them and yields the achievable samples per second. The mode "none"
+    runs the simulation without a registered listener; its CPU time is
+    the cost of the simulated library alone and can be subtracted from
+    the other modes.
+
+    Usage:
+        python callback_throughput.py --duration 2 --output results.json
+        python callback_throughput.py --rates 1000,max --channels 8,128 --modes list,block
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+DEFAULT_RATES = "1000,2000,5000,10000,max"
+DEFAULT_CHANNELS = "8,16,32,64,128"
+DEFAULT_MODES = "none,list,array,view,block"
+
+class _GCMonitor():
+    '''Collects the number and duration of garbage collector runs.'''
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.pauses = []
+        self._start = None
+
+    def __call__(self, phase, info):
+        if phase == "start":
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            self.pauses.append(time.perf_counter() - self._start)
+            self.collections[info["generation"]] += 1
+            self._start = None
+
+def _create_listener_class():
+    from pythonapi import ImplantListener
+
+    class CountingListener(ImplantListener):
+        '''Listener doing nothing but counting the received samples.'''
+
+        def __init__(self):
+            self.num_samples = 0
+            self.too_slow_events = 0
+
+        def on_stimulation_state_changed(self, is_stimulating):
+            pass
+
+        def on_measurement_state_changed(self, is_measuring):
+            pass
+
+        def on_connection_state_changed(self, connection_type, connection_state):
+            pass
+
+        def on_data(self, sample):
+            self.num_samples += 1
+
+        def on_data_block(self, block):
+            self.num_samples += len(block)
+
+        def on_implant_voltage_changed(self, voltage_V):
+            pass
+
+        def on_primary_coil_current_changed(self, current_mA):
+            pass
+
+        def on_implant_control_value_changed(self, control_value):
+            pass
+
+        def on_temperature_changed(self, temperature):
+            pass
+
+        def on_humidity_changed(self, humidity):
+            pass
+
+        def on_error(self, error_description):
+            pass
+
+        def on_data_processing_too_slow(self):
+            self.too_slow_events += 1
+
+        def on_stimulation_function_finished(self, num_executed_functions):
+            pass
+
+    return CountingListener
+
+def run_configuration(rate: str, num_channels: int, mode: str, duration_s: float, warmup_s: float,
+                      trace_allocations: bool) -> dict:
+    '''Measure one configuration in the current process.'''
+
+    from pythonapi import ImplantFactory, MeasurementMode, use_simulated_api
+
+    realtime = rate != "max"
+    sampling_rate = int(rate) if realtime else 1000
+    simulation = use_simulated_api(num_channels=num_channels, sampling_rate=sampling_rate, realtime=realtime).simulation
+
+    factory = ImplantFactory()
+    external_unit_info = factory.load_external_unit_infos()[0]
+    implant = factory.create(external_unit_info, factory.load_implant_info(external_unit_info))
+
+    listener = _create_listener_class()()
+    if mode == "list":
+        implant.register_listener(listener)
+    elif mode == "array":
+        implant.register_listener(listener, measurement_mode=MeasurementMode.MEASUREMENT_ARRAY)
+    elif mode == "view":
+        implant.register_listener(listener, measurement_mode=MeasurementMode.MEASUREMENT_VIEW)
+    elif mode == "block":
+        implant.register_listener(listener, block_interval_ms=10.)
+    elif mode != "none":
+        raise ValueError(f"Unknown mode {mode}.")
+
+    gc_monitor = _GCMonitor()
+
+    implant.start_measurement([])
+    time.sleep(warmup_s)
+
+    if trace_allocations:
+        import tracemalloc
+        tracemalloc.start()
+    gc.callbacks.append(gc_monitor)
+    gc_count_start = gc.get_count()[0]
+    blocks_start = sys.getallocatedblocks()
+    samples_start = listener.num_samples
+    counter_start = simulation.implant.measurement_counter if mode == "none" else None
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    time.sleep(duration_s)
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    samples = listener.num_samples - samples_start
+    if mode == "none":
+        # Without listener the generated samples are counted by the simulation
+        samples = simulation.implant.measurement_counter - counter_start
+    blocks = sys.getallocatedblocks() - blocks_start
+    gc_count = gc.get_count()[0] - gc_count_start
+    gc.callbacks.remove(gc_monitor)
+    if trace_allocations:
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    implant.stop_measurement()
+    gap_statistics = implant.gap_statistics
+    implant.unregister_listener()
+
+    # Gen 0 runs every threshold[0] container allocations (net of deallocations)
+    allocations_estimate = gc_monitor.collections[0] * gc.get_threshold()[0] + gc_count
+
+    result = {"rate": rate,
+              "channels": num_channels,
+              "mode": mode,
+              "duration_s": wall,
+              "samples": samples,
+              "samples_per_s": samples / wall,
+              "expected_samples_per_s": sampling_rate if realtime else None,
+              "cpu_s": cpu,
+              "cpu_us_per_sample": cpu / samples * 1e6 if samples else None,
+              "cpu_load": cpu / wall,
+              "too_slow_events": listener.too_slow_events,
+              "lost_samples": gap_statistics["total_missing"] if gap_statistics else 0,
+              "allocated_blocks_delta": blocks,
+              "gc_allocations_estimate": allocations_estimate,
+              "gc_allocations_per_sample": allocations_estimate / samples if samples else None,
+              "gc_collections": gc_monitor.collections,
+              "gc_pause_total_ms": sum(gc_monitor.pauses) * 1e3,
+              "gc_pause_max_ms": max(gc_monitor.pauses, default=0.) * 1e3}
+    if trace_allocations:
+        result["traced_current_bytes"] = traced_current
+        result["traced_peak_bytes"] = traced_peak
+    return result
+
+def _metadata() -> dict:
+    import numpy as np
+    from pythonapi import get_library_version, use_simulated_api
+
+    use_simulated_api()
+    return {"timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "library_version": get_library_version()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the measurement callback path.")
+    parser.add_argument("--rates", default=DEFAULT_RATES, help="Comma-separated sampling rates in Hz or 'max'.")
+    parser.add_argument("--channels", default=DEFAULT_CHANNELS, help="Comma-separated channel counts.")
+    parser.add_argument("--modes", default=DEFAULT_MODES, help="Comma-separated modes: none, list, array, view, block.")
+    parser.add_argument("--duration", type=float, default=2., help="Measured seconds per configuration.")
+    parser.add_argument("--warmup", type=float, default=0.5, help="Seconds before measuring.")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace allocated memory (slows down the callbacks).")
+    parser.add_argument("--output", help="JSON file for the results (default: stdout).")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_configuration(args.rates, int(args.channels), args.modes, args.duration, args.warmup,
+                                           args.tracemalloc)))
+        return
+
+    results = []
+    for rate in args.rates.split(","):
+        for num_channels in args.channels.split(","):
+            for mode in args.modes.split(","):
+                command = [sys.executable, __file__, "--single", "--rates", rate, "--channels", num_channels,
+                           "--modes", mode, "--duration", str(args.duration), "--warmup", str(args.warmup)]
+                if args.tracemalloc:
+                    command.append("--tracemalloc")
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                results.append(result)
+                print(f"{rate:>6} Hz {num_channels:>4} ch {mode:>6}: {result['samples_per_s']:>10.0f} samples/s, "
+                      f"{result['cpu_us_per_sample'] or 0:7.2f} us/sample, lost {result['lost_samples']}",
+                      file=sys.stderr)
+
+    report = json.dumps({"metadata": _metadata(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring import_time
+
+    Benchmark of the startup cost of the pythonapi package.
+
+    Every scenario runs in a fresh interpreter, as short-lived command
+    line tools do. The time of each step is taken inside the child 
+    process, the total wall time of the process includes the 
+    interpreter startup ("python -c pass" is measured as reference).
+    The first call runs against the simulated C library, selected with
+    the environment variable CORTEC_CAPI_SIMULATION.
+
+    Usage:
+        python import_time.py --runs 20 --output results.json
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Each scenario prints the durations of its steps in seconds as JSON
+SCENARIOS = {
+    "interpreter": "import json; print(json.dumps({}))",
+    "import_package": """
+import json, time
+start = time.perf_counter()
+import pythonapi
+print(json.dumps({"import": time.perf_counter() - start}))
+""",
+    "import_factory": """
+import json, time
+start = time.perf_counter()
+from pythonapi import ImplantFactory
+print(json.dumps({"import": time.perf_counter() - start}))
+""",
+    "first_call": """
+import json, time
+start = time.perf_counter()
+from pythonapi import ImplantFactory, get_library_version
+imported = time.perf_counter()
+get_library_version()
+loaded = time.perf_counter()
+factory = ImplantFactory()
+factory.load_implant_info(factory.load_external_unit_infos()[0]).channel_info
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "load_library": loaded - imported, "first_call": done - loaded}))
+""",
+}
+
+def run_scenario(code: str, runs: int) -> dict:
+    '''Run code in runs fresh interpreters and summarize the wall time
+        and the reported step durations in milliseconds.
+    '''
+
+    environment = dict(os.environ, PYTHONPATH=SRC_DIR, CORTEC_CAPI_SIMULATION="num_channels=32")
+    wall_times = []
+    steps = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code], env=environment, capture_output=True, text=True,
+                                check=True).stdout
+        wall_times.append(time.perf_counter() - start)
+        for step, duration in json.loads(output).items():
+            steps.setdefault(step, []).append(duration)
+
+    def summarize(values):
+        return {"median_ms": statistics.median(values) * 1e3, "min_ms": min(values) * 1e3,
+                "max_ms": max(values) * 1e3}
+
+    result = {"wall": summarize(wall_times)}
+    for step, durations in steps.items():
+        result[step] = summarize(durations)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the startup cost of the pythonapi package.")
+    parser.add_argument("--runs", type=int, default=20, help="Interpreter launches per scenario.")
+    parser.add_argument("--output", help="JSON file for the results (default: stdout).")
+    args = parser.parse_args()
+
+    results = {name: run_scenario(code, args.runs) for name, code in SCENARIOS.items()}
+    report = json.dumps({"metadata": {"timestamp": datetime.now(timezone.utc).isoformat(),
+                                      "python": platform.python_version(),
+                                      "platform": platform.platform(),
+                                      "runs": args.runs},
+                         "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring object_construction
+
+    Micro-benchmark of constructing the ctypes wrapper objects.
+
+    The wrapper classes declare the C functions they use as _CFunction
+    class attributes, which are bound once per process. This benchmark
+    compares the construction time with the former per-instance 
+    registration, which looked up every function in the dll and set its
+    restype and argtypes in each constructor. The per-instance variant
+    is reproduced from the class declarations before they are bound.
+
+    It further times building a stimulation command with many atoms and
+    enumerating the channels of an implant, both running against the 
+    simulated C library.
+
+    Usage:
+        python object_construction.py --repeat 20000 --output results.json
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from datetime import datetime, timezone
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from pythonapi import (ChannelInfo, ImplantFactory, ImplantInfo, StimulationAtom, StimulationCommand,
+                       StimulationCommandFactory, StimulationFunction, get_library_version, use_simulated_api)
+from pythonapi.pythonapibase import CAPIStatus, _CFunction, get_api_base
+
+WRAPPER_CLASSES = (ChannelInfo, ImplantInfo, StimulationAtom, StimulationFunction, StimulationCommand)
+
+def _declarations(cls) -> list:
+    '''Collect the (attribute, C name, argtypes) declarations of a class.
+        Must be called before the functions are bound.
+    '''
+    return [(name, value._c_name, value._argtypes) for name, value in vars(cls).items()
+            if isinstance(value, _CFunction)]
+
+def _register_per_instance(instance, declarations: list, dll):
+    '''Former registration done in every constructor.'''
+
+    for attribute, c_name, argtypes in declarations:
+        function = getattr(dll, c_name)
+        function.restype = CAPIStatus
+        if argtypes is not None:
+            function.argtypes = argtypes
+        setattr(instance, attribute, function)
+
+def _construct(cls, handle):
+    instance = cls(handle)
+    # Keep __del__ from destroying the shared handle
+    instance.valid = False
+    instance._handle = None
+    return instance
+
+def _best_of(statement, repeat: int, rounds: int = 5) -> float:
+    '''Best time per call in microseconds.'''
+    return min(timeit.repeat(statement, number=repeat, repeat=rounds)) / repeat * 1e6
+
+def run(repeat: int, num_atoms: int) -> dict:
+    simulation = use_simulated_api().simulation
+    declarations = {cls: _declarations(cls) for cls in WRAPPER_CLASSES}
+    dll = get_api_base().dll_instance
+
+    stimulation_factory = StimulationCommandFactory()
+    handle = stimulation_factory.create_rect_stimulation_atom(-120., 100)._handle
+
+    results = {}
+    for cls in WRAPPER_CLASSES:
+        per_instance = _best_of(lambda: _register_per_instance(_construct(cls, handle), declarations[cls], dll),
+                                repeat)
+        shared = _best_of(lambda: _construct(cls, handle), repeat)
+        results[cls.__name__] = {"c_functions": len(declarations[cls]),
+                                 "per_instance_us": per_instance,
+                                 "shared_us": shared,
+                                 "speedup": per_instance / shared}
+
+    def build_command():
+        command = stimulation_factory.create_stimulation_command()
+        function = stimulation_factory.create_stimulation_function()
+        for _ in range(num_atoms):
+            function.append(stimulation_factory.create_rect_stimulation_atom(-120., 100))
+        command.append(function)
+
+    factory = ImplantFactory()
+    external_unit_info = factory.load_external_unit_infos()[0]
+    implant_info = factory.load_implant_info(external_unit_info)
+
+    results["build_command"] = {"atoms": num_atoms, "ms": _best_of(build_command, 1) / 1e3}
+    results["enumerate_channels"] = {"channels": simulation.num_channels,
+                                     "us": _best_of(lambda: implant_info.channel_info, max(1, repeat // 100))}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of constructing the ctypes wrapper objects.")
+    parser.add_argument("--repeat", type=int, default=20000, help="Constructions per timing round.")
+    parser.add_argument("--atoms", type=int, default=500, help="Atoms of the command built in one run.")
+    parser.add_argument("--output", help="JSON file for the results (default: stdout).")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.atoms)
+    report = json.dumps({"metadata": {"timestamp": datetime.now(timezone.utc).isoformat(),
+                                      "python": platform.python_version(),
+                                      "platform": platform.platform(),
+                                      "library_version": get_library_version()},
+                         "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -13,15 +13,67 @@
 # CorTec excludes any liability for any damage caused by Licensee's 
 # use of the Software for regular medical treatment of patients.
 #######################################################################
-from pythonapi.pythonapibase import get_library_version
-from pythonapi.implantfactory import init_implant_factory, ImplantFactory
-from pythonapi.externalunitinfo import ExternalUnitInfo
-from pythonapi.implantinfo import ImplantInfo
-from pythonapi.implant import Implant
-from pythonapi.implantlistener import ImplantListener, ConnectionState, ConnectionType, Sample
-from pythonapi.channelinfo import ChannelInfo, UnitType
-
-from pythonapi.stimulationatom import StimulationAtom, AtomType
-from pythonapi.stimulationfunction import StimulationFunction
-from pythonapi.stimulationcommand import StimulationCommand
-from pythonapi.stimulationcommandfactory import StimulationCommandFactory
+'''@doctring pythonapi
+
+    Python API of the CorTec implant C api.
+
+    The public names are imported lazily (PEP 562): 'import pythonapi'
+    only defines the table below, and a submodule (and NumPy, asyncio,
+    ... with it) is imported when one of its names is first accessed.
+    Short-lived tools therefore only pay for the parts they use.
+'''
+import importlib
+
+# Public name -> submodule defining it
+_LAZY_IMPORTS = {}
+for _module, _names in (
+        ("pythonapibase", ("get_library_version",)),
+        ("implantfactory", ("init_implant_factory", "ImplantFactory")),
+        ("externalunitinfo", ("ExternalUnitInfo",)),
+        ("implantinfo", ("ImplantInfo",)),
+        ("implant", ("Implant",)),
+        ("implantlistener", ("ImplantListener", "ConnectionState", "ConnectionType", "Sample", "MeasurementMode")),
+        ("sampleblock", ("SampleBlock", "SAMPLE_NO_STIMULATION")),
+        ("dispatchinglistener", ("DispatchingListener", "OverflowPolicy")),
+        ("asynclistener", ("AsyncImplantListener", "StateEvent")),
+        ("gapdetection", ("CounterTracker", "GapFillPolicy", "GapEvent", "fill_gaps")),
+        ("stimulationevents", ("StimulationEventIndex", "STIMULATION_EVENT_DTYPE", "OFFSET_OPEN")),
+        ("instrumentation", ("CallbackInstrumentation", "LatencyHistogram")),
+        ("recorder", ("SampleRecorder", "RecordingReader", "RecordingListener")),
+        ("triggeredaverage", ("TriggeredAverager", "TriggeredAverage", "TriggeredAveragingListener")),
+        ("simulatedapi", ("SimulatedImplantAPI", "use_simulated_api")),
+        ("replay", ("ImplantReplay", "PacingMode", "ReplaySource", "replay_recording", "replay_csv")),
+        ("channelinfo", ("ChannelInfo", "UnitType", "CHANNEL_TABLE_DTYPE")),
+        ("impedancesweep", ("ImpedanceSweep", "ImpedanceCache", "ImpedanceResult")),
+        ("telemetry", ("TelemetryStore", "TELEMETRY_NAMES")),
+        ("implantsession", ("ImplantSession", "MergedSamples")),
+
+        ("stimulationatom", ("StimulationAtom", "AtomType")),
+        ("stimulationfunction", ("StimulationFunction",)),
+        ("stimulationcommand", ("StimulationCommand",)),
+        ("stimulationcommandfactory", ("StimulationCommandFactory",)),
+        ("atomarrays", ("AtomArrays",)),
+        ("waveform", ("StimulationWaveform", "render_waveform", "charge_metrics")),
+        ("stimulationcompiler", ("StimulationCompiler", "ATOM_DTYPE", "compile_stimulation_command")),
+        ("commandpool", ("StimulationCommandPool",)),
+        ("stimulationvalidator", ("StimulationValidator", "Violation", "PULSE_DTYPE", "make_pulses"))):
+    for _name in _names:
+        _LAZY_IMPORTS[_name] = "pythonapi." + _module
+del _module, _names, _name
+
+__all__ = list(_LAZY_IMPORTS)
+
+def __getattr__(name):
+    '''Import the submodule defining name on first access.'''
+
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module 'pythonapi' has no attribute '{name}'")
+
+    value = getattr(importlib.import_module(module_name), name)
+    # Later accesses find the name directly in the module dictionary
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
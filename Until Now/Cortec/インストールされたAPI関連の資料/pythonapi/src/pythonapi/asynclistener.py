@@ -0,0 +1,195 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring asynclistener
+
+    Bridge between the callbacks of the C api and asyncio.
+
+    The AsyncImplantListener is registered in block mode and passes
+    sample blocks and all other events to an asyncio event loop, where
+    they can be consumed with 'async for'. Events arriving while the
+    loop has not yet processed the previous ones are handed over
+    together, so the loop is woken up at most once per block.
+
+    Typical usage (see also Implant.stream):
+
+        async for item in implant.stream(block_ms=10):
+            if isinstance(item, SampleBlock):
+                ...
+            else:
+                ... # StateEvent
+'''
+import asyncio
+from collections import deque
+from threading import Lock
+
+from pythonapi.implantlistener import ImplantListener, ConnectionType, ConnectionState, Sample
+from pythonapi.sampleblock import SampleBlock
+
+class StateEvent():
+    '''Non-data event of the implant listener.
+
+        name is the name of the ImplantListener callback which received
+        the event (e.g. 'on_measurement_state_changed') and args the
+        tuple of arguments it was called with.
+    '''
+
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name: str, args: tuple):
+        self.name = name
+        self.args = args
+
+    def __repr__(self):
+        return f"StateEvent({self.name}, {self.args})"
+
+class AsyncImplantListener(ImplantListener):
+    '''ImplantListener making its events available as asynchronous
+        iterator on an event loop.
+
+        At most max_blocks blocks are queued. Further blocks are dropped
+        (counted in dropped_blocks) until the consumer caught up, and an
+        'on_data_processing_too_slow' StateEvent is queued once per
+        overflow. State events are never dropped.
+
+        Must be registered in block mode, individual samples passed to
+        on_data are ignored.
+    '''
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None, max_blocks: int = 64):
+        '''@param loop       (Type: asyncio.AbstractEventLoop) The loop
+                consuming the events. Defaults to the running loop.
+           @param max_blocks (Type: int) Maximum number of queued blocks.
+        '''
+
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        self._max_blocks = max_blocks
+
+        self._lock = Lock()
+        self._pending = []
+        self._wakeup_scheduled = False
+        self._num_blocks = 0
+        self._is_overflowing = False
+
+        self._items = deque()
+        self._available = asyncio.Event()
+        self._closed = False
+
+        self.dropped_blocks = 0
+        self.wakeups = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            if self._closed:
+                raise StopAsyncIteration
+            self._available.clear()
+            await self._available.wait()
+
+        item = self._items.popleft()
+        if isinstance(item, SampleBlock):
+            with self._lock:
+                self._num_blocks -= 1
+        return item
+
+    def close(self):
+        '''End the iteration once all queued items were consumed. Must
+            be called from the event loop thread.
+        '''
+
+        self._closed = True
+        self._available.set()
+
+    def _post(self, item, is_block: bool = False):
+        '''Hand an item over to the event loop. Called from the
+            callback thread of the C api.
+        '''
+
+        with self._lock:
+            if is_block:
+                if self._num_blocks >= self._max_blocks:
+                    self.dropped_blocks += 1
+                    if self._is_overflowing:
+                        return
+                    self._is_overflowing = True
+                    item = StateEvent('on_data_processing_too_slow', ())
+                else:
+                    self._is_overflowing = False
+                    self._num_blocks += 1
+
+            self._pending.append(item)
+            if self._wakeup_scheduled:
+                return
+            self._wakeup_scheduled = True
+
+        self._loop.call_soon_threadsafe(self._receive_pending)
+
+    def _receive_pending(self):
+        '''Move the items passed by the callback thread into the queue
+            of the event loop.
+        '''
+
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._wakeup_scheduled = False
+
+        self.wakeups += 1
+        self._items.extend(pending)
+        self._available.set()
+
+    def _post_event(self, name: str, *args):
+        self._post(StateEvent(name, args))
+
+    def on_stimulation_state_changed(self, is_stimulating: bool):
+        self._post_event('on_stimulation_state_changed', is_stimulating)
+
+    def on_measurement_state_changed(self, is_measuring: bool):
+        self._post_event('on_measurement_state_changed', is_measuring)
+
+    def on_connection_state_changed(self, connection_type: ConnectionType, connection_state: ConnectionState):
+        self._post_event('on_connection_state_changed', connection_type, connection_state)
+
+    def on_data(self, sample: Sample):
+        pass
+
+    def on_data_block(self, block: SampleBlock):
+        self._post(block.copy(), is_block=True)
+
+    def on_implant_voltage_changed(self, voltage_V: float):
+        self._post_event('on_implant_voltage_changed', voltage_V)
+
+    def on_primary_coil_current_changed(self, current_mA: float):
+        self._post_event('on_primary_coil_current_changed', current_mA)
+
+    def on_implant_control_value_changed(self, control_value: float):
+        self._post_event('on_implant_control_value_changed', control_value)
+
+    def on_temperature_changed(self, temperature: float):
+        self._post_event('on_temperature_changed', temperature)
+
+    def on_humidity_changed(self, humidity: float):
+        self._post_event('on_humidity_changed', humidity)
+
+    def on_error(self, error_description: str):
+        self._post_event('on_error', error_description)
+
+    def on_data_processing_too_slow(self):
+        self._post_event('on_data_processing_too_slow')
+
+    def on_stimulation_function_finished(self, num_executed_functions: int):
+        self._post_event('on_stimulation_function_finished', num_executed_functions)
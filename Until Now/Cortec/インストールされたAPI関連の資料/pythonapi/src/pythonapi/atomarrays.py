@@ -0,0 +1,132 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring atomarrays
+
+    Columnar representation of the atoms of stimulation functions and
+    commands (see StimulationFunction.to_arrays and 
+    StimulationCommand.to_arrays).
+
+    The C api can only be queried atom by atom and does not return the
+    amplitudes of an atom. Functions and commands created with the 
+    StimulationCommandFactory (or the StimulationCompiler) therefore 
+    record their atoms on the Python side when they are built, so the
+    arrays can be created without any C call. For objects of unknown 
+    content (e.g. functions returned by the command iterators) the 
+    atom types and durations are read from the C api once and the 
+    amplitudes are NaN.
+'''
+from typing import Sequence
+
+import numpy as np
+
+class AtomArrays():
+    '''Atoms of a stimulation command (or function), one entry (row) 
+        per atom in the order of execution without repetitions:
+
+        - atom_type:            AtomType of each atom (uint8).
+        - duration:             Duration of each atom in us (uint64).
+        - amplitudes:           2-D float64 array of shape 
+            (num_atoms, 4) in uA. Unused amplitudes are 0, unknown ones
+            NaN.
+        - function_index:       Index of the function holding each atom
+            (uint32).
+
+        and one entry per function:
+
+        - function_repetitions: Repetitions of each function (uint32).
+        - function_electrodes:  Tuple (source, destination, 
+            use_ground_electrode) of each function, source and 
+            destination are tuples of channel indices.
+
+        command_repetitions holds the repetitions of the command (1 for
+        a function).
+
+        The arrays are read-only, since they are cached by the objects
+        they were created from.
+    '''
+
+    __slots__ = ('atom_type', 'duration', 'amplitudes', 'function_index', 'function_repetitions',
+                 'function_electrodes', 'command_repetitions', '__weakref__')
+
+    def __init__(self, atom_type: np.ndarray, duration: np.ndarray, amplitudes: np.ndarray,
+                 function_index: np.ndarray, function_repetitions: np.ndarray, function_electrodes: tuple,
+                 command_repetitions: int = 1):
+        self.atom_type = atom_type
+        self.duration = duration
+        self.amplitudes = amplitudes
+        self.function_index = function_index
+        self.function_repetitions = function_repetitions
+        self.function_electrodes = function_electrodes
+        self.command_repetitions = command_repetitions
+
+        for array in (atom_type, duration, amplitudes, function_index, function_repetitions):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_records(cls, functions: Sequence, command_repetitions: int = 1):
+        '''Create the arrays from atom records.
+
+           @param functions           (Type: Sequence) One tuple 
+                (atom_records, repetitions, electrodes) per function, 
+                where each atom record is a tuple (atom_type, 
+                (a0, a1, a2, a3), duration) and electrodes is a tuple
+                (source, destination, use_ground_electrode).
+           @param command_repetitions (Type: int) Repetitions of the 
+                command.
+        '''
+
+        counts = [len(atom_records) for atom_records, _, _ in functions]
+        num_atoms = sum(counts)
+        records = [record for atom_records, _, _ in functions for record in atom_records]
+
+        atom_type = np.fromiter((record[0] for record in records), dtype=np.uint8, count=num_atoms)
+        duration = np.fromiter((record[2] for record in records), dtype=np.uint64, count=num_atoms)
+        amplitudes = np.array([record[1] for record in records], dtype=np.float64).reshape(num_atoms, 4)
+        function_index = np.repeat(np.arange(len(functions), dtype=np.uint32), counts)
+        function_repetitions = np.fromiter((repetitions for _, repetitions, _ in functions), dtype=np.uint32,
+                                           count=len(functions))
+        function_electrodes = tuple(electrodes for _, _, electrodes in functions)
+        return cls(atom_type, duration, amplitudes, function_index, function_repetitions, function_electrodes,
+                   command_repetitions)
+
+    def __len__(self):
+        return len(self.atom_type)
+
+    @property
+    def num_atoms(self) -> int:
+        '''Number of atoms without repetitions.'''
+        return len(self.atom_type)
+
+    @property
+    def num_functions(self) -> int:
+        '''Number of functions.'''
+        return len(self.function_repetitions)
+
+    @property
+    def function_period(self) -> np.ndarray:
+        '''Duration of one repetition of each function in us.'''
+        return np.bincount(self.function_index, weights=self.duration,
+                           minlength=self.num_functions).astype(np.uint64)
+
+    @property
+    def function_duration(self) -> np.ndarray:
+        '''Duration of each function including its repetitions in us.'''
+        return self.function_period * self.function_repetitions
+
+    @property
+    def duration_total(self) -> int:
+        '''Duration of the command including all repetitions in us.'''
+        return int(self.function_duration.sum()) * self.command_repetitions
@@ -19,8 +19,11 @@
     about individual channels.
 '''
 from ctypes import Structure, c_size_t, c_bool, c_double, POINTER, byref, c_int
+from typing import List
 
-from pythonapi.pythonapibase import _CAPIEnum, opaque_ptr, get_api_base, CAPIStatus, get_error_message
+import numpy as np
+
+from pythonapi.pythonapibase import _CAPIEnum, opaque_ptr, CAPIStatus, get_error_message, _CFunction
 
 class UnitType(_CAPIEnum):
     '''Enumeration for unit types.'''
@@ -30,6 +33,17 @@ class UnitType(_CAPIEnum):
     UT_VOLTAGE = 2
     UT_COUNT   = 3
 
+# Fields of the table returned by ImplantInfo.channel_table
+CHANNEL_TABLE_DTYPE = np.dtype([("index", np.uint32),
+                                ("can_measure", np.bool_),
+                                ("measure_value_min", np.float64),
+                                ("measure_value_max", np.float64),
+                                ("can_stimulate", np.bool_),
+                                ("stimulation_unit", np.int32),
+                                ("stimulation_value_min", np.float64),
+                                ("stimulation_value_max", np.float64),
+                                ("can_measure_impedance", np.bool_)])
+
 class _ChannelInfoVector(Structure):
     '''Vector of channel information.
   
@@ -45,48 +59,20 @@ class ChannelInfo():
     
         Use ImplantInfo to create instances!
     '''
+
+    # C functions used by this class, bound once per process (see _CFunction)
+    _channelinfo_canMeasure = _CFunction('channelinfo_canMeasure', [opaque_ptr, POINTER(c_bool)])
+    _channelinfo_getMeasureValueMin = _CFunction('channelinfo_getMeasureValueMin', [opaque_ptr, POINTER(c_double)])
+    _channelinfo_getMeasureValueMax = _CFunction('channelinfo_getMeasureValueMax', [opaque_ptr, POINTER(c_double)])
+    _channelinfo_canStimulate = _CFunction('channelinfo_canStimulate', [opaque_ptr, POINTER(c_bool)])
+    _channelinfo_getStimulationUnit = _CFunction('channelinfo_getStimulationUnit', [opaque_ptr, POINTER(c_int)])
+    _channelinfo_getStimValueMin = _CFunction('channelinfo_getStimValueMin', [opaque_ptr, POINTER(c_double)])
+    _channelinfo_getStimValueMax = _CFunction('channelinfo_getStimValueMax', [opaque_ptr, POINTER(c_double)])
+    _channelinfo_canMeasureImpedance = _CFunction('channelinfo_canMeasureImpedance', [opaque_ptr, POINTER(c_bool)])
     
     def __init__(self, handle):
         self._handle = handle
 
-        api = get_api_base()
-        self.__registerMethods(api)
-
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-
-        self._channelinfo_canMeasure = api.dll_instance.channelinfo_canMeasure
-        self._channelinfo_canMeasure.restype = CAPIStatus
-        self._channelinfo_canMeasure.argtypes = [opaque_ptr, POINTER(c_bool)]
-        
-        self._channelinfo_getMeasureValueMin = api.dll_instance.channelinfo_getMeasureValueMin
-        self._channelinfo_getMeasureValueMin.restype = CAPIStatus
-        self._channelinfo_getMeasureValueMin.argtypes = [opaque_ptr, POINTER(c_double)]
-        
-        self._channelinfo_getMeasureValueMax = api.dll_instance.channelinfo_getMeasureValueMax
-        self._channelinfo_getMeasureValueMax.restype = CAPIStatus
-        self._channelinfo_getMeasureValueMax.argtypes = [opaque_ptr, POINTER(c_double)]
-
-        self._channelinfo_canStimulate = api.dll_instance.channelinfo_canStimulate
-        self._channelinfo_canStimulate.restype = CAPIStatus
-        self._channelinfo_canStimulate.argtypes = [opaque_ptr, POINTER(c_bool)]
-        
-        self._channelinfo_getStimulationUnit = api.dll_instance.channelinfo_getStimulationUnit
-        self._channelinfo_getStimulationUnit.restype = CAPIStatus
-        self._channelinfo_getStimulationUnit.argtypes = [opaque_ptr, POINTER(c_int)]
-
-        self._channelinfo_getStimValueMin = api.dll_instance.channelinfo_getStimValueMin
-        self._channelinfo_getStimValueMin.restype = CAPIStatus
-        self._channelinfo_getStimValueMin.argtypes = [opaque_ptr, POINTER(c_double)]
-        
-        self._channelinfo_getStimValueMax = api.dll_instance.channelinfo_getStimValueMax
-        self._channelinfo_getStimValueMax.restype = CAPIStatus
-        self._channelinfo_getStimValueMax.argtypes = [opaque_ptr, POINTER(c_double)]
-
-        self._channelinfo_canMeasureImpedance = api.dll_instance.channelinfo_canMeasureImpedance
-        self._channelinfo_canMeasureImpedance.restype = CAPIStatus
-        self._channelinfo_canMeasureImpedance.argtypes = [opaque_ptr, POINTER(c_bool)]
-
     @property
     def can_measure(self) -> bool:
         '''Check if the electrode is capable of measuring electrical
@@ -224,3 +210,22 @@ class ChannelInfo():
             return result.value
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+
+def _create_channel_table(channel_infos: List[ChannelInfo]) -> np.ndarray:
+    '''Read all properties of the channels into a read-only structured
+        array with dtype CHANNEL_TABLE_DTYPE (one row per channel).
+    '''
+
+    table = np.zeros(len(channel_infos), dtype=CHANNEL_TABLE_DTYPE)
+    for index, channel_info in enumerate(channel_infos):
+        table[index] = (index,
+                        channel_info.can_measure,
+                        channel_info.measure_value_min,
+                        channel_info.measure_value_max,
+                        channel_info.can_stimulate,
+                        channel_info.stimulation_unit,
+                        channel_info.stimulation_value_min,
+                        channel_info.stimulation_value_max,
+                        channel_info.can_measure_impedance)
+    table.flags.writeable = False
+    return table
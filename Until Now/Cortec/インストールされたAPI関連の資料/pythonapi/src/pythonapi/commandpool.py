@@ -0,0 +1,254 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring commandpool
+
+    Pool of ready-made stimulation commands for low-latency triggering.
+
+    Implant.start_stimulation consumes the command it is given (the 
+    command becomes invalid), so each trigger needs a new command. The
+    StimulationCommandPool keeps a number of clones of each prepared
+    command and refills them on a background thread. Triggering then
+    only takes a clone from the pool and calls the C api once.
+
+    Typical usage:
+
+        with StimulationCommandPool(depth=4) as pool:
+            key = pool.prepare(spec)    # see stimulationcompiler
+            ...
+            pool.trigger(implant, key)
+'''
+from collections import deque
+from copy import deepcopy
+from threading import Condition, Thread
+from time import perf_counter_ns
+from typing import Dict, Union
+
+from pythonapi.instrumentation import LatencyHistogram
+from pythonapi.stimulationcommand import StimulationCommand
+from pythonapi.stimulationcompiler import StimulationCompiler, normalize_spec
+
+def _key(spec) -> tuple:
+    '''Key of a specification, keys returned by prepare are passed 
+        through.
+    '''
+    return spec if isinstance(spec, tuple) else normalize_spec(spec)
+
+class _PoolEntry():
+    '''Master command and ready clones of one specification.'''
+
+    __slots__ = ('master', 'ready')
+
+    def __init__(self, master: StimulationCommand):
+        self.master = master
+        self.ready = deque()
+
+class StimulationCommandPool():
+    '''Keeps depth ready clones of each prepared command.
+
+        Commands are identified by their specification (dict or JSON
+        text, see stimulationcompiler) or by the key returned by 
+        prepare, which saves normalizing the specification on each 
+        trigger. Clones are created with the C
+        clone function (StimulationCommand.__deepcopy__); __copy__ would
+        only share the handle of the master command. If a pool is empty
+        when a command is requested, the clone is created on the calling
+        thread and counted as miss.
+    '''
+
+    def __init__(self, depth: int = 4, compiler: StimulationCompiler = None):
+        '''Create the pool and start its replenishing thread.
+
+           @param depth    (Type: int) Number of ready clones kept per 
+                command.
+           @param compiler (Type: StimulationCompiler) Compiler building
+                the commands. A new one is created if not given.
+        '''
+
+        if depth < 1:
+            raise ValueError("depth must be at least 1.")
+
+        self._depth = depth
+        self._compiler = compiler if compiler is not None else StimulationCompiler()
+        self._entries: Dict[tuple, _PoolEntry] = {}
+        self._condition = Condition()
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.replenished = 0
+        self.replenish_errors = 0
+        self.last_error = None
+        self.replenish_latency = LatencyHistogram()
+
+        self._worker = Thread(target=self._replenish, name="StimulationCommandPool", daemon=True)
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self, timeout: float = None):
+        '''Stop the replenishing thread and release the pooled commands.
+
+           @param timeout (Type: float) Maximum time in seconds to wait
+                for the thread.
+        '''
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join(timeout)
+
+        with self._condition:
+            self._entries.clear()
+
+    def prepare(self, spec: Union[dict, str]) -> tuple:
+        '''Compile a command and fill its pool. Does nothing if the 
+            command was already prepared. Returns the key of the 
+            command.
+
+           @param spec (Type: dict or str) The command specification.
+        '''
+
+        key = normalize_spec(spec)
+        self._entry(key)
+        return key
+
+    def acquire(self, spec: Union[dict, str]) -> StimulationCommand:
+        '''Take a ready command from the pool. Prepares the command if 
+            necessary.
+
+           @param spec (Type: dict, str or tuple) The command 
+                specification or its key.
+        '''
+
+        key = _key(spec)
+        with self._condition:
+            entry = self._entries.get(key)
+            if entry is not None and entry.ready:
+                command = entry.ready.popleft()
+                self.hits += 1
+                self._condition.notify()
+                return command
+
+        entry = self._entry(key)
+        with self._condition:
+            self.misses += 1
+            self._condition.notify()
+        return deepcopy(entry.master)
+
+    def trigger(self, implant, spec: Union[dict, str]):
+        '''Start the stimulation of a pooled command on the implant.
+
+           @param implant (Type: Implant) The implant to stimulate with.
+           @param spec    (Type: dict, str or tuple) The command 
+                specification or its key.
+        '''
+
+        implant.start_stimulation(self.acquire(spec))
+
+    def discard(self, spec: Union[dict, str]):
+        '''Remove a command and its clones from the pool.
+
+           @param spec (Type: dict, str or tuple) The command 
+                specification or its key.
+        '''
+
+        with self._condition:
+            self._entries.pop(_key(spec), None)
+
+    @property
+    def statistics(self) -> Dict[str, float]:
+        '''Counters of the pool.
+
+            - hits:              Commands taken from the pool.
+            - misses:            Commands cloned on the calling thread.
+            - replenished:       Clones created by the background thread.
+            - replenish_errors:  Failed clones.
+            - ready:             Clones currently in the pool.
+            - commands:          Number of prepared commands.
+            - replenish_latency: Summary of the time per clone (see 
+                LatencyHistogram.summary).
+        '''
+
+        with self._condition:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "replenished": self.replenished,
+                    "replenish_errors": self.replenish_errors,
+                    "ready": sum(len(entry.ready) for entry in self._entries.values()),
+                    "commands": len(self._entries),
+                    "replenish_latency": self.replenish_latency.summary()}
+
+    def _entry(self, key: tuple) -> _PoolEntry:
+        '''Get the entry of a command, compiling the command if it is 
+            not yet in the pool.
+        '''
+
+        with self._condition:
+            entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+
+        master = self._compiler.compile(key)
+        with self._condition:
+            # Another thread may have prepared the same command meanwhile
+            entry = self._entries.setdefault(key, _PoolEntry(master))
+            self._condition.notify()
+        return entry
+
+    def _next_empty_slot(self) -> _PoolEntry:
+        '''Entry missing the most clones or None if all are full. 
+            Requires the lock.
+        '''
+
+        result = None
+        for entry in self._entries.values():
+            if len(entry.ready) < self._depth and (result is None or len(entry.ready) < len(result.ready)):
+                result = entry
+        return result
+
+    def _replenish(self):
+        '''Main loop of the replenishing thread.'''
+
+        condition = self._condition
+        while True:
+            with condition:
+                entry = self._next_empty_slot()
+                while entry is None and not self._closed:
+                    condition.wait()
+                    entry = self._next_empty_slot()
+                if self._closed:
+                    return
+
+            start = perf_counter_ns()
+            try:
+                command = deepcopy(entry.master)
+            except Exception as e:
+                with condition:
+                    self.replenish_errors += 1
+                    self.last_error = e
+                    # Do not spin on a command that cannot be cloned
+                    condition.wait(0.1)
+                continue
+            elapsed = perf_counter_ns() - start
+
+            with condition:
+                self.replenish_latency.record(elapsed)
+                self.replenished += 1
+                entry.ready.append(command)
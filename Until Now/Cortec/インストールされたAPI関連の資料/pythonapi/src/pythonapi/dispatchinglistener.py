@@ -0,0 +1,322 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring dispatchinglistener
+
+    Listener wrapper decoupling the callback thread of the C api from
+    the processing in Python.
+
+    The callbacks of the C api are executed on its internal thread. A
+    slow handler therefore delays the acquisition itself. The
+    DispatchingListener only stores each event in a bounded queue and
+    returns; a dedicated consumer thread drains the queue in batches
+    and calls the wrapped listener.
+
+    Typical usage:
+    1. Wrap the listener: dispatcher = DispatchingListener(listener)
+    2. Register the dispatcher: implant.register_listener(dispatcher)
+    3. Call dispatcher.close() after unregistering the listener.
+'''
+from collections import deque
+from enum import IntEnum
+from threading import Condition, Lock, Thread
+from typing import Dict
+
+import numpy as np
+
+from pythonapi.implantlistener import ImplantListener, ConnectionType, ConnectionState, Sample
+from pythonapi.sampleblock import SampleBlock
+
+class OverflowPolicy(IntEnum):
+    '''Enumeration defining what happens if data arrives while the
+        queue is full.
+
+        - OVERFLOW_BLOCK:       The callback thread waits until the
+            consumer made room. This stalls the C api.
+        - OVERFLOW_DROP_OLDEST: The oldest queued data event is
+            discarded.
+        - OVERFLOW_DROP_NEWEST: The arriving data event is discarded.
+    '''
+
+    OVERFLOW_BLOCK = 0
+    OVERFLOW_DROP_OLDEST = 1
+    OVERFLOW_DROP_NEWEST = 2
+
+class _SpscQueue():
+    '''Bounded queue for one producer and one consumer thread.
+
+        Only items put with bounded=True count against the capacity and
+        are subject to the overflow policy. Other items (state changes,
+        errors) are always accepted so that they cannot get lost.
+    '''
+
+    def __init__(self, capacity: int, overflow_policy: OverflowPolicy):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+
+        self._items = deque()
+        self._capacity = capacity
+        self._overflow_policy = OverflowPolicy(overflow_policy)
+        self._num_bounded = 0
+        self._closed = False
+
+        lock = Lock()
+        self._not_empty = Condition(lock)
+        self._not_full = Condition(lock)
+
+        self.enqueued = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.blocked = 0
+        self.high_water_mark = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, bounded: bool = True) -> bool:
+        '''Add an item. Returns False if an item was dropped.'''
+
+        dropped = False
+
+        with self._not_full:
+            if bounded:
+                if self._num_bounded >= self._capacity:
+                    if self._overflow_policy == OverflowPolicy.OVERFLOW_DROP_NEWEST:
+                        self.dropped_newest += 1
+                        return False
+                    elif self._overflow_policy == OverflowPolicy.OVERFLOW_DROP_OLDEST:
+                        self._drop_oldest_bounded()
+                        dropped = True
+                    else:
+                        self.blocked += 1
+                        while self._num_bounded >= self._capacity and not self._closed:
+                            self._not_full.wait()
+                self._num_bounded += 1
+
+            self._items.append((bounded, item))
+            self.enqueued += 1
+            if self._num_bounded > self.high_water_mark:
+                self.high_water_mark = self._num_bounded
+            self._not_empty.notify()
+
+        return not dropped
+
+    def _drop_oldest_bounded(self):
+        '''Remove the oldest bounded item. Requires the lock.'''
+
+        for index, (bounded, _) in enumerate(self._items):
+            if bounded:
+                del self._items[index]
+                self._num_bounded -= 1
+                self.dropped_oldest += 1
+                return
+
+    def get_batch(self, max_items: int, timeout: float = None):
+        '''Remove and return up to max_items items. Waits for at least
+            one item unless the queue is closed or timeout (in seconds)
+            expired, in which case the returned list may be empty.
+        '''
+
+        with self._not_empty:
+            if not self._items and not self._closed:
+                self._not_empty.wait(timeout)
+
+            batch = []
+            while self._items and len(batch) < max_items:
+                bounded, item = self._items.popleft()
+                if bounded:
+                    self._num_bounded -= 1
+                batch.append(item)
+
+            if batch:
+                self._not_full.notify()
+            return batch
+
+    def close(self):
+        '''Wake up all waiting threads. Queued items can still be read.'''
+
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+class DispatchingListener(ImplantListener):
+    '''ImplantListener forwarding all events to another listener on a
+        dedicated consumer thread.
+
+        Measurement data (on_data and on_data_block) is subject to the
+        overflow policy, all other events are always delivered. The
+        wrapped listener's on_data_processing_too_slow is called if the
+        C api reports it, which now only happens if the queue blocks
+        (OVERFLOW_BLOCK), and additionally once whenever data starts
+        being dropped because the consumer cannot keep up.
+
+        Samples whose measurements are views into the C sample
+        (MeasurementMode.MEASUREMENT_VIEW) and blocks are copied before
+        they are queued, since the originals are only valid during the
+        callback.
+    '''
+
+    def __init__(self, listener: ImplantListener, capacity: int = 4096,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.OVERFLOW_DROP_OLDEST, batch_size: int = 256):
+        '''Create the dispatcher and start its consumer thread.
+
+           @param listener        (Type: ImplantListener) The listener
+                receiving the events on the consumer thread.
+           @param capacity        (Type: int) Maximum number of queued
+                data events (samples or blocks).
+           @param overflow_policy (Type: OverflowPolicy) Behavior if the
+                queue is full.
+           @param batch_size      (Type: int) Maximum number of events
+                processed per queue access of the consumer.
+        '''
+
+        self._listener = listener
+        self._queue = _SpscQueue(capacity, overflow_policy)
+        self._batch_size = batch_size
+
+        self._is_overflowing = False
+        self.delivered = 0
+        self.too_slow_events = 0
+        self.handler_errors = 0
+        self.last_error = None
+
+        self._consumer = Thread(target=self._consume, name="DispatchingListener", daemon=True)
+        self._consumer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self, timeout: float = None):
+        '''Deliver the remaining events and stop the consumer thread.
+
+           @param timeout (Type: float) Maximum time in seconds to wait
+                for the consumer thread.
+        '''
+
+        self._queue.close()
+        self._consumer.join(timeout)
+
+    @property
+    def statistics(self) -> Dict[str, int]:
+        '''Counters of the dispatcher.
+
+            - enqueued:        Events added to the queue.
+            - delivered:       Events passed to the wrapped listener.
+            - dropped_oldest:  Queued data events discarded.
+            - dropped_newest:  Arriving data events discarded.
+            - blocked:         Times the callback thread had to wait.
+            - high_water_mark: Maximum number of queued data events.
+            - queued:          Events currently queued.
+            - too_slow_events: Reported on_data_processing_too_slow
+                events.
+            - handler_errors:  Exceptions raised by the wrapped listener.
+        '''
+
+        queue = self._queue
+        return {"enqueued": queue.enqueued,
+                "delivered": self.delivered,
+                "dropped_oldest": queue.dropped_oldest,
+                "dropped_newest": queue.dropped_newest,
+                "blocked": queue.blocked,
+                "high_water_mark": queue.high_water_mark,
+                "queued": len(queue),
+                "too_slow_events": self.too_slow_events,
+                "handler_errors": self.handler_errors}
+
+    def _consume(self):
+        '''Main loop of the consumer thread.'''
+
+        queue = self._queue
+        while True:
+            batch = queue.get_batch(self._batch_size)
+            if not batch:
+                if queue.closed:
+                    return
+                continue
+
+            for handler, args in batch:
+                try:
+                    handler(*args)
+                except Exception as e:
+                    self.handler_errors += 1
+                    self.last_error = e
+            self.delivered += len(batch)
+
+            if self._is_overflowing and len(queue) < queue.capacity // 2:
+                self._is_overflowing = False
+
+    def _put_data(self, handler, args):
+        '''Queue a data event and report an overflow once per episode.'''
+
+        if not self._queue.put((handler, args)) and not self._is_overflowing:
+            self._is_overflowing = True
+            self.too_slow_events += 1
+            self._queue.put((self._listener.on_data_processing_too_slow, ()), bounded=False)
+
+    def on_stimulation_state_changed(self, is_stimulating: bool):
+        self._queue.put((self._listener.on_stimulation_state_changed, (is_stimulating,)), bounded=False)
+
+    def on_measurement_state_changed(self, is_measuring: bool):
+        self._queue.put((self._listener.on_measurement_state_changed, (is_measuring,)), bounded=False)
+
+    def on_connection_state_changed(self, connection_type: ConnectionType, connection_state: ConnectionState):
+        self._queue.put((self._listener.on_connection_state_changed, (connection_type, connection_state)),
+                        bounded=False)
+
+    def on_data(self, sample: Sample):
+        measurements = sample.measurements
+        if isinstance(measurements, np.ndarray) and not measurements.flags.owndata:
+            sample.measurements = measurements.copy()
+        self._put_data(self._listener.on_data, (sample,))
+
+    def on_data_block(self, block: SampleBlock):
+        self._put_data(self._listener.on_data_block, (block.copy(),))
+
+    def on_implant_voltage_changed(self, voltage_V: float):
+        self._queue.put((self._listener.on_implant_voltage_changed, (voltage_V,)), bounded=False)
+
+    def on_primary_coil_current_changed(self, current_mA: float):
+        self._queue.put((self._listener.on_primary_coil_current_changed, (current_mA,)), bounded=False)
+
+    def on_implant_control_value_changed(self, control_value: float):
+        self._queue.put((self._listener.on_implant_control_value_changed, (control_value,)), bounded=False)
+
+    def on_temperature_changed(self, temperature: float):
+        self._queue.put((self._listener.on_temperature_changed, (temperature,)), bounded=False)
+
+    def on_humidity_changed(self, humidity: float):
+        self._queue.put((self._listener.on_humidity_changed, (humidity,)), bounded=False)
+
+    def on_error(self, error_description: str):
+        self._queue.put((self._listener.on_error, (error_description,)), bounded=False)
+
+    def on_data_processing_too_slow(self):
+        self.too_slow_events += 1
+        self._queue.put((self._listener.on_data_processing_too_slow, ()), bounded=False)
+
+    def on_stimulation_function_finished(self, num_executed_functions: int):
+        self._queue.put((self._listener.on_stimulation_function_finished, (num_executed_functions,)), bounded=False)
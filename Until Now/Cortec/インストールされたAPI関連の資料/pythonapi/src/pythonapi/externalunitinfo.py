@@ -17,8 +17,8 @@
 
     Information about the external unit.
 '''
-from ctypes import create_string_buffer, c_size_t, Structure, POINTER, byref, pointer
-from pythonapi.pythonapibase import get_api_base, CAPIStatus, c_size_t_ptr, opaque_ptr, get_error_message
+from ctypes import c_size_t, Structure, POINTER, byref, pointer
+from pythonapi.pythonapibase import CAPIStatus, opaque_ptr, get_error_message, _CFunction, _buffers
 
 class _ExternalUnitInfoVector(Structure):
     '''Ctype for an external unit info vector.'''
@@ -33,24 +33,15 @@ class ExternalUnitInfo():
         Create instances using the implant factory!
     '''
 
+    # C functions used by this class, bound once per process (see _CFunction)
+    _externalunitinfo_getImplantType = _CFunction('externalunitinfo_getImplantType')
+    _externalunitinfo_getDeviceId = _CFunction('externalunitinfo_getDeviceId')
+    _externalunitinfo_getFirmwareVersion = _CFunction('externalunitinfo_getFirmwareVersion')
+    _externalunitinfos_destroy = _CFunction('externalunitinfos_destroy', [POINTER(_ExternalUnitInfoVector)])
+
     def __init__(self, handle):
         self._handle = handle
 
-        api = get_api_base()
-
-        self._externalunitinfo_getImplantType = api.dll_instance.externalunitinfo_getImplantType
-        self._externalunitinfo_getImplantType.restype = CAPIStatus
-
-        self._externalunitinfo_getDeviceId = api.dll_instance.externalunitinfo_getDeviceId
-        self._externalunitinfo_getDeviceId.restype = CAPIStatus
-        
-        self._externalunitinfo_getFirmwareVersion = api.dll_instance.externalunitinfo_getFirmwareVersion
-        self._externalunitinfo_getFirmwareVersion.restype = CAPIStatus
-
-        self._externalunitinfos_destroy = api.dll_instance.externalunitinfos_destroy 
-        self._externalunitinfos_destroy.restype = CAPIStatus
-        self._externalunitinfos_destroy.argtypes = [POINTER(_ExternalUnitInfoVector)]
-
     def __del__(self):
         '''Destroys the handle individually by wrapping it in an
             external unit vector.
@@ -66,14 +57,10 @@ class ExternalUnitInfo():
             This property is read-only.
         '''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._externalunitinfo_getImplantType(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._externalunitinfo_getImplantType, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -85,14 +72,10 @@ class ExternalUnitInfo():
             This property is read-only.
         '''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._externalunitinfo_getDeviceId(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._externalunitinfo_getDeviceId, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -103,13 +86,9 @@ class ExternalUnitInfo():
             This property is read-only.
         '''
         
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._externalunitinfo_getFirmwareVersion(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._externalunitinfo_getFirmwareVersion, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
\ No newline at end of file
@@ -0,0 +1,267 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring gapdetection
+
+    Detection of lost samples based on Sample.measurement_counter.
+
+    The implant increases the measurement counter by one for each
+    sample and wraps around at 2^32. Missing counter values therefore
+    tell how many samples were lost between two received samples. The
+    CounterTracker keeps statistics of these gaps and fill_gaps inserts
+    placeholder samples so that blocks are continuous again.
+'''
+from enum import IntEnum
+from typing import Dict, List
+
+import numpy as np
+
+from pythonapi.sampleblock import SampleBlock, SAMPLE_NO_STIMULATION
+
+COUNTER_MODULO = 2 ** 32
+
+# Counter differences larger than this are treated as a counter reset
+# or out-of-order delivery instead of lost samples
+_MAX_GAP = 2 ** 31
+
+# Largest gap filled with placeholders by fill_gaps. Larger gaps (e.g.
+# after a reconnect) would allocate a huge block on the callback thread
+MAX_GAP_FILL = 2 ** 16
+
+class GapFillPolicy(IntEnum):
+    '''Enumeration of the values used for the measurements of missing
+        samples.
+
+        - GAP_FILL_NAN:       Not-a-number.
+        - GAP_FILL_HOLD_LAST: Measurements of the last received sample.
+        - GAP_FILL_ZERO:      Zero.
+    '''
+
+    GAP_FILL_NAN = 0
+    GAP_FILL_HOLD_LAST = 1
+    GAP_FILL_ZERO = 2
+
+class GapEvent():
+    '''Information about one gap in the sample stream.
+
+        - position:         Number of samples received before the gap.
+        - last_counter:     Counter of the last sample before the gap.
+        - next_counter:     Counter of the first sample after the gap.
+        - num_missing:      Number of lost samples.
+    '''
+
+    __slots__ = ('position', 'last_counter', 'next_counter', 'num_missing')
+
+    def __init__(self, position: int, last_counter: int, next_counter: int, num_missing: int):
+        self.position = position
+        self.last_counter = last_counter
+        self.next_counter = next_counter
+        self.num_missing = num_missing
+
+    def __repr__(self):
+        return f"GapEvent(position={self.position}, last_counter={self.last_counter}, " \
+               f"next_counter={self.next_counter}, num_missing={self.num_missing})"
+
+class CounterTracker():
+    '''Tracks the continuity of the measurement counter.
+
+        Use update for single samples and update_block for blocks. Both
+        handle the wrap-around of the counter. A jump backwards (e.g.
+        after the measurement was restarted) is counted as reset and
+        not as gap.
+    '''
+
+    def __init__(self, max_gap_events: int = 1024):
+        '''@param max_gap_events (Type: int) Number of most recent gap
+                events to keep.
+        '''
+
+        self._max_gap_events = max_gap_events
+        self.reset()
+
+    def reset(self):
+        '''Forget the last counter and clear the statistics.'''
+
+        self._last_counter = None
+        self.total_received = 0
+        self.total_missing = 0
+        self.largest_gap = 0
+        self.num_gaps = 0
+        self.num_resets = 0
+        self.gap_events: List[GapEvent] = []
+
+    def restart(self):
+        '''Forget the last counter but keep the statistics, e.g. when
+            a new measurement is started.
+        '''
+
+        self._last_counter = None
+
+    def _record_gap(self, position: int, last_counter: int, next_counter: int, num_missing: int):
+        self.total_missing += num_missing
+        self.num_gaps += 1
+        if num_missing > self.largest_gap:
+            self.largest_gap = num_missing
+        self.gap_events.append(GapEvent(position, last_counter, next_counter, num_missing))
+        if len(self.gap_events) > self._max_gap_events:
+            del self.gap_events[0]
+
+    def update(self, counter: int) -> int:
+        '''Process the counter of one sample and return the number of
+            samples missing before it.
+        '''
+
+        last_counter = self._last_counter
+        self._last_counter = counter
+        self.total_received += 1
+
+        if last_counter is None:
+            return 0
+
+        num_missing = (counter - last_counter - 1) % COUNTER_MODULO
+        if num_missing == 0:
+            return 0
+        if num_missing >= _MAX_GAP:
+            self.num_resets += 1
+            return 0
+
+        self._record_gap(self.total_received - 1, last_counter, counter, num_missing)
+        return num_missing
+
+    def update_block(self, counters: np.ndarray) -> np.ndarray:
+        '''Process the counters of a block.
+
+            Returns None if the block continues the stream without gaps
+            and otherwise an array holding the number of samples missing
+            before each sample of the block.
+        '''
+
+        num_samples = len(counters)
+        if num_samples == 0:
+            return None
+
+        position = self.total_received
+        first = int(counters[0])
+        previous = self._last_counter if self._last_counter is not None else (first - 1) % COUNTER_MODULO
+        self._last_counter = int(counters[-1])
+        self.total_received += num_samples
+
+        # Fast path: uint32 differences wrap around like the counter itself
+        if (first - previous) % COUNTER_MODULO == 1 and np.all(np.diff(counters) == 1):
+            return None
+
+        extended = np.empty(num_samples + 1, dtype=np.int64)
+        extended[0] = previous
+        extended[1:] = counters
+        missing = (np.diff(extended) - 1) % COUNTER_MODULO
+
+        resets = missing >= _MAX_GAP
+        if np.any(resets):
+            self.num_resets += int(np.count_nonzero(resets))
+            missing[resets] = 0
+
+        gap_indices = np.flatnonzero(missing)
+        if len(gap_indices) == 0:
+            return None
+
+        for index in gap_indices:
+            self._record_gap(position + int(index), int(extended[index]), int(extended[index + 1]), int(missing[index]))
+        return missing
+
+    @property
+    def statistics(self) -> Dict[str, int]:
+        '''Running statistics of the tracker.
+
+            - total_received: Number of received samples.
+            - total_missing:  Number of lost samples.
+            - largest_gap:    Largest number of consecutive lost samples.
+            - num_gaps:       Number of gaps.
+            - num_resets:     Number of counter jumps backwards.
+        '''
+
+        return {"total_received": self.total_received,
+                "total_missing": self.total_missing,
+                "largest_gap": self.largest_gap,
+                "num_gaps": self.num_gaps,
+                "num_resets": self.num_resets}
+
+def fill_gaps(block: SampleBlock, missing: np.ndarray, policy: GapFillPolicy,
+              last_measurements: np.ndarray = None, max_fill: int = MAX_GAP_FILL) -> SampleBlock:
+    '''Create a new block with placeholder samples inserted into the
+        gaps reported by CounterTracker.update_block.
+
+        Inserted samples get consecutive counters, no stimulation id and
+        the flag SampleBlock.FLAG_IS_GAP_FILL. Their supply voltage and
+        states are copied from the preceding sample. Gaps of more than
+        max_fill samples are not filled, instead the sample following
+        such a gap gets the flag SampleBlock.FLAG_IS_DISCONTINUITY.
+
+       @param block             (Type: SampleBlock) The received block.
+       @param missing           (Type: numpy.ndarray) Number of samples
+            missing before each sample of the block.
+       @param policy            (Type: GapFillPolicy) Values used for the
+            measurements of the inserted samples.
+       @param last_measurements (Type: numpy.ndarray) Measurements of the
+            sample preceding the block, used by GAP_FILL_HOLD_LAST for a
+            gap at the start of the block. NaN is used if not given.
+       @param max_fill          (Type: int) Largest gap filled with
+            placeholders.
+    '''
+
+    num_samples = len(block)
+    missing = missing.astype(np.int64)
+    is_discontinuity = missing > max_fill
+    missing[is_discontinuity] = 0
+    positions = np.arange(num_samples) + np.cumsum(missing)
+    total = num_samples + int(missing.sum())
+
+    # Index of the received sample preceding each output row (-1: before the block)
+    source = np.full(total, -1, dtype=np.int64)
+    source[positions] = np.arange(num_samples)
+    source = np.maximum.accumulate(source)
+    is_fill = np.ones(total, dtype=bool)
+    is_fill[positions] = False
+
+    result = SampleBlock.empty(total, block.num_measurements, block.measurements.dtype)
+    result.host_timestamp = block.host_timestamp
+    result.measurements[positions] = block.measurements
+
+    fill_rows = np.flatnonzero(is_fill)
+    fill_source = source[fill_rows]
+    if policy == GapFillPolicy.GAP_FILL_HOLD_LAST:
+        held = block.measurements[np.maximum(fill_source, 0)]
+        before_block = fill_source < 0
+        if np.any(before_block):
+            held[before_block] = last_measurements if last_measurements is not None else np.nan
+        result.measurements[fill_rows] = held
+    elif policy == GapFillPolicy.GAP_FILL_ZERO:
+        result.measurements[fill_rows] = 0.
+    else:
+        result.measurements[fill_rows] = np.nan
+
+    neighbour = np.where(source < 0, 0, source)
+    result.supply_voltage_mV[:] = block.supply_voltage_mV[neighbour]
+    result.flags[:] = block.flags[neighbour]
+    result.flags[fill_rows] |= SampleBlock.FLAG_IS_GAP_FILL
+    result.stimulation_id[:] = SAMPLE_NO_STIMULATION
+    result.stimulation_id[positions] = block.stimulation_id
+
+    # Inserted samples count backwards from the next received sample
+    next_received = fill_source + 1
+    result.measurement_counter[positions] = block.measurement_counter
+    result.measurement_counter[fill_rows] = (block.measurement_counter[next_received].astype(np.int64) \
+                                             - (positions[next_received] - fill_rows)) % COUNTER_MODULO
+    result.flags[positions[is_discontinuity]] |= SampleBlock.FLAG_IS_DISCONTINUITY
+    return result
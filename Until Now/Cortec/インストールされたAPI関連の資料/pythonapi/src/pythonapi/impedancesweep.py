@@ -0,0 +1,243 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring impedancesweep
+
+    Impedance measurement of several channels on a worker thread.
+
+    Implant.calculate_impedance blocks for each channel and is only 
+    possible while neither measurement nor stimulation is running. An
+    ImpedanceSweep measures a list of channels one after the other on
+    its own thread, reports the progress, can be cancelled between two
+    channels and stores timestamped results in an ImpedanceCache. 
+    Channels with a result younger than max_age_s are not measured 
+    again.
+
+    Typical usage:
+
+        sweep = implant.start_impedance_sweep(max_age_s=600, 
+                                              on_progress=print)
+        ...
+        results = sweep.wait()      # channel -> ImpedanceResult
+'''
+from threading import Event, Lock, Thread
+from time import time
+from typing import Callable, Dict, List, Sequence
+
+class ImpedanceResult():
+    '''Impedance of one channel.
+
+        - channel:   The channel index.
+        - impedance: Impedance as returned by 
+            Implant.calculate_impedance, None if the measurement failed.
+        - timestamp: Time of the measurement (time.time()).
+        - error:     Error message if the measurement failed, else None.
+    '''
+
+    __slots__ = ('channel', 'impedance', 'timestamp', 'error')
+
+    def __init__(self, channel: int, impedance: float, timestamp: float, error: str = None):
+        self.channel = channel
+        self.impedance = impedance
+        self.timestamp = timestamp
+        self.error = error
+
+    def __repr__(self):
+        return f"ImpedanceResult(channel={self.channel}, impedance={self.impedance}, " \
+               f"timestamp={self.timestamp}, error={self.error!r})"
+
+    @property
+    def age_s(self) -> float:
+        '''Seconds since the measurement.'''
+        return time() - self.timestamp
+
+class ImpedanceCache():
+    '''Latest successful impedance result of each channel, per device 
+        (ImplantInfo.device_id).
+    '''
+
+    def __init__(self):
+        self._results: Dict[str, Dict[int, ImpedanceResult]] = {}
+        self._lock = Lock()
+
+    def store(self, device_id: str, result: ImpedanceResult):
+        '''Store a successful result. Failed measurements are ignored.'''
+
+        if result.error is not None:
+            return
+        with self._lock:
+            self._results.setdefault(device_id, {})[result.channel] = result
+
+    def get(self, device_id: str, channel: int, max_age_s: float = None) -> ImpedanceResult:
+        '''Get the result of a channel or None if there is none (younger
+            than max_age_s).
+
+           @param device_id (Type: str)   Id of the implant.
+           @param channel   (Type: int)   The channel index.
+           @param max_age_s (Type: float) Maximum age of the result.
+        '''
+
+        with self._lock:
+            result = self._results.get(device_id, {}).get(channel)
+        if result is None or (max_age_s is not None and result.age_s > max_age_s):
+            return None
+        return result
+
+    def results(self, device_id: str) -> Dict[int, ImpedanceResult]:
+        '''All results of a device by channel.'''
+
+        with self._lock:
+            return dict(self._results.get(device_id, {}))
+
+    def stale_channels(self, device_id: str, channels: Sequence[int], max_age_s: float = None) -> List[int]:
+        '''Channels without a result younger than max_age_s. All 
+            channels if max_age_s is None.
+        '''
+
+        if max_age_s is None:
+            return list(channels)
+        return [channel for channel in channels if self.get(device_id, channel, max_age_s) is None]
+
+    def clear(self, device_id: str = None):
+        '''Remove the results of one device or of all devices.'''
+
+        with self._lock:
+            if device_id is None:
+                self._results.clear()
+            else:
+                self._results.pop(device_id, None)
+
+# Cache used by sweeps without an explicit cache
+default_cache = ImpedanceCache()
+
+class ImpedanceSweep():
+    '''Measures the impedance of several channels on a worker thread.
+
+        The sweep refuses to start (RuntimeError) and stops before the 
+        next channel if the implant is known to measure or stimulate 
+        (see Implant.is_measuring and Implant.is_stimulating). If the 
+        state is unknown, the C api reports the error of each channel.
+        A failed channel is recorded with its error and the sweep 
+        continues.
+    '''
+
+    def __init__(self, implant, channels: Sequence[int] = None, max_age_s: float = None,
+                 cache: ImpedanceCache = None, on_progress: Callable[[int, int, ImpedanceResult], None] = None):
+        '''@param implant     (Type: Implant) The implant.
+           @param channels    (Type: Sequence[int]) Channels to measure.
+                All channels able to measure impedance if not given.
+           @param max_age_s   (Type: float) Channels with a cached result
+                younger than this are skipped. All channels are measured
+                if None.
+           @param cache       (Type: ImpedanceCache) Cache for the 
+                results, the module's default_cache if not given.
+           @param on_progress (Type: Callable) Called on the worker 
+                thread after each channel with the number of measured 
+                channels, the number of channels to measure and the
+                result.
+        '''
+
+        implant_info = implant.implant_info
+        if channels is None:
+            table = implant_info.channel_table
+            channels = table["index"][table["can_measure_impedance"]].tolist()
+
+        self._implant = implant
+        self.device_id = implant_info.device_id
+        self._cache = cache if cache is not None else default_cache
+        self.channels = self._cache.stale_channels(self.device_id, channels, max_age_s)
+        self._on_progress = on_progress
+
+        self.results: Dict[int, ImpedanceResult] = {}
+        self.error = None
+        self._cancelled = Event()
+        self._worker = None
+
+    @property
+    def cache(self) -> ImpedanceCache:
+        '''The cache holding the results.'''
+        return self._cache
+
+    @property
+    def is_running(self) -> bool:
+        '''True while the worker thread measures.'''
+        return self._worker is not None and self._worker.is_alive()
+
+    @property
+    def is_cancelled(self) -> bool:
+        '''True if cancel was called.'''
+        return self._cancelled.is_set()
+
+    @property
+    def progress(self) -> float:
+        '''Fraction of the channels measured (1 if there are none).'''
+        return len(self.results) / len(self.channels) if self.channels else 1.
+
+    def _check_idle(self):
+        # An unknown state (None) is left to the C api to check
+        if self._implant.is_measuring or self._implant.is_stimulating:
+            raise RuntimeError("Impedance measurement is only possible while no measurement or stimulation "
+                               "is running.")
+
+    def start(self):
+        '''Start the worker thread. Raises RuntimeError if the implant 
+            measures or stimulates.
+        '''
+
+        if self._worker is not None:
+            raise RuntimeError("The sweep was already started.")
+        self._check_idle()
+
+        self._worker = Thread(target=self._run, name="ImpedanceSweep", daemon=True)
+        self._worker.start()
+        return self
+
+    def cancel(self):
+        '''Stop the sweep after the channel currently measured.'''
+        self._cancelled.set()
+
+    def wait(self, timeout: float = None) -> Dict[int, ImpedanceResult]:
+        '''Wait until the sweep finished and return the results by 
+            channel.
+
+           @param timeout (Type: float) Maximum time to wait in seconds.
+        '''
+
+        if self._worker is not None:
+            self._worker.join(timeout)
+        return dict(self.results)
+
+    def _run(self):
+        '''Main loop of the worker thread.'''
+
+        total = len(self.channels)
+        for channel in self.channels:
+            if self._cancelled.is_set():
+                return
+            try:
+                self._check_idle()
+            except RuntimeError as e:
+                self.error = e
+                return
+
+            try:
+                result = ImpedanceResult(channel, self._implant.calculate_impedance(channel), time())
+            except RuntimeError as e:
+                result = ImpedanceResult(channel, None, time(), str(e))
+
+            self.results[channel] = result
+            self._cache.store(self.device_id, result)
+            if self._on_progress is not None:
+                self._on_progress(len(self.results), total, result)
@@ -25,11 +25,14 @@
      the commands fails (e.g. missing connection).
 '''
 
-from ctypes import POINTER, pointer, byref, c_bool, c_uint32, c_size_t, c_double, Structure, create_string_buffer
+from ctypes import POINTER, pointer, byref, c_bool, c_uint32, c_size_t, c_double, Structure
 from typing import List
 
-from pythonapi.pythonapibase import get_api_base, CAPIStatus, _Opaque, opaque_ptr, _CAPIUint32Set, get_error_message, c_size_t_ptr
-from pythonapi.implantlistener import _ImplantListener, ImplantListener
+from pythonapi.pythonapibase import CAPIStatus, _Opaque, opaque_ptr, _CAPIUint32Set, get_error_message, _CFunction, _buffers
+from pythonapi.implantlistener import _ImplantListener, ImplantListener, MeasurementMode
+from pythonapi.gapdetection import GapFillPolicy
+from pythonapi.instrumentation import CallbackInstrumentation
+from pythonapi.telemetry import TelemetryStore
 from pythonapi.implantinfo import ImplantInfo
 from pythonapi.stimulationcommand import StimulationCommand
 
@@ -39,75 +42,36 @@ class Implant():
        Create instances using the implant factory!
     '''
 
+    # C functions used by this class, bound once per process (see _CFunction)
+    _implant_registerListener = _CFunction('implant_registerListener', [opaque_ptr, opaque_ptr])
+    _implant_unregisterListener = _CFunction('implant_unregisterListener', [opaque_ptr])
+    _implant_getImplantInfo = _CFunction('implant_getImplantInfo', [opaque_ptr, POINTER(opaque_ptr)])
+    _implant_startMeasurement = _CFunction('implant_startMeasurement', [opaque_ptr, _CAPIUint32Set])
+    _implant_stopMeasurement = _CFunction('implant_stopMeasurement', [opaque_ptr])
+    _implant_getImpedance = _CFunction('implant_getImpedance', [opaque_ptr, c_uint32, POINTER(c_double)])
+    _implant_getTemperature = _CFunction('implant_getTemperature', [opaque_ptr, POINTER(c_double)])
+    _implant_getHumidity = _CFunction('implant_getHumidity', [opaque_ptr, POINTER(c_double)])
+    _implant_isStimulationCommandValid = _CFunction('implant_isStimulationCommandValid')
+    _implant_startStimulation = _CFunction('implant_startStimulation', [opaque_ptr, opaque_ptr])
+    _implant_stopStimulation = _CFunction('implant_stopStimulation', [opaque_ptr])
+    _implant_setImplantPower = _CFunction('implant_setImplantPower', [opaque_ptr, c_bool])
+    _implant_implant_pushState = _CFunction('implant_pushState', [opaque_ptr])
+    _implant_destroy = _CFunction('implant_destroy', [POINTER(opaque_ptr)])
+
     def __init__(self, handle):
-        api = get_api_base()
         self._handle = handle
-        self.__registerMethods(api)
 
         self._listener = None
+        self._telemetry = TelemetryStore()
+        self._is_measuring = False
+        self._is_stimulating = False
 
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-        
-        self._implant_registerListener = api.dll_instance.implant_registerListener
-        self._implant_registerListener.restype = CAPIStatus
-        self._implant_registerListener.argtypes = [opaque_ptr, opaque_ptr]
-
-        self._implant_unregisterListener = api.dll_instance.implant_unregisterListener
-        self._implant_unregisterListener.restype = CAPIStatus
-        self._implant_unregisterListener.argtypes = [opaque_ptr]
-
-        self._implant_getImplantInfo = api.dll_instance.implant_getImplantInfo
-        self._implant_getImplantInfo.restype = CAPIStatus
-        self._implant_getImplantInfo.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-
-        self._implant_startMeasurement = api.dll_instance.implant_startMeasurement
-        self._implant_startMeasurement.restype = CAPIStatus
-        self._implant_startMeasurement.argtypes = [opaque_ptr, _CAPIUint32Set]
-
-        self._implant_stopMeasurement = api.dll_instance.implant_stopMeasurement
-        self._implant_stopMeasurement.restype = CAPIStatus
-        self._implant_stopMeasurement.argtypes = [opaque_ptr]
-
-        self._implant_getImpedance = api.dll_instance.implant_getImpedance
-        self._implant_getImpedance.restype = CAPIStatus
-        self._implant_getImpedance.argtypes = [opaque_ptr, c_uint32, POINTER(c_double)]
-
-        self._implant_getTemperature = api.dll_instance.implant_getTemperature
-        self._implant_getTemperature.restype = CAPIStatus
-        self._implant_getTemperature.argtypes = [opaque_ptr, POINTER(c_double)]
-
-        self._implant_getHumidity = api.dll_instance.implant_getHumidity
-        self._implant_getHumidity.restype = CAPIStatus
-        self._implant_getHumidity.argtypes = [opaque_ptr, POINTER(c_double)]
-
-        self._implant_isStimulationCommandValid = api.dll_instance.implant_isStimulationCommandValid
-        self._implant_isStimulationCommandValid.restype = CAPIStatus
-
-        self._implant_startStimulation = api.dll_instance.implant_startStimulation
-        self._implant_startStimulation.restype = CAPIStatus
-        self._implant_startStimulation.argtypes = [opaque_ptr, opaque_ptr]
-
-        self._implant_stopStimulation = api.dll_instance.implant_stopStimulation
-        self._implant_stopStimulation.restype = CAPIStatus
-        self._implant_stopStimulation.argtypes = [opaque_ptr]
-
-        self._implant_setImplantPower = api.dll_instance.implant_setImplantPower
-        self._implant_setImplantPower.restype = CAPIStatus
-        self._implant_setImplantPower.argtypes = [opaque_ptr, c_bool]
-
-        self._implant_implant_pushState = api.dll_instance.implant_pushState
-        self._implant_implant_pushState.restype = CAPIStatus
-        self._implant_implant_pushState.argtypes = [opaque_ptr]
-
-        self._implant_destroy = api.dll_instance.implant_destroy
-        self._implant_destroy.restype = CAPIStatus
-        self._implant_destroy.argtypes = [POINTER(opaque_ptr)]
-        
     def __del__(self):
         self._implant_destroy(byref(self._handle))
 
-    def register_listener(self, listener: ImplantListener):
+    def register_listener(self, listener: ImplantListener, block_size: int = None, block_interval_ms: float = None,
+                          measurement_mode: MeasurementMode = MeasurementMode.MEASUREMENT_LIST,
+                          gap_fill: GapFillPolicy = None, instrumentation: CallbackInstrumentation = None):
         '''Register listener object, which is notified on arrival of 
             new data and errors. 
         
@@ -116,28 +80,198 @@ class Implant():
             On consecutive calls only the latest registered listener
             will be notified.
 
-           @param listener (Type: ImplantListener) The listener 
+            If block_size or block_interval_ms is given, the listener
+            is registered in block mode: samples are copied into a 
+            preallocated ring buffer and passed to on_data_block every
+            block_size samples or every block_interval_ms milliseconds,
+            whichever comes first. on_data is not called in block mode.
+
+            measurement_mode selects how Sample.measurements is passed to
+            on_data. MEASUREMENT_ARRAY and MEASUREMENT_VIEW avoid creating
+            one Python float per channel, see MeasurementMode for how long
+            the data stays valid.
+
+            The continuity of Sample.measurement_counter is tracked for
+            every listener, see gap_statistics. In block mode, gap_fill
+            additionally inserts placeholder samples for lost samples 
+            so that blocks passed to on_data_block are continuous. Gaps
+            larger than gapdetection.MAX_GAP_FILL are only marked with 
+            SampleBlock.FLAG_IS_DISCONTINUITY.
+
+            If instrumentation is given, call counts and handler 
+            durations of all callbacks are recorded in it. Without
+            instrumentation the callbacks are not wrapped.
+
+           @param listener          (Type: ImplantListener) The listener 
                 instance to be registered on the implant.
+           @param block_size        (Type: int)   Maximum number of
+                samples per block.
+           @param block_interval_ms (Type: float) Maximum time span
+                covered by a block in milliseconds.
+           @param measurement_mode  (Type: MeasurementMode) 
+                Representation of the measurements passed to on_data.
+           @param gap_fill          (Type: GapFillPolicy)
+                Measurement values inserted for lost samples in block 
+                mode. No samples are inserted if None.
+           @param instrumentation   (Type: CallbackInstrumentation)
+                Statistics collector for the callback execution.
         '''
-        new_listener = _ImplantListener(listener)
+        new_listener = _ImplantListener(listener, block_size, block_interval_ms, measurement_mode, gap_fill,
+                                        instrumentation, self._telemetry)
         status = self._implant_registerListener(self._handle, new_listener._handle)
 
         if status == CAPIStatus.STATUS_OK:
+            new_listener.is_measuring = self.is_measuring
+            new_listener.is_stimulating = self.is_stimulating
             self._listener = new_listener
         else:
             del new_listener
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
+    async def stream(self, block_ms: float = 10., max_blocks: int = 64, block_size: int = None):
+        '''Asynchronous iterator over the measurement data and events
+            of the implant.
+
+            Registers an AsyncImplantListener in block mode, which 
+            replaces a previously registered listener, and yields 
+            SampleBlock instances and StateEvent instances for all 
+            other callbacks. The listener is unregistered once the
+            iteration is left. Measurement still has to be started
+            with start_measurement.
+
+            Usage: 'async for item in implant.stream(block_ms=10):'
+
+           @param block_ms   (Type: float) Maximum time span covered by
+                a block in milliseconds.
+           @param max_blocks (Type: int)   Maximum number of blocks 
+                queued for the consumer before blocks are dropped.
+           @param block_size (Type: int)   Maximum number of samples 
+                per block.
+        '''
+
+        # Imported here since asyncio is only needed for streaming
+        from pythonapi.asynclistener import AsyncImplantListener
+
+        listener = AsyncImplantListener(max_blocks=max_blocks)
+        self.register_listener(listener, block_size=block_size, block_interval_ms=block_ms)
+        try:
+            async for item in listener:
+                yield item
+        finally:
+            if self._listener is not None and self._listener._py_listener is listener:
+                self.unregister_listener()
+
     def unregister_listener(self):
         '''Unregister listener object from an implant handle.'''
 
         status = self._implant_unregisterListener(self._handle)
 
         if status == CAPIStatus.STATUS_OK:
+            self._is_measuring = self.is_measuring
+            # The end of a running stimulation is not reported anymore
+            self._is_stimulating = None if self.is_stimulating else False
             self._listener = None
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
+    @property
+    def gap_statistics(self):
+        '''Statistics about lost samples of the registered listener 
+            (see CounterTracker.statistics) or None if no listener is 
+            registered. The recent gaps are available via
+            gap_events.
+        
+            This property is read-only.
+        '''
+
+        if self._listener is None:
+            return None
+        return self._listener.counter_tracker.statistics
+
+    @property
+    def gap_events(self):
+        '''List of the most recent GapEvent instances of the registered
+            listener or None if no listener is registered.
+        
+            This property is read-only.
+        '''
+
+        if self._listener is None:
+            return None
+        return list(self._listener.counter_tracker.gap_events)
+
+    def _set_state(self, is_measuring: bool = None, is_stimulating: bool = None):
+        '''Record a state change caused by a call of this object.'''
+
+        listener = self._listener
+        if is_measuring is not None:
+            self._is_measuring = is_measuring
+            if listener is not None:
+                listener.is_measuring = is_measuring
+        if is_stimulating is not None:
+            if listener is not None:
+                self._is_stimulating = is_stimulating
+                listener.is_stimulating = is_stimulating
+            else:
+                # Without listener the end of a finite command is not
+                # reported, so a started stimulation is only known to
+                # run until then
+                self._is_stimulating = None if is_stimulating else False
+
+    @property
+    def is_measuring(self) -> bool:
+        '''True if a measurement is running, as reported by the 
+            listener or, without listener, as started and stopped 
+            through this object.
+        
+            This property is read-only.
+        '''
+
+        listener = self._listener
+        if listener is not None and listener.is_measuring is not None:
+            return bool(listener.is_measuring)
+        return self._is_measuring
+
+    @property
+    def is_stimulating(self) -> bool:
+        '''True if a stimulation is running, as reported by the 
+            listener. Without listener the end of a stimulation is not
+            noticed: after start_stimulation (or unregistering the 
+            listener during a stimulation) the state is unknown (None)
+            until stop_stimulation is called or a listener reports it.
+        
+            This property is read-only.
+        '''
+
+        listener = self._listener
+        if listener is not None and listener.is_stimulating is not None:
+            return bool(listener.is_stimulating)
+        return self._is_stimulating
+
+    @property
+    def telemetry(self):
+        '''TelemetryStore holding the telemetry values reported to the
+            registered listeners without blocking calls. The same store
+            is used for all listeners registered on the implant, it 
+            stays empty while no listener is registered.
+        
+            This property is read-only.
+        '''
+        return self._telemetry
+
+    @property
+    def stimulation_events(self):
+        '''StimulationEventIndex of the registered listener, holding the
+            stimulations found in the received samples, or None if no 
+            listener is registered.
+        
+            This property is read-only.
+        '''
+
+        if self._listener is None:
+            return None
+        return self._listener.stimulation_events
+
     @property
     def implant_info(self) -> ImplantInfo:
         '''Get information about the implant.
@@ -173,6 +307,7 @@ class Implant():
 
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+        self._set_state(is_measuring=True)
         
     def stop_measurement(self):
         '''Stops measurement of data.'''
@@ -181,6 +316,7 @@ class Implant():
 
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+        self._set_state(is_measuring=False)
 
     def calculate_impedance(self, channel: int) -> float:
         '''Starts impedance measurement of one channel. This is a
@@ -200,10 +336,32 @@ class Implant():
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
+    def start_impedance_sweep(self, channels: List[int] = None, max_age_s: float = None, cache=None,
+                              on_progress=None):
+        '''Measure the impedance of several channels on a worker thread,
+            see ImpedanceSweep. Returns the started ImpedanceSweep.
+
+           @param channels    (Type: List[int]) Channels to measure. All
+                channels able to measure impedance if not given.
+           @param max_age_s   (Type: float) Skip channels with a cached 
+                result younger than this.
+           @param cache       (Type: ImpedanceCache) Cache for the 
+                results, impedancesweep.default_cache if not given.
+           @param on_progress (Type: Callable) Called after each channel
+                with (num_done, num_channels, ImpedanceResult).
+        '''
+
+        # Imported here since the sweep is rarely needed
+        from pythonapi.impedancesweep import ImpedanceSweep
+
+        return ImpedanceSweep(self, channels, max_age_s, cache, on_progress).start()
+
     @property
     def temperature(self) -> float:
         '''Measures the temperature within implant capsule. This is a
-            blocking call. It will stop running measurements.
+            blocking call. It will stop running measurements. The 
+            values reported to the listener are available without 
+            blocking in telemetry.
         
             This property is read-only.
         '''
@@ -220,7 +378,9 @@ class Implant():
     @property
     def humidity(self) -> float:
         '''Measures the humidity within implant capsule. This is a 
-            blocking call. It will stop running measurements.
+            blocking call. It will stop running measurements. The 
+            values reported to the listener are available without 
+            blocking in telemetry.
         
             This property is read-only.
         '''
@@ -244,15 +404,13 @@ class Implant():
                                 empty string if the command is valid.
         '''
         
-        buffer_size = 256
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
         result = c_bool(False)
 
-        status = self._implant_isStimulationCommandValid(self._handle, command._handle, byref(result), buffer, buffer_size, string_length_ptr)
+        status, message = _buffers.call_string(self._implant_isStimulationCommandValid, self._handle, command._handle,
+                                               byref(result))
 
         if status == CAPIStatus.STATUS_OK:
-            return result.value, buffer.value.decode("utf-8")
+            return result.value, message
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -269,6 +427,7 @@ class Implant():
 
         if status == CAPIStatus.STATUS_OK:
             command.valid = False
+            self._set_state(is_stimulating=True)
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
         
@@ -279,6 +438,7 @@ class Implant():
 
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+        self._set_state(is_stimulating=False)
 
     def set_implant_power(self, enabled: bool):
         '''Enable or disable power transfer to the implant (enabled
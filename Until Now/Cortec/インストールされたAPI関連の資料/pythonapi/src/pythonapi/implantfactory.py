@@ -29,7 +29,7 @@
 from ctypes import create_string_buffer, c_size_t, c_bool, POINTER, pointer, byref 
 from typing import List
 
-from pythonapi.pythonapibase import get_api_base, CAPIStatus, opaque_ptr, _Opaque, get_error_message
+from pythonapi.pythonapibase import get_api_base, CAPIStatus, opaque_ptr, _Opaque, get_error_message, _CFunction, _bind, _buffers
 from pythonapi.externalunitinfo import ExternalUnitInfo, _ExternalUnitInfoVector
 from pythonapi.implantinfo import ImplantInfo
 from pythonapi.implant import Implant
@@ -46,8 +46,7 @@ def init_implant_factory(enable_logging: bool, file_name: str):
 
     api = get_api_base()
 
-    implantfactory_init = api.dll_instance.implantfactory_init
-    implantfactory_init.restype = CAPIStatus
+    implantfactory_init = _bind('implantfactory_init')
 
     buffer_length = len(file_name)
     buffer = create_string_buffer(buffer_length)
@@ -59,61 +58,38 @@ def init_implant_factory(enable_logging: bool, file_name: str):
         raise RuntimeError(f"{status.name}: {api.error_message}")
 
 class ImplantFactory():
-    def __init__(self):
-        api = get_api_base()
+    # C functions used by this class, bound once per process (see _CFunction)
+    _implantfactory_getExternalUnitInfos = \
+        _CFunction('implantfactory_getExternalUnitInfos', [opaque_ptr, POINTER(_ExternalUnitInfoVector)])
+    _implantfactory_getImplantInfo = \
+        _CFunction('implantfactory_getImplantInfo', [opaque_ptr, opaque_ptr, POINTER(opaque_ptr)])
+    _implantfactory_isResponsibleFactory = \
+        _CFunction('implantfactory_isResponsibleFactory', [opaque_ptr, opaque_ptr, POINTER(c_bool)])
+    _implantfactory_create = \
+        _CFunction('implantfactory_create', [opaque_ptr, opaque_ptr, opaque_ptr, POINTER(opaque_ptr)])
 
-        implantfactory_getFactoryHandle = api.dll_instance.implantfactory_getFactoryHandle
-        implantfactory_getFactoryHandle.restype = CAPIStatus
-        implantfactory_getFactoryHandle.argtypes = [POINTER(opaque_ptr)]
+    def __init__(self):
+        implantfactory_getFactoryHandle = _bind('implantfactory_getFactoryHandle', [POINTER(opaque_ptr)])
 
         self._handle = pointer(_Opaque())
 
-        vector_size = 127
-        vector_t = POINTER(_Opaque) * vector_size
-        self._external_unit_infos = _ExternalUnitInfoVector(c_size_t(vector_size), pointer(vector_t()[0]))
-
         status = implantfactory_getFactoryHandle(byref(self._handle))
 
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"Could not create an implant factory due to error: {status.name}")
 
-        self.__registerMethods(api)
-
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-
-        self._implantfactory_getExternalUnitInfos = api.dll_instance.implantfactory_getExternalUnitInfos
-        self._implantfactory_getExternalUnitInfos.restype = CAPIStatus
-        self._implantfactory_getExternalUnitInfos.argtypes = [opaque_ptr, POINTER(_ExternalUnitInfoVector)]
-        
-        self._implantfactory_getImplantInfo = api.dll_instance.implantfactory_getImplantInfo
-        self._implantfactory_getImplantInfo.restype = CAPIStatus
-        self._implantfactory_getImplantInfo.argtypes = [opaque_ptr, opaque_ptr, POINTER(opaque_ptr)]
-                
-        self._implantfactory_isResponsibleFactory = api.dll_instance.implantfactory_isResponsibleFactory
-        self._implantfactory_isResponsibleFactory.restype = CAPIStatus
-        self._implantfactory_isResponsibleFactory.argtypes = [opaque_ptr, opaque_ptr, POINTER(c_bool)]
-                        
-        self._implantfactory_create = api.dll_instance.implantfactory_create
-        self._implantfactory_create.restype = CAPIStatus
-        self._implantfactory_create.argtypes = [opaque_ptr, opaque_ptr, opaque_ptr, POINTER(opaque_ptr)]
-        
     def load_external_unit_infos(self) -> List[ExternalUnitInfo]:
         '''Method for discovering the available external units
             connected to the system.
         '''
 
-        status = self._implantfactory_getExternalUnitInfos(self._handle, byref(self._external_unit_infos))
+        status, handles = _buffers.call_handle_vector(self._implantfactory_getExternalUnitInfos,
+                                                      _ExternalUnitInfoVector, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return self._convert_to_external_unit_infos()
+            return [ExternalUnitInfo(handle) for handle in handles]
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
-
-    def _convert_to_external_unit_infos(self):
-        '''Convert the C data structure to python objects.'''
-
-        return [ExternalUnitInfo(self._external_unit_infos.vector[i]) for i in range(self._external_unit_infos.count)]
         
     def load_implant_info(self, ext_unit_info: ExternalUnitInfo) -> ImplantInfo:
         '''Method for discovering the connected implant of an
@@ -17,9 +17,12 @@
 
     Information about the implant including channel info.
 '''
-from ctypes import create_string_buffer, c_size_t, pointer, byref, POINTER, c_uint32
-from pythonapi.pythonapibase import get_api_base, CAPIStatus, c_size_t_ptr, opaque_ptr, _Opaque, get_error_message
-from pythonapi.channelinfo import _ChannelInfoVector, ChannelInfo
+from ctypes import c_size_t, byref, POINTER, c_uint32
+
+import numpy as np
+
+from pythonapi.pythonapibase import CAPIStatus, c_size_t_ptr, opaque_ptr, get_error_message, _CFunction, _buffers
+from pythonapi.channelinfo import _ChannelInfoVector, ChannelInfo, _create_channel_table
 
 class ImplantInfo():
     '''Class holding information about a connected implant.
@@ -27,43 +30,22 @@ class ImplantInfo():
         Create instances using the implant factory!
     '''
 
+    # C functions used by this class, bound once per process (see _CFunction)
+    _implantinfo_getFirmwareVersion = _CFunction('implantinfo_getFirmwareVersion')
+    _implantinfo_getDeviceType = _CFunction('implantinfo_getDeviceType')
+    _implantinfo_getDeviceId = _CFunction('implantinfo_getDeviceId')
+    _implantinfo_getChannelInfo = _CFunction('implantinfo_getChannelInfo', [opaque_ptr, POINTER(_ChannelInfoVector)])
+    _implantinfo_getChannelCount = _CFunction('implantinfo_getChannelCount', [opaque_ptr, c_size_t_ptr])
+    _implantinfo_getMeasurementChannelCount = \
+        _CFunction('implantinfo_getMeasurementChannelCount', [opaque_ptr, c_size_t_ptr])
+    _implantinfo_getStimulationChannelCount = \
+        _CFunction('implantinfo_getStimulationChannelCount', [opaque_ptr, c_size_t_ptr])
+    _implantinfo_getSamplingRate = _CFunction('implantinfo_getSamplingRate', [opaque_ptr, POINTER(c_uint32)])
+    _implantinfo_destroy = _CFunction('implantinfo_destroy', [POINTER(opaque_ptr)])
+
     def __init__(self, handle):
         self._handle = handle
-
-        api = get_api_base()
-        
-        self._implantinfo_getFirmwareVersion = api.dll_instance.implantinfo_getFirmwareVersion
-        self._implantinfo_getFirmwareVersion.restype = CAPIStatus
-
-        self._implantinfo_getDeviceType = api.dll_instance.implantinfo_getDeviceType
-        self._implantinfo_getDeviceType.restype = CAPIStatus
-
-        self._implantinfo_getDeviceId = api.dll_instance.implantinfo_getDeviceId
-        self._implantinfo_getDeviceId.restype = CAPIStatus
-
-        self._implantinfo_getChannelInfo = api.dll_instance.implantinfo_getChannelInfo 
-        self._implantinfo_getChannelInfo.restype = CAPIStatus
-        self._implantinfo_getChannelInfo.argtypes = [opaque_ptr, POINTER(_ChannelInfoVector)]
-
-        self._implantinfo_getChannelCount = api.dll_instance.implantinfo_getChannelCount 
-        self._implantinfo_getChannelCount.restype = CAPIStatus
-        self._implantinfo_getChannelCount.argtypes = [opaque_ptr, c_size_t_ptr]
-
-        self._implantinfo_getMeasurementChannelCount = api.dll_instance.implantinfo_getMeasurementChannelCount 
-        self._implantinfo_getMeasurementChannelCount.restype = CAPIStatus
-        self._implantinfo_getMeasurementChannelCount.argtypes = [opaque_ptr, c_size_t_ptr]
-
-        self._implantinfo_getStimulationChannelCount = api.dll_instance.implantinfo_getStimulationChannelCount 
-        self._implantinfo_getStimulationChannelCount.restype = CAPIStatus
-        self._implantinfo_getStimulationChannelCount.argtypes = [opaque_ptr, c_size_t_ptr]
-
-        self._implantinfo_getSamplingRate = api.dll_instance.implantinfo_getSamplingRate 
-        self._implantinfo_getSamplingRate.restype = CAPIStatus
-        self._implantinfo_getSamplingRate.argtypes = [opaque_ptr, POINTER(c_uint32)]
-
-        self._implantinfo_destroy = api.dll_instance.implantinfo_destroy 
-        self._implantinfo_destroy.restype = CAPIStatus
-        self._implantinfo_destroy.argtypes = [POINTER(opaque_ptr)]
+        self._channel_table = None
 
     def __del__(self):
         if self._handle is not None:
@@ -76,14 +58,10 @@ class ImplantInfo():
             This property is read-only.
         '''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._implantinfo_getFirmwareVersion(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._implantinfo_getFirmwareVersion, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -94,14 +72,10 @@ class ImplantInfo():
             This property is read-only.
         '''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._implantinfo_getDeviceType(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._implantinfo_getDeviceType, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
     
@@ -112,14 +86,10 @@ class ImplantInfo():
             This property is read-only.
         '''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._implantinfo_getDeviceId(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._implantinfo_getDeviceId, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
     
@@ -130,28 +100,32 @@ class ImplantInfo():
             This property is read-only.
         '''
         
-        vector_size = 127
-        vector_t = POINTER(_Opaque) * vector_size
-        channel_info_vector = _ChannelInfoVector(c_size_t(vector_size), pointer(vector_t()[0]))
-
-        status = self._implantinfo_getChannelInfo(self._handle, byref(channel_info_vector))
+        status, handles = _buffers.call_handle_vector(self._implantinfo_getChannelInfo, _ChannelInfoVector,
+                                                      self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return self._convert_to_channel_infos(channel_info_vector)
+            return [ChannelInfo(handle) for handle in handles]
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
-    def _convert_to_channel_infos(self, info_vector):
-        '''Convert the C data structure to python objects'''
+    @property
+    def channel_table(self) -> np.ndarray:
+        '''Get the capabilities of all channels as read-only NumPy
+            structured array with one row per channel and the fields of
+            channelinfo.CHANNEL_TABLE_DTYPE, e.g.
+            
+                table = implant_info.channel_table
+                stimulation_channels = table["index"][table["can_stimulate"]]
 
-        if info_vector.count > 0:
-            result = []
-            for i in range(info_vector.count):
-                channel_info = ChannelInfo(info_vector.vector[i])
-                result.append(channel_info)
-            return result
-        else:
-            return []
+            The channel information is read from the C api on first
+            access only and then kept for the lifetime of this object.
+
+            This property is read-only.
+        '''
+
+        if self._channel_table is None:
+            self._channel_table = _create_channel_table(self.channel_info)
+        return self._channel_table
     
     @property
     def channel_count(self) -> int:
@@ -13,11 +13,21 @@
 # CorTec excludes any liability for any damage caused by Licensee's 
 # use of the Software for regular medical treatment of patients.
 #######################################################################
-from ctypes import CFUNCTYPE, Structure, c_bool, c_double, c_char_p, c_uint16, c_uint32, c_uint64, c_int, POINTER, pointer, byref
+from ctypes import CFUNCTYPE, Structure, c_bool, c_double, c_char_p, c_uint16, c_uint32, c_uint64, c_int, c_void_p, \
+                   POINTER, pointer, byref, addressof
 from abc import ABCMeta, abstractmethod
-from typing import List
+from enum import IntEnum
+from typing import List, Union
 
-from pythonapi.pythonapibase import _Opaque, opaque_ptr, get_api_base, CAPIStatus, _CAPIEnum
+import numpy as np
+
+from pythonapi.pythonapibase import _Opaque, opaque_ptr, CAPIStatus, _CAPIEnum, _CFunction, get_error_message
+from pythonapi.sampleblock import SampleBlock, SAMPLE_NO_STIMULATION
+from pythonapi.samplebuffer import _SampleRingBuffer
+from pythonapi.gapdetection import CounterTracker, GapFillPolicy, fill_gaps, MAX_GAP_FILL
+from pythonapi.stimulationevents import StimulationEventIndex
+from pythonapi.telemetry import TelemetryStore
+from pythonapi.instrumentation import CallbackInstrumentation, CALLBACK_NAMES
 
 class Sample():
     '''Measurement data read by the implant at one point in time,
@@ -34,13 +44,22 @@ class Sample():
             (all channels available).
         - Id of the stimulation which starts with this sample. If no
             stimulation started with this sample, then the
-            stimulationNumber is IMPLANT_NO_STIMULATION.
+            stimulationNumber is SAMPLE_NO_STIMULATION.
         - Information whether the stimulation is active.
         - Counter that is increased for each measurement sample starting with 0.
             The value range is [0, 4294967295] (i.e. 2^32 - 1). If the maximum
             value is exceeded the counter will be reset automatically.
+
+        Depending on the MeasurementMode the listener was registered
+        with, measurements is a list or a NumPy array.
+
+        For buffering many samples use SampleBlock, which stores the
+        same information column-wise without one object per sample.
     '''
-    def __init__(self, num_measurements: int, measurements: List[float], supply_voltage_mV: int, \
+    __slots__ = ('num_measurements', 'measurements', 'supply_voltage_mV', 'is_connected', 'stimulation_id',
+                 'is_stimulation_active', 'measurement_counter')
+
+    def __init__(self, num_measurements: int, measurements: Union[List[float], np.ndarray], supply_voltage_mV: int, \
                  is_connected: bool, stimulation_id: int, is_stimulation_active: bool, measurement_counter: int):
         self.num_measurements = num_measurements
         self.measurements = measurements
@@ -61,6 +80,44 @@ class _CtypesSample(Structure):
                 ("isStimulationActive",  c_bool),
                 ("measurementCounter",   c_uint32)]
 
+class MeasurementMode(IntEnum):
+    '''Enumeration for the representation of Sample.measurements.
+
+        - MEASUREMENT_LIST:  List of floats (one Python object per 
+            channel).
+        - MEASUREMENT_ARRAY: NumPy array created with one bulk copy
+            from the C sample.
+        - MEASUREMENT_VIEW:  NumPy array viewing the memory of the C
+            sample without copying. The view is only valid until 
+            on_data returns, since the C api releases the sample 
+            afterwards. Copy it (e.g. with numpy.array) to keep it.
+    '''
+
+    MEASUREMENT_LIST = 0
+    MEASUREMENT_ARRAY = 1
+    MEASUREMENT_VIEW = 2
+
+# ctypes array types used to view the measurements, indexed by channel count
+_measurement_array_types = {}
+_measurements_offset = _CtypesSample.measurements.offset
+
+def _measurement_view(c_sample: _CtypesSample) -> np.ndarray:
+    '''Create a NumPy array viewing the measurements of a C sample.
+
+        The view shares the memory of the C sample and thus is only 
+        valid while the C sample is valid, i.e. until the callback 
+        which received it returns.
+    '''
+
+    num_measurements = c_sample.numberOfMeasurements
+    array_type = _measurement_array_types.get(num_measurements)
+    if array_type is None:
+        array_type = _measurement_array_types.setdefault(num_measurements, c_double * num_measurements)
+
+    # Reading the raw pointer value avoids creating a ctypes pointer object
+    address = c_void_p.from_address(addressof(c_sample) + _measurements_offset).value
+    return np.frombuffer(array_type.from_address(address), dtype=np.float64)
+
 class ConnectionType(_CAPIEnum):
     ''' Enumeration for different connections. 
 
@@ -157,11 +214,27 @@ class ImplantListener(metaclass=ABCMeta):
         '''Callback receiving measurement data.
 
            Important: Once the callback returns the pointed sample is
-           no longer valid!
+           no longer valid! This includes sample.measurements if the
+           listener was registered with MeasurementMode.MEASUREMENT_VIEW.
 
            @param sample (Type: Sample) One measurement sample.
         '''
         raise NotImplementedError
+
+    def on_data_block(self, block: SampleBlock):
+        '''Callback receiving measurement data in blocks of samples.
+
+           Only called instead of on_data if the listener was registered
+           in block mode (see Implant.register_listener).
+
+           Important: The arrays of the block are views into a ring
+           buffer which is reused for later samples. Use block.copy()
+           to keep the data after the callback returned.
+
+           @param block (Type: SampleBlock) Consecutive measurement
+                samples.
+        '''
+        raise NotImplementedError
     
     @abstractmethod
     def on_implant_voltage_changed(self, voltage_V: float):
@@ -245,41 +318,91 @@ class ImplantListener(metaclass=ABCMeta):
         '''
         raise NotImplementedError
 
-class _ImplantListener():
-    def __init__(self, listener: ImplantListener):
-        api = get_api_base()
-
-        implant_createListener = api.dll_instance.implant_createListener
-        implant_createListener.restype = CAPIStatus
-        implant_createListener.argtypes = [POINTER(_CTypesImplantListener), POINTER(opaque_ptr)]
+# Maximum number of samples per block if only a block interval is given
+_DEFAULT_BLOCK_SIZE = 1024
 
-        self._implant_destroyListener = api.dll_instance.implant_destroyListener
-        self._implant_destroyListener.restype = CAPIStatus
-        self._implant_destroyListener.argtypes = [POINTER(opaque_ptr)]
+class _ListenerBridge():
+    '''Ctypes listener structure whose callbacks convert the C arguments
+        and call a python listener. It is not registered with the C api
+        by itself, see _ImplantListener.
+    '''
 
-        self._handle = pointer(_Opaque())
+    def __init__(self, listener: ImplantListener, block_size: int = None, block_interval_ms: float = None,
+                 measurement_mode: MeasurementMode = MeasurementMode.MEASUREMENT_LIST, gap_fill: GapFillPolicy = None,
+                 instrumentation: CallbackInstrumentation = None, telemetry: TelemetryStore = None):
         self._py_listener = listener
-        self._ctypes_listener = self.connect_listener_methods()
+        self._measurement_mode = MeasurementMode(measurement_mode)
+
+        self.counter_tracker = CounterTracker()
+        self.stimulation_events = StimulationEventIndex()
+        # Shared by all listeners of an implant, so that the history 
+        # survives registering another listener
+        self.telemetry = telemetry if telemetry is not None else TelemetryStore()
+        # States reported by the C api, None until the first report
+        self.is_measuring = None
+        self.is_stimulating = None
+        self._gap_fill = gap_fill
+        self._last_measurements = None
+        self.instrumentation = instrumentation
+
+        if block_size is not None or block_interval_ms is not None:
+            self._sample_buffer = _SampleRingBuffer(block_size or _DEFAULT_BLOCK_SIZE, block_interval_ms,
+                                                    self._deliver_block)
+        else:
+            self._sample_buffer = None
 
-        status = implant_createListener(byref(self._ctypes_listener), byref(self._handle))
+        self._ctypes_listener = self.connect_listener_methods()
 
-        if status != CAPIStatus.STATUS_OK:
-            self._handle = None
-            raise RuntimeError(f"{status.name}: {api.error_message}")
+    def _deliver_block(self, block: SampleBlock):
+        '''Check a completed block for lost samples and pass it to the
+            python listener.
+        '''
 
-    def __del__(self):
-        if self._handle is not None:
-            self._implant_destroyListener(byref(self._handle))
+        tracker = self.counter_tracker
+        first_position = tracker.total_received + tracker.total_missing
+        missing = tracker.update_block(block.measurement_counter)
+        if self._gap_fill is not None:
+            if missing is not None:
+                block = fill_gaps(block, missing, self._gap_fill, self._last_measurements)
+                # Gaps too large to be filled remain in the stream
+                unfilled = missing[missing > MAX_GAP_FILL]
+                if len(unfilled) > 0:
+                    missing = np.zeros(len(block), dtype=np.int64)
+                    missing[block.is_discontinuity] = unfilled
+                else:
+                    missing = None
+            self._last_measurements = block.measurements[-1].copy()
+        self.stimulation_events.add_block(block, first_position, missing)
+
+        self._py_listener.on_data_block(block)
 
     def connect_listener_methods(self):
         '''Create bridge methods between the ctypes and the 
             python listener object.
         '''
 
+        if self._measurement_mode == MeasurementMode.MEASUREMENT_VIEW:
+            convert_measurements = _measurement_view
+        elif self._measurement_mode == MeasurementMode.MEASUREMENT_ARRAY:
+            convert_measurements = lambda c_sample: _measurement_view(c_sample).copy()
+        else:
+            convert_measurements = lambda c_sample: c_sample.measurements[:c_sample.numberOfMeasurements]
+
+        tracker = self.counter_tracker
+        update_counter = tracker.update
+        stimulation_events = self.stimulation_events
+
         def onStimulationStateChanged(isStimulating: bool):
+            self.is_stimulating = isStimulating
             self._py_listener.on_stimulation_state_changed(isStimulating)
 
         def onMeasurementStateChanged(isMeasuring: bool):
+            self.is_measuring = isMeasuring
+            if isMeasuring:
+                self.counter_tracker.restart()
+                self._last_measurements = None
+            elif self._sample_buffer is not None:
+                self._sample_buffer.flush()
             self._py_listener.on_measurement_state_changed(isMeasuring)
 
         def onConnectionStateChanged(connectionType: int, connectionState: int):
@@ -288,7 +411,12 @@ class _ImplantListener():
 
         def onData(sample: POINTER(_CtypesSample)):
             c_sample = sample.contents
-            measurements = c_sample.measurements[:c_sample.numberOfMeasurements]
+            measurements = convert_measurements(c_sample)
+            update_counter(c_sample.measurementCounter)
+            if c_sample.stimulationId != SAMPLE_NO_STIMULATION or c_sample.isStimulationActive != stimulation_events.is_active:
+                stimulation_events.add_sample(tracker.total_received + tracker.total_missing - 1,
+                                              c_sample.measurementCounter, c_sample.stimulationId,
+                                              c_sample.isStimulationActive)
 
             py_sample = Sample(c_sample.numberOfMeasurements, 
                                 measurements,
@@ -300,19 +428,29 @@ class _ImplantListener():
 
             self._py_listener.on_data(py_sample)
 
+        def onDataBlockMode(sample: POINTER(_CtypesSample)):
+            self._sample_buffer.append(sample.contents)
+
+        record_telemetry = self.telemetry.record
+
         def onImplantVoltageChanged(voltageV: float):
+            record_telemetry('implant_voltage_V', voltageV)
             self._py_listener.on_implant_voltage_changed(voltageV)
 
         def onPrimaryCoilCurrentChanged(currentMilliA: float):
+            record_telemetry('primary_coil_current_mA', currentMilliA)
             self._py_listener.on_primary_coil_current_changed(currentMilliA)
 
         def onImplantControlValueChanged(controlValue: float):
+            record_telemetry('implant_control_value', controlValue)
             self._py_listener.on_implant_control_value_changed(controlValue)
 
         def onTemperatureChanged(temperature: float):
+            record_telemetry('temperature', temperature)
             self._py_listener.on_temperature_changed(temperature)
 
         def onHumidityChanged(humidity: float):
+            record_telemetry('humidity', humidity)
             self._py_listener.on_humidity_changed(humidity)
 
         def onError(errorDescription: bytes):
@@ -324,17 +462,58 @@ class _ImplantListener():
         def onStimulationFunctionFinished(numExecutedFunctions: int):
             self._py_listener.on_stimulation_function_finished(numExecutedFunctions)
 
+        bridge_functions = [onStimulationStateChanged,
+                            onMeasurementStateChanged,
+                            onConnectionStateChanged,
+                            onData if self._sample_buffer is None else onDataBlockMode,
+                            onImplantVoltageChanged,
+                            onPrimaryCoilCurrentChanged,
+                            onImplantControlValueChanged,
+                            onTemperatureChanged,
+                            onHumidityChanged,
+                            onError,
+                            onDataProcessingTooSlow,
+                            onStimulationFunctionFinished]
+
+        # Without instrumentation the bridge functions are used directly
+        if self.instrumentation is not None:
+            bridge_functions = [self.instrumentation.wrap(name, function)
+                                for name, function in zip(CALLBACK_NAMES, bridge_functions)]
+
         return _CTypesImplantListener(
-            _boolFunc_t(onStimulationStateChanged),
-            _boolFunc_t(onMeasurementStateChanged),
-            _connectFunc_t(onConnectionStateChanged),
-            CFUNCTYPE(None, POINTER(_CtypesSample))(onData),
-            _floatFunc_t(onImplantVoltageChanged),
-            _floatFunc_t(onPrimaryCoilCurrentChanged),
-            _floatFunc_t(onImplantControlValueChanged),
-            _floatFunc_t(onTemperatureChanged),
-            _floatFunc_t(onHumidityChanged),
-            CFUNCTYPE(None, c_char_p)(onError),
-            CFUNCTYPE(None)(onDataProcessingTooSlow),
-            _uint64Func_t(onStimulationFunctionFinished)
-        )
\ No newline at end of file
+            _boolFunc_t(bridge_functions[0]),
+            _boolFunc_t(bridge_functions[1]),
+            _connectFunc_t(bridge_functions[2]),
+            CFUNCTYPE(None, POINTER(_CtypesSample))(bridge_functions[3]),
+            _floatFunc_t(bridge_functions[4]),
+            _floatFunc_t(bridge_functions[5]),
+            _floatFunc_t(bridge_functions[6]),
+            _floatFunc_t(bridge_functions[7]),
+            _floatFunc_t(bridge_functions[8]),
+            CFUNCTYPE(None, c_char_p)(bridge_functions[9]),
+            CFUNCTYPE(None)(bridge_functions[10]),
+            _uint64Func_t(bridge_functions[11])
+        )
+
+class _ImplantListener(_ListenerBridge):
+    _implant_createListener = _CFunction('implant_createListener',
+                                         [POINTER(_CTypesImplantListener), POINTER(opaque_ptr)])
+    _implant_destroyListener = _CFunction('implant_destroyListener', [POINTER(opaque_ptr)])
+
+    def __init__(self, listener: ImplantListener, block_size: int = None, block_interval_ms: float = None,
+                 measurement_mode: MeasurementMode = MeasurementMode.MEASUREMENT_LIST, gap_fill: GapFillPolicy = None,
+                 instrumentation: CallbackInstrumentation = None, telemetry: TelemetryStore = None):
+        self._handle = pointer(_Opaque())
+
+        super().__init__(listener, block_size, block_interval_ms, measurement_mode, gap_fill, instrumentation,
+                         telemetry)
+
+        status = self._implant_createListener(byref(self._ctypes_listener), byref(self._handle))
+
+        if status != CAPIStatus.STATUS_OK:
+            self._handle = None
+            raise RuntimeError(f"{status.name}: {get_error_message()}")
+
+    def __del__(self):
+        if self._handle is not None:
+            self._implant_destroyListener(byref(self._handle))
@@ -0,0 +1,540 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring implantsession
+
+    Simultaneous measurement with several external units.
+
+    An ImplantSession creates one Implant per external unit found by
+    the factory and owns them. Each implant gets its own 
+    DispatchingListener, i.e. its own consumer thread, which copies the
+    received blocks into a ring buffer holding the last buffer_s 
+    seconds of that device. merged() aligns the buffered samples of all
+    devices on a common host time axis.
+
+    The implants are not synchronized by hardware. The host time of a
+    sample is estimated from its (unwrapped) measurement counter and 
+    the sampling rate, anchored at the smallest observed difference 
+    between the arrival time of a block and the counter of its last 
+    sample (the block with the lowest transport latency). The anchor is
+    determined anew for every measurement run and after every counter
+    reset. Clock drift between the devices and the host is not 
+    corrected.
+
+    Typical usage:
+
+        with ImplantSession(block_interval_ms=10.) as session:
+            session.start_measurement()
+            ...
+            merged = session.merged(window_s=1.)
+            print(session.statistics)
+'''
+from threading import Lock
+from time import perf_counter
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from pythonapi.implantlistener import ImplantListener, ConnectionType, ConnectionState, Sample
+from pythonapi.dispatchinglistener import DispatchingListener, OverflowPolicy
+from pythonapi.gapdetection import COUNTER_MODULO, _MAX_GAP, CounterTracker
+from pythonapi.sampleblock import SampleBlock
+
+class _DeviceStream(ImplantListener):
+    '''Listener of one device of a session. Runs on the consumer thread
+        of the device's DispatchingListener and keeps the most recent
+        samples in a ring buffer.
+
+        The samples are split into segments of continuous counters. A 
+        new segment starts with every measurement start and every 
+        counter reset. Each sample stores its segment and its position
+        within the segment (the counter with wrap-arounds and gaps 
+        resolved), each segment has its own host time anchor.
+    '''
+
+    def __init__(self, device_id: str, sampling_rate: int, capacity: int):
+        self.device_id = device_id
+        self.sampling_rate = sampling_rate
+        self._capacity = capacity
+        self._lock = Lock()
+
+        self._measurements = None
+        self._measurement_counter = np.zeros(capacity, dtype=np.uint32)
+        self._position = np.zeros(capacity, dtype=np.int64)
+        self._segment = np.zeros(capacity, dtype=np.int64)
+        self._num_written = 0
+        self.counter_tracker = CounterTracker()
+
+        # Estimated host time of position 0 of each segment
+        self._clock_offsets: Dict[int, float] = {}
+        self._current_segment = -1
+        self._last_counter = None
+        self._last_position = -1
+
+        self.is_measuring = False
+        self.connection_state = None
+        self.num_samples = 0
+        self.num_blocks = 0
+        self.num_bytes = 0
+        self.errors = 0
+        self.last_error = None
+        self._start_run()
+
+    def _start_run(self):
+        '''Start a new segment and the throughput counters of a new 
+            measurement run.
+        '''
+
+        self._current_segment += 1
+        self._last_position = -1
+        self.counter_tracker.restart()
+
+        self.run_samples = 0
+        self.run_bytes = 0
+        self.run_first_block_samples = 0
+        self.run_first_block_bytes = 0
+        self.run_first_block_time = None
+        self.last_block_time = None
+
+    def on_data_block(self, block: SampleBlock):
+        num_samples = len(block)
+        if num_samples == 0:
+            return
+
+        counters = block.measurement_counter
+        num_resets = self.counter_tracker.num_resets
+        missing = self.counter_tracker.update_block(counters)
+        steps = np.ones(num_samples, dtype=np.int64) if missing is None else missing.astype(np.int64) + 1
+
+        segments = np.full(num_samples, self._current_segment, dtype=np.int64)
+        if self._last_position < 0:
+            # The first sample of a segment is at position 0
+            steps[0] = 0
+        if self.counter_tracker.num_resets != num_resets:
+            # The counter jumped backwards: continue in a new segment
+            extended = np.empty(num_samples + 1, dtype=np.int64)
+            extended[0] = int(counters[0]) - 1 if self._last_position < 0 else self._last_counter
+            extended[1:] = counters
+            resets = (np.diff(extended) - 1) % COUNTER_MODULO >= _MAX_GAP
+            segments += np.cumsum(resets)
+            steps[resets] = 0
+
+        # Positions count from 0 in every new segment
+        positions = np.empty(num_samples, dtype=np.int64)
+        segment_ends = np.append(np.flatnonzero(np.diff(segments)) + 1, num_samples)
+        start = 0
+        for end in segment_ends:
+            base = self._last_position if start == 0 and self._last_position >= 0 else 0
+            positions[start:end] = base + np.cumsum(steps[start:end])
+            start = end
+
+        with self._lock:
+            if self._measurements is None or self._measurements.shape[1] != block.num_measurements:
+                self._measurements = np.zeros((self._capacity, block.num_measurements), dtype=np.float64)
+                self._num_written = 0
+
+            # Only the newest capacity samples of a large block are kept
+            keep = min(num_samples, self._capacity)
+            rows = (self._num_written + num_samples - keep + np.arange(keep)) % self._capacity
+            self._measurements[rows] = block.measurements[-keep:]
+            self._measurement_counter[rows] = counters[-keep:]
+            self._position[rows] = positions[-keep:]
+            self._segment[rows] = segments[-keep:]
+            self._num_written += num_samples
+
+            # The block arrived after its samples, so the smallest
+            # difference seen within a segment is the best anchor
+            for end in segment_ends:
+                segment = int(segments[end - 1])
+                offset = float(block.host_timestamp - positions[end - 1] / self.sampling_rate)
+                if segment not in self._clock_offsets or offset < self._clock_offsets[segment]:
+                    self._clock_offsets[segment] = offset
+            # Segments no longer in the buffer are not needed anymore
+            oldest = int(self._segment[(self._num_written - min(self._num_written, self._capacity)) % self._capacity])
+            for old in [old for old in self._clock_offsets if old < oldest]:
+                del self._clock_offsets[old]
+
+        self._current_segment = int(segments[-1])
+        self._last_counter = int(counters[-1])
+        self._last_position = int(positions[-1])
+
+        self.num_samples += num_samples
+        self.num_blocks += 1
+        self.num_bytes += block.nbytes
+        self.run_samples += num_samples
+        self.run_bytes += block.nbytes
+        if self.run_first_block_time is None:
+            self.run_first_block_time = block.host_timestamp
+            self.run_first_block_samples = num_samples
+            self.run_first_block_bytes = block.nbytes
+        self.last_block_time = block.host_timestamp
+
+    def window(self, since: float = None):
+        '''Copy of the buffered samples as (host_time, counter, 
+            measurements), optionally only those at or after since.
+        '''
+
+        with self._lock:
+            if self._measurements is None or self._num_written == 0:
+                return None
+
+            num_buffered = min(self._num_written, self._capacity)
+            rows = (self._num_written - num_buffered + np.arange(num_buffered)) % self._capacity
+            segments = self._segment[rows]
+            # Runs without data leave unused segment numbers, so only the
+            # segments present in the buffer are looked up
+            present, segment_index = np.unique(segments, return_inverse=True)
+            offsets = np.array([self._clock_offsets[segment] for segment in present.tolist()])
+            host_time = offsets[segment_index] + self._position[rows] / self.sampling_rate
+            if since is not None:
+                first = np.searchsorted(host_time, since, 'left')
+                rows = rows[first:]
+                host_time = host_time[first:]
+            return host_time, self._measurement_counter[rows], self._measurements[rows]
+
+    @property
+    def segment_start(self) -> float:
+        '''Estimated host time of the first sample of the current 
+            segment or None.
+        '''
+
+        with self._lock:
+            return self._clock_offsets.get(self._current_segment)
+
+    def on_stimulation_state_changed(self, is_stimulating: bool):
+        pass
+
+    def on_measurement_state_changed(self, is_measuring: bool):
+        if is_measuring and not self.is_measuring:
+            # The counter may restart and the host time anchor of the
+            # previous run does not include the pause
+            self._start_run()
+        self.is_measuring = is_measuring
+
+    def on_connection_state_changed(self, connection_type: ConnectionType, connection_state: ConnectionState):
+        self.connection_state = connection_state
+
+    def on_data(self, sample: Sample):
+        # The session registers its listeners in block mode
+        pass
+
+    def on_implant_voltage_changed(self, voltage_V: float):
+        pass
+
+    def on_primary_coil_current_changed(self, current_mA: float):
+        pass
+
+    def on_implant_control_value_changed(self, control_value: float):
+        pass
+
+    def on_temperature_changed(self, temperature: float):
+        pass
+
+    def on_humidity_changed(self, humidity: float):
+        pass
+
+    def on_error(self, error_description: str):
+        self.errors += 1
+        self.last_error = error_description
+
+    def on_data_processing_too_slow(self):
+        pass
+
+    def on_stimulation_function_finished(self, num_executed_functions: int):
+        pass
+
+class MergedSamples():
+    '''Samples of several devices aligned on a common host time axis.
+
+        - timestamp: Estimated host time (time.perf_counter()) of each
+            row, taken from the reference device (the first device with
+            data).
+        - measurement_counter: int64 array of shape (num_rows, 
+            num_devices) with the counter of the sample of each device
+            or -1 if the device has no sample within half a sampling 
+            period of the row.
+        - measurements: List with one float64 array of shape (num_rows,
+            num_channels) per device, NaN where the device has no 
+            sample.
+    '''
+
+    __slots__ = ('device_ids', 'timestamp', 'measurement_counter', 'measurements')
+
+    def __init__(self, device_ids: List[str], timestamp: np.ndarray, measurement_counter: np.ndarray,
+                 measurements: List[np.ndarray]):
+        self.device_ids = device_ids
+        self.timestamp = timestamp
+        self.measurement_counter = measurement_counter
+        self.measurements = measurements
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def device(self, device_id: str) -> np.ndarray:
+        '''Get the aligned measurements of one device.
+
+           @param device_id (Type: str) Device id of the external unit.
+        '''
+        return self.measurements[self.device_ids.index(device_id)]
+
+    @property
+    def is_complete(self) -> np.ndarray:
+        '''Boolean array telling whether all devices have a sample in
+            a row.
+        '''
+        return np.all(self.measurement_counter >= 0, axis=1)
+
+class ImplantSession():
+    '''Owner of the implants of all (or the given) external units.'''
+
+    def __init__(self, factory=None, external_unit_infos: Sequence = None, block_size: int = None,
+                 block_interval_ms: float = 10., buffer_s: float = 10., capacity: int = 1024,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.OVERFLOW_DROP_OLDEST):
+        '''Connect to the implants and register a dispatching listener
+            on each of them.
+
+           @param factory             (Type: ImplantFactory) Factory 
+                creating the implants, a new one if None.
+           @param external_unit_infos (Type: Sequence[ExternalUnitInfo])
+                The external units to use, all found ones if None.
+           @param block_size          (Type: int)   Maximum number of 
+                samples per block (see Implant.register_listener).
+           @param block_interval_ms   (Type: float) Maximum time span of
+                a block in milliseconds.
+           @param buffer_s            (Type: float) Time span kept in 
+                the ring buffer of each device in seconds.
+           @param capacity            (Type: int) Maximum number of 
+                queued blocks per device (see DispatchingListener).
+           @param overflow_policy     (Type: OverflowPolicy) Behavior if
+                the queue of a device is full.
+        '''
+
+        if factory is None:
+            # Imported here since implantfactory loads the C library
+            from pythonapi.implantfactory import ImplantFactory
+            factory = ImplantFactory()
+        if external_unit_infos is None:
+            external_unit_infos = factory.load_external_unit_infos()
+
+        self._device_ids = []
+        self._implants = {}
+        self._dispatchers = {}
+        self._streams = {}
+
+        try:
+            for ext_unit_info in external_unit_infos:
+                implant_info = factory.load_implant_info(ext_unit_info)
+                implant = factory.create(ext_unit_info, implant_info)
+                device_id = ext_unit_info.device_id
+                sampling_rate = implant_info.sampling_rate
+
+                stream = _DeviceStream(device_id, sampling_rate, max(1, int(buffer_s * sampling_rate)))
+                dispatcher = DispatchingListener(stream, capacity, overflow_policy)
+                self._device_ids.append(device_id)
+                self._implants[device_id] = implant
+                self._streams[device_id] = stream
+                self._dispatchers[device_id] = dispatcher
+
+                implant.register_listener(dispatcher, block_size=block_size, block_interval_ms=block_interval_ms)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Stop all measurements and stimulations, stop the dispatch 
+            threads and release the implants.
+        '''
+
+        for device_id in self._device_ids:
+            implant = self._implants[device_id]
+            try:
+                if implant.is_stimulating:
+                    implant.stop_stimulation()
+                if implant.is_measuring:
+                    implant.stop_measurement()
+                if implant._listener is not None:
+                    implant.unregister_listener()
+            except RuntimeError:
+                pass
+            self._dispatchers[device_id].close()
+
+        self._device_ids = []
+        self._implants.clear()
+        self._dispatchers.clear()
+        self._streams.clear()
+
+    @property
+    def device_ids(self) -> List[str]:
+        '''Device ids of the external units of the session.'''
+        return list(self._device_ids)
+
+    @property
+    def implants(self) -> Dict:
+        '''The implants of the session by device id of the external 
+            unit. They are owned by the session, do not register other
+            listeners on them.
+        '''
+        return dict(self._implants)
+
+    def __getitem__(self, device_id: str):
+        return self._implants[device_id]
+
+    def __len__(self):
+        return len(self._device_ids)
+
+    def start_measurement(self, ref_channels: List[int] = []):
+        '''Start the measurement on all implants.
+
+           @param ref_channels (Type: List[int]) Reference channels used
+                for every implant.
+        '''
+
+        for device_id in self._device_ids:
+            self._implants[device_id].start_measurement(ref_channels)
+
+    def stop_measurement(self):
+        '''Stop the measurement (and stimulation) on all implants.'''
+
+        for device_id in self._device_ids:
+            self._implants[device_id].stop_measurement()
+
+    def latest(self, device_id: str, window_s: float = None):
+        '''Get the buffered samples of one device as (host_time, 
+            measurement_counter, measurements) arrays or None if no 
+            data arrived yet.
+
+           @param device_id (Type: str)   Device id of the external unit.
+           @param window_s  (Type: float) Only the last window_s seconds.
+        '''
+
+        stream = self._streams[device_id]
+        window = stream.window()
+        if window is None or window_s is None:
+            return window
+        return stream.window(window[0][-1] - window_s)
+
+    def merged(self, window_s: float = None) -> MergedSamples:
+        '''Align the buffered samples of all devices on the host time 
+            axis of the first device with data.
+
+            Only the time span covered by all devices with data is 
+            returned, optionally limited to its last window_s seconds. 
+            Each row holds the sample of every device closest in time
+            if it is less than half a sampling period away.
+
+           @param window_s (Type: float) Maximum time span in seconds.
+        '''
+
+        windows = {}
+        for device_id in self._device_ids:
+            window = self._streams[device_id].window()
+            if window is not None:
+                windows[device_id] = window
+
+        if not windows:
+            return MergedSamples(self.device_ids, np.zeros(0), np.zeros((0, len(self._device_ids)), dtype=np.int64),
+                                 [np.zeros((0, 0)) for _ in self._device_ids])
+
+        start = max(window[0][0] for window in windows.values())
+        stop = min(window[0][-1] for window in windows.values())
+        if window_s is not None:
+            start = max(start, stop - window_s)
+
+        reference = windows[next(iter(windows))][0]
+        timestamp = reference[np.searchsorted(reference, start, 'left'):np.searchsorted(reference, stop, 'right')]
+
+        counters = np.full((len(timestamp), len(self._device_ids)), -1, dtype=np.int64)
+        measurements = []
+        for column, device_id in enumerate(self._device_ids):
+            if device_id not in windows:
+                measurements.append(np.full((len(timestamp), 0), np.nan))
+                continue
+
+            host_time, measurement_counter, values = windows[device_id]
+            aligned = np.full((len(timestamp), values.shape[1]), np.nan)
+            if len(timestamp) > 0:
+                # Closest sample of the device for each row
+                after = np.clip(np.searchsorted(host_time, timestamp), 1, len(host_time) - 1) \
+                    if len(host_time) > 1 else np.zeros(len(timestamp), dtype=np.intp)
+                before = np.maximum(after - 1, 0)
+                nearest = np.where(np.abs(host_time[before] - timestamp) <= np.abs(host_time[after] - timestamp),
+                                   before, after)
+                valid = np.abs(host_time[nearest] - timestamp) <= 0.5 / self._streams[device_id].sampling_rate
+                aligned[valid] = values[nearest[valid]]
+                counters[valid, column] = measurement_counter[nearest[valid]]
+            measurements.append(aligned)
+
+        return MergedSamples(self.device_ids, timestamp, counters, measurements)
+
+    @property
+    def statistics(self) -> Dict[str, Dict]:
+        '''Throughput statistics by device id.
+
+            - samples:         Received samples.
+            - blocks:          Received blocks.
+            - bytes:           Bytes of the received blocks.
+            - samples_per_s:   Received samples per second between the
+                first and the last block of the current measurement.
+            - bytes_per_s:     Received bytes per second of the current
+                measurement.
+            - expected_samples_per_s: Sampling rate of the implant.
+            - segment_start_s: Estimated host time of the first sample 
+                of the current segment (see _DeviceStream), relative to
+                that of the first device.
+            - idle_s:          Time since the last block of the current
+                measurement.
+            - missing:         Lost samples.
+            - resets:          Counter jumps backwards.
+            - dropped:         Blocks discarded by the dispatcher.
+            - queued:          Blocks waiting for the dispatch thread.
+            - errors:          Reported errors.
+        '''
+
+        now = perf_counter()
+        statistics = {}
+        reference_start = None
+        for device_id in self._device_ids:
+            stream = self._streams[device_id]
+            dispatcher = self._dispatchers[device_id].statistics
+            gaps = stream.counter_tracker.statistics
+
+            duration = (stream.last_block_time - stream.run_first_block_time) \
+                if stream.run_first_block_time is not None else 0.
+            segment_start = stream.segment_start
+            if segment_start is not None and reference_start is None:
+                reference_start = segment_start
+
+            statistics[device_id] = {
+                "samples": stream.num_samples,
+                "blocks": stream.num_blocks,
+                "bytes": stream.num_bytes,
+                "samples_per_s": (stream.run_samples - stream.run_first_block_samples) / duration \
+                    if duration > 0 else 0.,
+                "bytes_per_s": (stream.run_bytes - stream.run_first_block_bytes) / duration if duration > 0 else 0.,
+                "expected_samples_per_s": stream.sampling_rate,
+                "segment_start_s": segment_start - reference_start if segment_start is not None else None,
+                "idle_s": now - stream.last_block_time if stream.last_block_time is not None else None,
+                "missing": gaps["total_missing"],
+                "resets": gaps["num_resets"],
+                "dropped": dispatcher["dropped_oldest"] + dispatcher["dropped_newest"],
+                "queued": dispatcher["queued"],
+                "errors": stream.errors}
+        return statistics
@@ -0,0 +1,280 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring instrumentation
+
+    Optional timing instrumentation of the listener callbacks.
+
+    A CallbackInstrumentation passed to Implant.register_listener
+    measures how long each bridged callback takes (including the
+    python listener), counts the calls per callback type and records
+    the inter-arrival time of the measurement samples. Without
+    instrumentation the callbacks are not wrapped at all.
+'''
+from threading import Event, Lock, Thread
+from time import perf_counter_ns, time
+from typing import Callable, Dict, List
+
+# Number of bits used for the linear sub-buckets of each power of two
+_SUB_BUCKET_BITS = 4
+_SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+
+# Callback names in the order of _CTypesImplantListener
+CALLBACK_NAMES = ('on_stimulation_state_changed', 'on_measurement_state_changed', 'on_connection_state_changed',
+                  'on_data', 'on_implant_voltage_changed', 'on_primary_coil_current_changed',
+                  'on_implant_control_value_changed', 'on_temperature_changed', 'on_humidity_changed',
+                  'on_error', 'on_data_processing_too_slow', 'on_stimulation_function_finished')
+
+class LatencyHistogram():
+    '''Histogram of durations in nanoseconds with logarithmic buckets.
+
+        Like an HDR histogram, each power of two is split into 
+        2^_SUB_BUCKET_BITS linear sub-buckets, which bounds the relative
+        error of the reported percentiles to about 6% while recording
+        is a few integer operations.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''Remove all recorded values.'''
+
+        self._counts = [0] * (64 * _SUB_BUCKET_COUNT)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value: int):
+        '''Add a value (integer nanoseconds).'''
+
+        exponent = value.bit_length()
+        if exponent <= _SUB_BUCKET_BITS:
+            index = value
+        else:
+            shift = exponent - _SUB_BUCKET_BITS - 1
+            index = ((shift + 1) << _SUB_BUCKET_BITS) + ((value >> shift) & (_SUB_BUCKET_COUNT - 1))
+        self._counts[index] += 1
+
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @staticmethod
+    def _bucket_upper_bound(index: int) -> int:
+        '''Largest value falling into the bucket with the given index.'''
+
+        if index < _SUB_BUCKET_COUNT:
+            return index
+        shift = (index >> _SUB_BUCKET_BITS) - 1
+        sub_bucket = index & (_SUB_BUCKET_COUNT - 1)
+        return ((_SUB_BUCKET_COUNT + sub_bucket + 1) << shift) - 1
+
+    def percentile(self, percent: float) -> int:
+        '''Value below or equal to which percent of the recorded values
+            fall (upper bound of the bucket).
+        '''
+
+        if self.count == 0:
+            return 0
+
+        threshold = max(1, int(round(self.count * percent / 100.)))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= threshold:
+                return min(self._bucket_upper_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        '''Count, mean, min, max and percentiles in microseconds.'''
+
+        if self.count == 0:
+            return {"count": 0}
+
+        return {"count": self.count,
+                "mean_us": self.total / self.count / 1000.,
+                "min_us": self.min / 1000.,
+                "p50_us": self.percentile(50) / 1000.,
+                "p90_us": self.percentile(90) / 1000.,
+                "p99_us": self.percentile(99) / 1000.,
+                "p999_us": self.percentile(99.9) / 1000.,
+                "max_us": self.max / 1000.}
+
+class CallbackInstrumentation():
+    '''Statistics about the execution of the listener callbacks.
+
+        - Number of calls per callback.
+        - Histogram of the handler duration per callback.
+        - Histogram of the time between two on_data calls and the 
+            standard deviation of this time (jitter).
+        - Wall-clock time of the most recent 
+            on_data_processing_too_slow events together with the 
+            on_data statistics at that moment.
+
+        The counters and histograms are created once and cleared in 
+        place by reset, since the wrapped callbacks keep references to
+        them.
+    '''
+
+    def __init__(self, max_too_slow_events: int = 1024):
+        '''@param max_too_slow_events (Type: int) Number of most recent
+                on_data_processing_too_slow events to keep.
+        '''
+
+        self._lock = Lock()
+        self._report_thread = None
+        self._stop_reporting = Event()
+        self._max_too_slow_events = max_too_slow_events
+
+        self.counts = {name: 0 for name in CALLBACK_NAMES}
+        self.durations = {name: LatencyHistogram() for name in CALLBACK_NAMES}
+        self.intervals = LatencyHistogram()
+        self.too_slow_events: List[Dict] = []
+        self.reset()
+
+    def reset(self):
+        '''Clear all statistics.'''
+
+        with self._lock:
+            for name in CALLBACK_NAMES:
+                self.counts[name] = 0
+                self.durations[name].reset()
+            self.intervals.reset()
+            self.too_slow_events.clear()
+
+            self._last_data_arrival = None
+            self._interval_mean = 0.
+            self._interval_m2 = 0.
+
+    def wrap(self, name: str, callback: Callable) -> Callable:
+        '''Wrap a bridge callback so that its calls are recorded.
+
+           @param name     (Type: str)      Name of the listener callback.
+           @param callback (Type: Callable) The bridge function.
+        '''
+
+        histogram = self.durations[name]
+        counts = self.counts
+
+        if name == 'on_data':
+            def instrumented(*args):
+                start = perf_counter_ns()
+                callback(*args)
+                end = perf_counter_ns()
+                self._record_arrival(start)
+                histogram.record(end - start)
+                counts[name] += 1
+        elif name == 'on_data_processing_too_slow':
+            def instrumented(*args):
+                self._record_too_slow()
+                start = perf_counter_ns()
+                callback(*args)
+                histogram.record(perf_counter_ns() - start)
+                counts[name] += 1
+        else:
+            def instrumented(*args):
+                start = perf_counter_ns()
+                callback(*args)
+                histogram.record(perf_counter_ns() - start)
+                counts[name] += 1
+
+        return instrumented
+
+    def _record_arrival(self, arrival: int):
+        '''Update the inter-arrival statistics of on_data.'''
+
+        last_arrival = self._last_data_arrival
+        self._last_data_arrival = arrival
+        if last_arrival is None:
+            return
+
+        interval = arrival - last_arrival
+        self.intervals.record(interval)
+
+        # Welford's online algorithm for the variance of the interval
+        delta = interval - self._interval_mean
+        self._interval_mean += delta / self.intervals.count
+        self._interval_m2 += delta * (interval - self._interval_mean)
+
+    def _record_too_slow(self):
+        '''Store the on_data statistics at the time of a too slow event.'''
+
+        durations = self.durations['on_data']
+        self.too_slow_events.append({"time": time(),
+                                     "on_data_count": self.counts['on_data'],
+                                     "on_data_p99_us": durations.percentile(99) / 1000.,
+                                     "on_data_max_us": durations.max / 1000.,
+                                     "jitter_us": self.jitter_us})
+        if len(self.too_slow_events) > self._max_too_slow_events:
+            del self.too_slow_events[0]
+
+    @property
+    def jitter_us(self) -> float:
+        '''Standard deviation of the time between two on_data calls in
+            microseconds.
+        '''
+
+        count = self.intervals.count
+        if count < 2:
+            return 0.
+        return (self._interval_m2 / (count - 1)) ** 0.5 / 1000.
+
+    def snapshot(self) -> Dict:
+        '''Current statistics as dictionary.
+
+            Only callbacks which were called at least once are included
+            in 'durations'.
+        '''
+
+        with self._lock:
+            return {"time": time(),
+                    "counts": dict(self.counts),
+                    "durations": {name: histogram.summary() for name, histogram in self.durations.items()
+                                  if histogram.count > 0},
+                    "on_data_interval": self.intervals.summary(),
+                    "on_data_jitter_us": self.jitter_us,
+                    "too_slow_events": list(self.too_slow_events)}
+
+    def start_reporting(self, interval_s: float, report: Callable[[Dict], None] = print):
+        '''Periodically pass a snapshot to report on a background thread.
+
+           @param interval_s (Type: float)    Time between two reports in
+                seconds.
+           @param report     (Type: Callable) Function receiving the 
+                snapshot dictionary.
+        '''
+
+        self.stop_reporting()
+        self._stop_reporting.clear()
+
+        def run():
+            while not self._stop_reporting.wait(interval_s):
+                report(self.snapshot())
+
+        self._report_thread = Thread(target=run, name="CallbackInstrumentation", daemon=True)
+        self._report_thread.start()
+
+    def stop_reporting(self):
+        '''Stop the periodic reports.'''
+
+        if self._report_thread is not None:
+            self._stop_reporting.set()
+            self._report_thread.join()
+            self._report_thread = None
@@ -24,10 +24,12 @@
     the API.
 '''
 
-from ctypes import CDLL, POINTER, create_string_buffer, c_size_t, Structure, c_uint32
+from ctypes import CDLL, POINTER, byref, cast, create_string_buffer, c_size_t, c_void_p, Structure, c_uint32
 from enum import IntEnum
-from platform import architecture
+from threading import Lock, local
+from typing import List, Tuple
 import os
+import sys
 
 class _Opaque(Structure):
     pass
@@ -65,6 +67,98 @@ class _CAPIUint32Set(Structure):
     _fields_ = [("size", c_size_t), 
                 ("elements", POINTER(c_uint32))]
 
+# Initial and maximum sizes of the reusable out-parameter buffers
+_INITIAL_STRING_BUFFER_SIZE = 512
+_INITIAL_VECTOR_CAPACITY = 128
+_MAX_STRING_BUFFER_SIZE = 1 << 20
+_MAX_VECTOR_CAPACITY = 1 << 16
+
+class _BufferPool(local):
+    '''Thread-local buffers for the string and vector out-parameters of
+        the C api.
+
+        All getters of a thread share the same buffers instead of 
+        allocating new ones per call. If the C api reports 
+        STATUS_STRING_TOO_LONG or STATUS_VECTOR_TOO_LONG, the buffer is
+        enlarged and the call repeated. Results are copied out of the
+        buffers before they are returned, so the next call can reuse 
+        them.
+    '''
+
+    def __init__(self):
+        self._string_buffer = create_string_buffer(_INITIAL_STRING_BUFFER_SIZE)
+        self._string_length = c_size_t(0)
+        self._handle_array = (c_void_p * _INITIAL_VECTOR_CAPACITY)()
+        self._uint32_arrays = [(c_uint32 * _INITIAL_VECTOR_CAPACITY)() for _ in range(2)]
+
+    def call_string(self, function, *args) -> Tuple[CAPIStatus, str]:
+        '''Call a C string getter as function(*args, buffer, 
+            buffer_length, string_length_ptr).
+
+            Returns the status and the decoded string (None if the 
+            status is not STATUS_OK).
+        '''
+
+        while True:
+            buffer = self._string_buffer
+            buffer_size = len(buffer)
+            status = function(*args, buffer, buffer_size, byref(self._string_length))
+            if status != CAPIStatus.STATUS_STRING_TOO_LONG or buffer_size >= _MAX_STRING_BUFFER_SIZE:
+                break
+            # The reported length is used if the C api provides it
+            self._string_buffer = create_string_buffer(max(2 * buffer_size, self._string_length.value + 1))
+
+        if status == CAPIStatus.STATUS_OK:
+            return status, buffer.value.decode("utf-8")
+        return status, None
+
+    def call_handle_vector(self, function, vector_type, *args) -> Tuple[CAPIStatus, List]:
+        '''Call a C function filling a vector of handles as 
+            function(*args, vector_ptr). vector_type is the ctypes
+            structure of the vector with the fields count and vector.
+
+            Returns the status and a list with copies of the handles
+            (empty if the status is not STATUS_OK), which stay valid
+            when the buffer is reused.
+        '''
+
+        while True:
+            array = self._handle_array
+            capacity = len(array)
+            vector = vector_type(c_size_t(capacity), cast(array, POINTER(POINTER(_Opaque))))
+            status = function(*args, byref(vector))
+            if status != CAPIStatus.STATUS_VECTOR_TOO_LONG or capacity >= _MAX_VECTOR_CAPACITY:
+                break
+            self._handle_array = (c_void_p * max(2 * capacity, vector.count))()
+
+        if status == CAPIStatus.STATUS_OK:
+            return status, [cast(address, opaque_ptr) for address in array[:vector.count]]
+        return status, []
+
+    def call_uint32_sets(self, function, *args) -> Tuple[CAPIStatus, List[List[int]]]:
+        '''Call a C function filling two uint32 sets as 
+            function(*args, set_ptr, set_ptr).
+
+            Returns the status and the elements of both sets.
+        '''
+
+        while True:
+            arrays = self._uint32_arrays
+            capacity = len(arrays[0])
+            uint32_sets = [_CAPIUint32Set(c_size_t(capacity), array) for array in arrays]
+            status = function(*args, *(byref(uint32_set) for uint32_set in uint32_sets))
+            if status not in (CAPIStatus.STATUS_VECTOR_TOO_LONG, CAPIStatus.STATUS_SET_TOO_BIG) \
+                    or capacity >= _MAX_VECTOR_CAPACITY:
+                break
+            self._uint32_arrays = [(c_uint32 * (2 * capacity))() for _ in range(2)]
+
+        if status == CAPIStatus.STATUS_OK:
+            return status, [array[:uint32_set.size] for array, uint32_set in zip(arrays, uint32_sets)]
+        return status, [[], []]
+
+# Buffers shared by all getters, one set per thread
+_buffers = _BufferPool()
+
 class PythonAPIBase():
     '''Base class of the Cortec python API. 
     
@@ -86,14 +180,10 @@ class PythonAPIBase():
     def library_version(self):
         '''Returns the used library version.'''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-
-        status = self._capi_getLibraryVersion(buffer, buffer_size, string_length_ptr)
+        status, version = _buffers.call_string(self._capi_getLibraryVersion)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return version
         else:
             raise RuntimeError(f"Could not retrieve library version due to error: {status.name}")
 
@@ -103,14 +193,10 @@ class PythonAPIBase():
             if no error has occurred.
         '''
 
-        buffer_size = 512
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-
-        status = self._capi_getErrorMessage(buffer, buffer_size, string_length_ptr)
+        status, message = _buffers.call_string(self._capi_getErrorMessage)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return message
         else:
             raise RuntimeError(f"Could not retrieve error message due to error: {status.name}")
 
@@ -118,33 +204,84 @@ class PythonAPIBase():
 _api_base: PythonAPIBase = None
 
 def _load_dll():
-    '''Load the C api dll.'''
+    '''Load the C api dll, or the simulated library if the environment
+        variable CORTEC_CAPI_SIMULATION is set (see simulatedapi).
+    '''
+    if os.environ.get('CORTEC_CAPI_SIMULATION'):
+        from pythonapi.simulatedapi import SimulatedImplantAPI
+        return SimulatedImplantAPI.from_environment()
+
     try:
         return CDLL('cimplantapi')
     except Exception as e:
         return _load_from_fallback_path()
 
+# Handles of the dlls the C api depends on, kept alive while it is used
+_dependency_dlls = []
+
+# Order in which the dependencies could be loaded, None before the first
+# successful load
+_dependency_order = None
+
 def _load_from_fallback_path():
     '''Load dll from c api installation directoy relative to python
         api installation.
 
-        Requires additional loading of all dlls the C api depends on.
+        If the interpreter supports it (Windows, Python 3.8+), the
+        installation directory is added to the dll search path, so that
+        the dependencies are resolved by the loader. Otherwise all dlls
+        the C api depends on are loaded before (see _load_dependencies).
     '''
     try:
-        required_dlls = []
         dll_dir = _get_dll_dir()
-        for dll_file in os.listdir(dll_dir):
-            if dll_file.endswith('.dll') and 'cimplantapi' not in dll_file and not dll_file.endswith('D.dll'):
-                required_dlls.append(CDLL(os.path.join(dll_dir, dll_file)))
-        return CDLL(os.path.join(dll_dir, 'cimplantapi.dll'))
+        dll_path = os.path.join(dll_dir, 'cimplantapi.dll')
+        if hasattr(os, 'add_dll_directory'):
+            os.add_dll_directory(dll_dir)
+            try:
+                return CDLL(dll_path)
+            except OSError:
+                pass
+        _load_dependencies(dll_dir)
+        return CDLL(dll_path)
     except:
         raise RuntimeError("Cortec C-API could not be loaded.")
 
+def _load_dependencies(dll_dir: str):
+    '''Load all dlls of the installation directory except the C api
+        itself and debug builds.
+
+        The files are loaded in sorted order. Dlls failing to load 
+        because one of their own dependencies is not loaded yet are 
+        retried after the others. The resulting order is cached, so 
+        that later calls neither list the directory nor retry.
+    '''
+
+    global _dependency_order
+    if _dependency_order is not None:
+        _dependency_dlls.extend(CDLL(os.path.join(dll_dir, dll_file)) for dll_file in _dependency_order)
+        return
+
+    pending = sorted(dll_file for dll_file in os.listdir(dll_dir) if dll_file.endswith('.dll') 
+                     and 'cimplantapi' not in dll_file and not dll_file.endswith('D.dll'))
+    order = []
+    while pending:
+        failed = []
+        for dll_file in pending:
+            try:
+                _dependency_dlls.append(CDLL(os.path.join(dll_dir, dll_file)))
+                order.append(dll_file)
+            except OSError:
+                failed.append(dll_file)
+        if len(failed) == len(pending):
+            raise OSError(f"Could not load {', '.join(failed)}.")
+        pending = failed
+    _dependency_order = order
+
 def _get_dll_dir():
     '''Returns the path to the C API installation depending on the used python
         interpreter version (32bit/64bit) based on a standard API installation
     '''
-    if(architecture()[0] == "32bit"):
+    if sys.maxsize <= 2 ** 32:
         return os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'capi', 'lib32'))
     else:
         return os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'capi', 'lib64'))
@@ -160,6 +297,57 @@ def get_api_base():
         _api_base = PythonAPIBase(main_dll)
     return _api_base
 
+# C functions with their prototype set, shared by all wrapper objects
+_functions = {}
+_functions_lock = Lock()
+
+def _bind(name: str, argtypes: list = None):
+    '''Returns the C function name of the loaded dll with restype
+        CAPIStatus and the given argtypes.
+
+        The prototype is set once per process when the function is first
+        requested, later calls return the same function object.
+    '''
+
+    function = _functions.get(name)
+    if function is None:
+        with _functions_lock:
+            function = _functions.get(name)
+            if function is None:
+                function = getattr(get_api_base().dll_instance, name)
+                function.restype = CAPIStatus
+                if argtypes is not None:
+                    function.argtypes = argtypes
+                _functions[name] = function
+    return function
+
+class _CFunction():
+    '''Class attribute declaring a C function used by a wrapper class.
+
+        The function is bound with _bind on first access and then 
+        replaces the declaration in the class, so that later accesses 
+        are plain attribute lookups and constructing wrapper objects 
+        does not touch the dll at all.
+    '''
+
+    def __init__(self, name: str, argtypes: list = None):
+        '''@param name     (Type: str) Name of the C function.
+           @param argtypes (Type: list) ctypes argument types or None to
+                leave them unchecked.
+        '''
+
+        self._c_name = name
+        self._argtypes = argtypes
+
+    def __set_name__(self, owner, name):
+        self._owner = owner
+        self._attribute_name = name
+
+    def __get__(self, instance, owner=None):
+        function = _bind(self._c_name, self._argtypes)
+        setattr(self._owner, self._attribute_name, function)
+        return function
+
 def get_library_version():
     '''Retrieves and returns the current API version.'''
 
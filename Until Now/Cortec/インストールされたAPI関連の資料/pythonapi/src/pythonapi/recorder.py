@@ -0,0 +1,622 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring recorder
+
+    Recording of measurement data into memory-mapped files.
+
+    A recording consists of two files:
+
+    - The data file: a fixed header of HEADER_SIZE bytes followed by
+        one fixed-size record per sample (see record_dtype). The header
+        holds the number of channels, the sampling rate, the device ids
+        and the number of samples written so far.
+    - The index file (data file name + INDEX_SUFFIX): one entry per 
+        segment of consecutive measurement counters, i.e. a new entry 
+        is written whenever samples were lost or the counter was reset.
+
+    Since all records have the same size, the offset of a sample is
+    HEADER_SIZE + index * record size. The index maps a measurement 
+    counter to the sample index with a binary search over the segments
+    of each run of increasing counters (a new run starts whenever the
+    counter was reset, e.g. by a new measurement).
+
+    The number of samples in the header is updated after the records 
+    and the index entries were written, so a RecordingReader can open
+    the file while it is still being written and only ever sees 
+    complete samples.
+
+    Typical usage:
+    1. Create the recorder: recorder = SampleRecorder.from_info(path, implant.implant_info)
+    2. Register the listener: implant.register_listener(RecordingListener(recorder, listener))
+    3. Call close() of the RecordingListener after unregistering it.
+'''
+import mmap
+import struct
+import time
+from threading import Thread
+from typing import Dict, Sequence
+
+import numpy as np
+
+from pythonapi.implantinfo import ImplantInfo
+from pythonapi.externalunitinfo import ExternalUnitInfo
+from pythonapi.implantlistener import ImplantListener, ConnectionType, ConnectionState, Sample
+from pythonapi.sampleblock import SampleBlock
+from pythonapi.gapdetection import COUNTER_MODULO, _MAX_GAP
+from pythonapi.dispatchinglistener import OverflowPolicy, _SpscQueue
+
+RECORDING_MAGIC = b"CTECREC\0"
+RECORDING_VERSION = 1
+HEADER_SIZE = 256
+INDEX_SUFFIX = ".idx"
+
+# magic, version, header size, channels, sampling rate, record size, reserved,
+# number of samples, start time, implant device id, external unit device id
+_HEADER_FORMAT = "<8sIIIIIIQd64s64s"
+_NUM_SAMPLES_FORMAT = "<Q"
+_NUM_SAMPLES_OFFSET = struct.calcsize("<8sIIIIII")
+_DEVICE_ID_LENGTH = 64
+
+# Sample index of the first sample of a segment and its counter
+_INDEX_DTYPE = np.dtype([('sample_index', '<u8'), ('first_counter', '<u4'), ('reserved', '<u4')])
+
+def record_dtype(num_channels: int) -> np.dtype:
+    '''NumPy data type of one record of the data file.
+
+        The measurements start at byte 16 so that they are aligned.
+
+       @param num_channels (Type: int) Number of measurement channels.
+    '''
+
+    return np.dtype([('measurement_counter', '<u4'),
+                     ('supply_voltage_mV', '<u4'),
+                     ('stimulation_id', '<u2'),
+                     ('flags', 'u1'),
+                     ('reserved', 'u1', (5,)),
+                     ('measurements', '<f8', (num_channels,))])
+
+def _encode_device_id(device_id: str) -> bytes:
+    encoded = device_id.encode("utf-8")
+    if len(encoded) > _DEVICE_ID_LENGTH:
+        raise ValueError(f"Device id must not be longer than {_DEVICE_ID_LENGTH} bytes.")
+    return encoded
+
+class SampleRecorder():
+    '''Appends samples to a recording.
+
+        The data file grows in steps of chunk_samples records and is 
+        memory-mapped, so appending a block is a single array copy. On
+        close the file is truncated to the written samples (if the
+        operating system allows it while readers have it mapped,
+        otherwise the unused tail remains and is ignored by readers).
+
+        Not thread-safe: all methods have to be called from the same
+        thread, e.g. the writer thread of a RecordingListener.
+    '''
+
+    def __init__(self, path: str, num_channels: int, sampling_rate: int, implant_device_id: str = "",
+                 external_unit_device_id: str = "", chunk_samples: int = 65536):
+        '''Create (or overwrite) a recording.
+
+           @param path                    (Type: str) Path of the data 
+                file.
+           @param num_channels            (Type: int) Number of 
+                measurements per sample.
+           @param sampling_rate           (Type: int) Sampling rate in Hz.
+           @param implant_device_id       (Type: str) Id of the implant.
+           @param external_unit_device_id (Type: str) Id of the external
+                unit.
+           @param chunk_samples           (Type: int) Number of records
+                by which the file grows.
+        '''
+
+        self._path = path
+        self._dtype = record_dtype(num_channels)
+        self._num_channels = num_channels
+        self._chunk_samples = max(1, chunk_samples)
+
+        self._num_samples = 0
+        self._capacity = 0
+        self._last_counter = None
+        self._map = None
+        self._records = None
+
+        header = struct.pack(_HEADER_FORMAT, RECORDING_MAGIC, RECORDING_VERSION, HEADER_SIZE, num_channels,
+                             sampling_rate, self._dtype.itemsize, 0, 0, time.time(),
+                             _encode_device_id(implant_device_id), _encode_device_id(external_unit_device_id))
+
+        self._file = open(path, "w+b")
+        self._file.write(header.ljust(HEADER_SIZE, b"\0"))
+        self._file.flush()
+        self._index_file = open(path + INDEX_SUFFIX, "wb")
+        self._grow(self._chunk_samples)
+
+    @classmethod
+    def from_info(cls, path: str, implant_info: ImplantInfo, external_unit_info: ExternalUnitInfo = None,
+                  chunk_samples: int = 65536):
+        '''Create a recording for an implant, taking the number of
+            channels, the sampling rate and the device ids from the
+            device information.
+
+           @param path               (Type: str) Path of the data file.
+           @param implant_info       (Type: ImplantInfo) Information of
+                the recorded implant.
+           @param external_unit_info (Type: ExternalUnitInfo) Information
+                of the external unit (optional).
+           @param chunk_samples      (Type: int) Number of records by 
+                which the file grows.
+        '''
+
+        external_unit_device_id = external_unit_info.device_id if external_unit_info is not None else ""
+        return cls(path, implant_info.measurement_channel_count, implant_info.sampling_rate,
+                   implant_info.device_id, external_unit_device_id, chunk_samples)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_samples(self) -> int:
+        '''Number of samples written.'''
+        return self._num_samples
+
+    @property
+    def num_channels(self) -> int:
+        '''Number of measurements per sample.'''
+        return self._num_channels
+
+    @property
+    def path(self) -> str:
+        '''Path of the data file.'''
+        return self._path
+
+    def _grow(self, min_capacity: int):
+        '''Enlarge the data file to hold at least min_capacity records.'''
+
+        capacity = max(min_capacity, self._capacity + self._chunk_samples)
+
+        # The array has to be released before the mapping can be closed
+        self._records = None
+        if self._map is not None:
+            self._map.close()
+
+        self._file.truncate(HEADER_SIZE + capacity * self._dtype.itemsize)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._records = np.ndarray((capacity,), dtype=self._dtype, buffer=self._map, offset=HEADER_SIZE)
+        self._capacity = capacity
+
+    def _update_index(self, counters: np.ndarray):
+        '''Write index entries for all samples not continuing the
+            counter of their predecessor.
+        '''
+
+        counters = counters.astype(np.int64)
+        previous = np.empty_like(counters)
+        previous[0] = self._last_counter if self._last_counter is not None else counters[0] - 2
+        previous[1:] = counters[:-1]
+        self._last_counter = int(counters[-1])
+
+        segment_starts = np.flatnonzero((counters - previous) % COUNTER_MODULO != 1)
+        if len(segment_starts) == 0:
+            return
+
+        entries = np.zeros(len(segment_starts), dtype=_INDEX_DTYPE)
+        entries['sample_index'] = self._num_samples + segment_starts
+        entries['first_counter'] = counters[segment_starts]
+        self._index_file.write(entries.tobytes())
+        self._index_file.flush()
+
+    def append_block(self, block: SampleBlock):
+        '''Append the samples of a block.
+
+           @param block (Type: SampleBlock) Samples with num_channels
+                measurements.
+        '''
+
+        num_samples = len(block)
+        if num_samples == 0:
+            return
+        if block.num_measurements != self._num_channels:
+            raise ValueError(f"Expected {self._num_channels} measurements per sample, "
+                             f"got {block.num_measurements}.")
+
+        self._update_index(block.measurement_counter)
+
+        end = self._num_samples + num_samples
+        if end > self._capacity:
+            self._grow(end)
+
+        records = self._records[self._num_samples:end]
+        records['measurement_counter'] = block.measurement_counter
+        records['supply_voltage_mV'] = block.supply_voltage_mV
+        records['stimulation_id'] = block.stimulation_id
+        records['flags'] = block.flags
+        records['measurements'] = block.measurements
+
+        # Publish the samples to readers only after they were written
+        self._num_samples = end
+        struct.pack_into(_NUM_SAMPLES_FORMAT, self._map, _NUM_SAMPLES_OFFSET, end)
+
+    def append_samples(self, samples: Sequence[Sample]):
+        '''Append Sample objects.
+
+           @param samples (Type: Sequence[Sample]) Samples with 
+                num_channels measurements.
+        '''
+
+        if len(samples) > 0:
+            self.append_block(SampleBlock.from_samples(samples))
+
+    def flush(self):
+        '''Write the mapped data to disk.'''
+
+        self._map.flush()
+        self._index_file.flush()
+
+    def close(self):
+        '''Flush and close the files.'''
+
+        if self._file.closed:
+            return
+
+        self.flush()
+        self._records = None
+        self._map.close()
+        try:
+            self._file.truncate(HEADER_SIZE + self._num_samples * self._dtype.itemsize)
+        except OSError:
+            pass
+        self._file.close()
+        self._index_file.close()
+
+class RecordingReader():
+    '''Read access to a recording, also while it is being written.
+
+        Call refresh() to see samples appended after the reader was
+        opened. Blocks returned by read are read-only views into the
+        memory-mapped file; use SampleBlock.copy() to modify them.
+    '''
+
+    def __init__(self, path: str):
+        '''@param path (Type: str) Path of the data file.'''
+
+        self._path = path
+        self._file = open(path, "rb")
+
+        header = self._file.read(struct.calcsize(_HEADER_FORMAT))
+        if len(header) < struct.calcsize(_HEADER_FORMAT):
+            raise ValueError(f"{path} is not a recording.")
+
+        magic, version, header_size, num_channels, sampling_rate, record_size, _, _, start_time, \
+            implant_device_id, external_unit_device_id = struct.unpack(_HEADER_FORMAT, header)
+        if magic != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a recording.")
+        if version != RECORDING_VERSION or header_size != HEADER_SIZE:
+            raise ValueError(f"Unsupported recording version {version}.")
+
+        self._dtype = record_dtype(num_channels)
+        if record_size != self._dtype.itemsize:
+            raise ValueError(f"Unexpected record size {record_size} in {path}.")
+
+        self.num_channels = num_channels
+        self.sampling_rate = sampling_rate
+        self.start_time = start_time
+        self.implant_device_id = implant_device_id.rstrip(b"\0").decode("utf-8")
+        self.external_unit_device_id = external_unit_device_id.rstrip(b"\0").decode("utf-8")
+
+        self._map = None
+        self._records = None
+        self._num_samples = 0
+        self._segment_starts = np.zeros(0, dtype=np.int64)
+        self._segment_lengths = np.zeros(0, dtype=np.int64)
+        self._segment_unwrapped = np.zeros(0, dtype=np.int64)
+        self._runs = []
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._num_samples
+
+    @property
+    def num_samples(self) -> int:
+        '''Number of samples available since the last refresh.'''
+        return self._num_samples
+
+    @property
+    def num_segments(self) -> int:
+        '''Number of segments with consecutive counters.'''
+        return len(self._segment_starts)
+
+    def refresh(self):
+        '''Update the number of available samples and the index.'''
+
+        file_size = self._file.seek(0, 2)
+        if self._map is None or len(self._map) < file_size:
+            # Blocks returned earlier keep the previous mapping alive
+            self._map = mmap.mmap(self._file.fileno(), file_size, access=mmap.ACCESS_READ)
+
+        num_samples = struct.unpack_from(_NUM_SAMPLES_FORMAT, self._map, _NUM_SAMPLES_OFFSET)[0]
+        capacity = (len(self._map) - HEADER_SIZE) // self._dtype.itemsize
+        self._num_samples = min(num_samples, capacity)
+        self._records = np.ndarray((self._num_samples,), dtype=self._dtype, buffer=self._map, offset=HEADER_SIZE)
+
+        try:
+            with open(self._path + INDEX_SUFFIX, "rb") as index_file:
+                data = index_file.read()
+        except FileNotFoundError:
+            data = b""
+        entries = np.frombuffer(data[:len(data) - len(data) % _INDEX_DTYPE.itemsize], dtype=_INDEX_DTYPE)
+        entries = entries[entries['sample_index'] < self._num_samples]
+        self._build_index(entries['sample_index'].astype(np.int64), entries['first_counter'].astype(np.int64))
+
+    def _build_index(self, starts: np.ndarray, first_counters: np.ndarray):
+        '''Prepare the counter lookup: unwrap the first counter of each
+            segment and split the segments into runs at counter resets.
+            Within a run the unwrapped counters increase, so a lookup is
+            a binary search.
+        '''
+
+        lengths = np.diff(np.append(starts, self._num_samples))
+        if len(starts) == 0:
+            run_starts = np.zeros(0, dtype=np.int64)
+            unwrapped = np.zeros(0, dtype=np.int64)
+        else:
+            # Counter step from the last sample of a segment to the first of the next one
+            steps = (first_counters[1:] - (first_counters[:-1] + lengths[:-1] - 1)) % COUNTER_MODULO
+            is_reset = (steps - 1) % COUNTER_MODULO >= _MAX_GAP
+            run_starts = np.append(0, np.flatnonzero(is_reset) + 1)
+
+            # Unwrapped counters continue within a run and start at the
+            # counter of the first segment of every run
+            increments = np.append(0, lengths[:-1] - 1 + steps)
+            increments[run_starts] = 0
+            cumulative = np.cumsum(increments)
+            is_run_start = np.zeros(len(starts), dtype=np.int64)
+            is_run_start[run_starts] = 1
+            run_of_segment = np.cumsum(is_run_start) - 1
+            unwrapped = first_counters[run_starts][run_of_segment] + cumulative
+            unwrapped -= cumulative[run_starts][run_of_segment]
+
+        self._segment_starts = starts
+        self._segment_lengths = lengths
+        self._segment_unwrapped = unwrapped
+        self._runs = list(zip(run_starts.tolist(), np.append(run_starts[1:], len(starts)).tolist()))
+
+    def read(self, start: int, stop: int) -> SampleBlock:
+        '''Get the samples with indices start to stop - 1.
+
+           @param start (Type: int) Index of the first sample.
+           @param stop  (Type: int) Index after the last sample.
+        '''
+
+        records = self._records[start:stop]
+        return SampleBlock(records['measurements'], records['supply_voltage_mV'], records['measurement_counter'],
+                           records['stimulation_id'], records['flags'])
+
+    def index_of_counter(self, counter: int) -> int:
+        '''Get the index of the first sample with the given measurement
+            counter or None if the counter was not recorded.
+
+           @param counter (Type: int) The measurement counter.
+        '''
+
+        for run_start, run_stop in self._runs:
+            unwrapped = self._segment_unwrapped[run_start:run_stop]
+            last = unwrapped[-1] + self._segment_lengths[run_stop - 1] - 1
+
+            # A run may span several wrap-arounds of the counter
+            candidate = unwrapped[0] + (counter - unwrapped[0]) % COUNTER_MODULO
+            while candidate <= last:
+                segment = run_start + int(np.searchsorted(unwrapped, candidate, 'right')) - 1
+                offset = candidate - self._segment_unwrapped[segment]
+                if offset < self._segment_lengths[segment]:
+                    return int(self._segment_starts[segment] + offset)
+                candidate += COUNTER_MODULO
+
+        return None
+
+    def read_from_counter(self, counter: int, num_samples: int) -> SampleBlock:
+        '''Get num_samples samples starting at the sample with the given
+            measurement counter. Returns None if the counter was not
+            recorded.
+
+           @param counter     (Type: int) Measurement counter of the first
+                sample.
+           @param num_samples (Type: int) Maximum number of samples.
+        '''
+
+        start = self.index_of_counter(counter)
+        if start is None:
+            return None
+        return self.read(start, start + num_samples)
+
+    def close(self):
+        '''Close the file. The mapping stays valid as long as blocks
+            returned by read are referenced.
+        '''
+
+        self._records = None
+        self._map = None
+        self._file.close()
+
+class RecordingListener(ImplantListener):
+    '''ImplantListener writing the measurement data to a SampleRecorder
+        on a dedicated writer thread.
+
+        The callback thread only queues the data, so writing never
+        delays the C api. If the writer cannot keep up and capacity 
+        data events are queued, further data is dropped and counted in
+        statistics (the recording then contains a gap which is visible
+        in the index). All events are additionally forwarded to the 
+        wrapped listener on the callback thread, if one is given.
+    '''
+
+    def __init__(self, recorder: SampleRecorder, listener: ImplantListener = None, capacity: int = 4096,
+                 batch_size: int = 256):
+        '''Create the listener and start its writer thread.
+
+           @param recorder   (Type: SampleRecorder) The recording to write
+                to. It is closed by close().
+           @param listener   (Type: ImplantListener) Listener receiving
+                all events (optional).
+           @param capacity   (Type: int) Maximum number of queued data
+                events (samples or blocks).
+           @param batch_size (Type: int) Maximum number of events written
+                at once.
+        '''
+
+        self._recorder = recorder
+        self._listener = listener
+        self._queue = _SpscQueue(capacity, OverflowPolicy.OVERFLOW_DROP_NEWEST)
+        self._batch_size = batch_size
+
+        self.write_errors = 0
+        self.last_error = None
+
+        self._writer = Thread(target=self._write, name="RecordingListener", daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self, timeout: float = None):
+        '''Write the remaining data, stop the writer thread and close the
+            recorder.
+
+           @param timeout (Type: float) Maximum time in seconds to wait
+                for the writer thread.
+        '''
+
+        self._queue.close()
+        self._writer.join(timeout)
+        if not self._writer.is_alive():
+            self._recorder.close()
+
+    @property
+    def statistics(self) -> Dict[str, int]:
+        '''Counters of the listener.
+
+            - written_samples: Samples in the recording.
+            - dropped:         Data events discarded because the queue
+                was full.
+            - queued:          Data events currently queued.
+            - write_errors:    Exceptions raised while writing.
+        '''
+
+        return {"written_samples": self._recorder.num_samples,
+                "dropped": self._queue.dropped_newest,
+                "queued": len(self._queue),
+                "write_errors": self.write_errors}
+
+    def _write(self):
+        '''Main loop of the writer thread.'''
+
+        queue = self._queue
+        while True:
+            batch = queue.get_batch(self._batch_size)
+            if not batch:
+                if queue.closed:
+                    return
+                continue
+
+            # Consecutive samples are written as one block
+            samples = []
+            for item in batch:
+                try:
+                    if isinstance(item, SampleBlock):
+                        if samples:
+                            self._recorder.append_samples(samples)
+                            samples = []
+                        self._recorder.append_block(item)
+                    else:
+                        samples.append(item)
+                except Exception as e:
+                    samples = []
+                    self.write_errors += 1
+                    self.last_error = e
+
+            try:
+                self._recorder.append_samples(samples)
+            except Exception as e:
+                self.write_errors += 1
+                self.last_error = e
+
+    def on_stimulation_state_changed(self, is_stimulating: bool):
+        if self._listener is not None:
+            self._listener.on_stimulation_state_changed(is_stimulating)
+
+    def on_measurement_state_changed(self, is_measuring: bool):
+        if self._listener is not None:
+            self._listener.on_measurement_state_changed(is_measuring)
+
+    def on_connection_state_changed(self, connection_type: ConnectionType, connection_state: ConnectionState):
+        if self._listener is not None:
+            self._listener.on_connection_state_changed(connection_type, connection_state)
+
+    def on_data(self, sample: Sample):
+        measurements = sample.measurements
+        if isinstance(measurements, np.ndarray) and not measurements.flags.owndata:
+            sample.measurements = measurements.copy()
+        self._queue.put(sample)
+        if self._listener is not None:
+            self._listener.on_data(sample)
+
+    def on_data_block(self, block: SampleBlock):
+        self._queue.put(block.copy())
+        if self._listener is not None:
+            self._listener.on_data_block(block)
+
+    def on_implant_voltage_changed(self, voltage_V: float):
+        if self._listener is not None:
+            self._listener.on_implant_voltage_changed(voltage_V)
+
+    def on_primary_coil_current_changed(self, current_mA: float):
+        if self._listener is not None:
+            self._listener.on_primary_coil_current_changed(current_mA)
+
+    def on_implant_control_value_changed(self, control_value: float):
+        if self._listener is not None:
+            self._listener.on_implant_control_value_changed(control_value)
+
+    def on_temperature_changed(self, temperature: float):
+        if self._listener is not None:
+            self._listener.on_temperature_changed(temperature)
+
+    def on_humidity_changed(self, humidity: float):
+        if self._listener is not None:
+            self._listener.on_humidity_changed(humidity)
+
+    def on_error(self, error_description: str):
+        if self._listener is not None:
+            self._listener.on_error(error_description)
+
+    def on_data_processing_too_slow(self):
+        if self._listener is not None:
+            self._listener.on_data_processing_too_slow()
+
+    def on_stimulation_function_finished(self, num_executed_functions: int):
+        if self._listener is not None:
+            self._listener.on_stimulation_function_finished(num_executed_functions)
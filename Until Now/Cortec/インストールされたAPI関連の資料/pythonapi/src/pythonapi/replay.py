@@ -0,0 +1,279 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring replay
+
+    Replay of recorded or otherwise stored measurement data through an
+    ImplantListener without an implant.
+
+    The samples are passed through the same bridge as the data of the 
+    C api (_ListenerBridge), so block mode, measurement modes, gap
+    filling and instrumentation behave exactly as for a registered 
+    listener. State changes of the samples (is_connected and 
+    is_stimulation_active) are reported through the respective 
+    callbacks as well.
+
+    Typical usage:
+
+        replay = ImplantReplay(listener, block_size=256)
+        replay.run(replay_recording("session.bin"), PacingMode.PACING_AS_FAST_AS_POSSIBLE)
+'''
+from ctypes import c_double, memmove, pointer
+from enum import IntEnum
+from threading import Event, Thread
+from time import perf_counter, sleep
+from typing import Callable, Dict, Iterator
+
+import numpy as np
+
+from pythonapi.implantlistener import ImplantListener, ConnectionType, ConnectionState, MeasurementMode, \
+    _CtypesSample, _ListenerBridge
+from pythonapi.sampleblock import SampleBlock
+from pythonapi.gapdetection import GapFillPolicy, COUNTER_MODULO
+from pythonapi.instrumentation import CallbackInstrumentation
+from pythonapi.recorder import RecordingReader
+
+class PacingMode(IntEnum):
+    '''Enumeration of the replay speeds.
+
+        - PACING_REALTIME:             One sample per sampling period.
+        - PACING_SPEED:                speed times faster than real time.
+        - PACING_AS_FAST_AS_POSSIBLE:  Without waiting, e.g. to measure
+            the throughput of offline processing.
+    '''
+
+    PACING_REALTIME = 0
+    PACING_SPEED = 1
+    PACING_AS_FAST_AS_POSSIBLE = 2
+
+class ReplaySource():
+    '''Samples to replay, provided as blocks.
+
+        - blocks:        Iterator of SampleBlock objects.
+        - sampling_rate: Sampling rate in Hz, used for pacing.
+
+        close() releases the resources of the source (e.g. the file of
+        a recording). ImplantReplay.run closes the source after the 
+        replay, otherwise use it as context manager.
+    '''
+
+    def __init__(self, blocks: Iterator[SampleBlock], sampling_rate: float, close: Callable[[], None] = None):
+        self.blocks = blocks
+        self.sampling_rate = sampling_rate
+        self._close = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Release the resources of the source.'''
+
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+def replay_recording(path: str, chunk_samples: int = 4096, start: int = 0, stop: int = None) -> ReplaySource:
+    '''Create a source replaying a recording of a SampleRecorder.
+
+       @param path          (Type: str) Path of the data file.
+       @param chunk_samples (Type: int) Number of samples read at once.
+       @param start         (Type: int) Index of the first sample.
+       @param stop          (Type: int) Index after the last sample, 
+            defaults to the end of the recording.
+    '''
+
+    reader = RecordingReader(path)
+
+    def blocks():
+        try:
+            end = len(reader) if stop is None else min(stop, len(reader))
+            for first in range(start, end, chunk_samples):
+                yield reader.read(first, min(first + chunk_samples, end))
+        finally:
+            reader.close()
+
+    return ReplaySource(blocks(), reader.sampling_rate, reader.close)
+
+def replay_csv(path: str, sampling_rate: float, delimiter: str = ",", skip_rows: int = 0,
+               supply_voltage_mV: int = 0, chunk_samples: int = 4096) -> ReplaySource:
+    '''Create a source replaying a CSV file with one sample per row and
+        one column per channel.
+
+        The samples get consecutive measurement counters starting at 0,
+        are flagged as connected and have no stimulation.
+
+       @param path              (Type: str) Path of the CSV file.
+       @param sampling_rate     (Type: float) Sampling rate of the data
+            in Hz.
+       @param delimiter         (Type: str) Column separator.
+       @param skip_rows         (Type: int) Number of header rows.
+       @param supply_voltage_mV (Type: int) Supply voltage of all samples.
+       @param chunk_samples     (Type: int) Number of samples per block.
+    '''
+
+    measurements = np.loadtxt(path, delimiter=delimiter, skiprows=skip_rows, ndmin=2, dtype=np.float64)
+
+    def blocks():
+        for first in range(0, len(measurements), chunk_samples):
+            chunk = measurements[first:first + chunk_samples]
+            num_samples = len(chunk)
+            yield SampleBlock(chunk,
+                              np.full(num_samples, supply_voltage_mV, dtype=np.uint32),
+                              (np.arange(first, first + num_samples) % COUNTER_MODULO).astype(np.uint32),
+                              np.zeros(num_samples, dtype=np.uint16),
+                              np.full(num_samples, SampleBlock.FLAG_IS_CONNECTED, dtype=np.uint8))
+
+    return ReplaySource(blocks(), sampling_rate)
+
+class ImplantReplay():
+    '''Feeds samples of a ReplaySource to an ImplantListener.
+
+        The listener receives on_connection_state_changed (implant
+        connected) and on_measurement_state_changed(True) before the 
+        first sample, on_stimulation_state_changed and
+        on_connection_state_changed whenever the respective flags of 
+        the samples change, and on_measurement_state_changed(False) 
+        after the last sample.
+    '''
+
+    def __init__(self, listener: ImplantListener, block_size: int = None, block_interval_ms: float = None,
+                 measurement_mode: MeasurementMode = MeasurementMode.MEASUREMENT_LIST, gap_fill: GapFillPolicy = None,
+                 instrumentation: CallbackInstrumentation = None):
+        '''The parameters have the same meaning as for 
+            Implant.register_listener.
+        '''
+
+        self._bridge = _ListenerBridge(listener, block_size, block_interval_ms, measurement_mode, gap_fill,
+                                       instrumentation)
+        self._stop = Event()
+        self._thread = None
+        self.statistics: Dict[str, float] = {}
+
+    @property
+    def counter_tracker(self):
+        '''Tracker of the measurement counters of the replayed samples.'''
+        return self._bridge.counter_tracker
+
+    def run(self, source: ReplaySource, pacing: PacingMode = PacingMode.PACING_REALTIME,
+            speed: float = 1.) -> Dict[str, float]:
+        '''Replay all samples of the source, close it and return 
+            statistics.
+
+           @param source (Type: ReplaySource) The samples.
+           @param pacing (Type: PacingMode) Replay speed.
+           @param speed  (Type: float) Speed factor for PACING_SPEED.
+        '''
+
+        if pacing == PacingMode.PACING_AS_FAST_AS_POSSIBLE:
+            sample_rate = None
+        else:
+            factor = speed if pacing == PacingMode.PACING_SPEED else 1.
+            if source.sampling_rate <= 0 or factor <= 0:
+                raise ValueError("Sampling rate and speed must be positive for paced replay.")
+            sample_rate = source.sampling_rate * factor
+
+        self._stop.clear()
+        callbacks = self._bridge._ctypes_listener
+        on_data = callbacks.onData
+
+        c_sample = _CtypesSample()
+        c_sample_pointer = pointer(c_sample)
+        measurement_buffer = None
+        is_connected = None
+        is_stimulation_active = False
+
+        callbacks.onMeasurementStateChanged(True)
+
+        num_samples = 0
+        start_time = perf_counter()
+        # Samples are released in groups of about one millisecond when paced
+        pacing_group = max(1, int(sample_rate / 1000)) if sample_rate is not None else 0
+
+        try:
+            for block in source.blocks:
+                if self._stop.is_set():
+                    break
+
+                num_measurements = block.num_measurements
+                if measurement_buffer is None or len(measurement_buffer) != num_measurements:
+                    measurement_buffer = (c_double * num_measurements)()
+                    c_sample.numberOfMeasurements = num_measurements
+                    c_sample.measurements = measurement_buffer
+
+                measurements = np.ascontiguousarray(block.measurements, dtype=np.float64)
+                row_bytes = measurements.strides[0]
+                address = measurements.ctypes.data
+                flags = block.flags.tolist()
+                supply_voltages = block.supply_voltage_mV.tolist()
+                counters = block.measurement_counter.tolist()
+                stimulation_ids = block.stimulation_id.tolist()
+
+                for row in range(len(block)):
+                    connected = bool(flags[row] & SampleBlock.FLAG_IS_CONNECTED)
+                    if connected != is_connected:
+                        is_connected = connected
+                        callbacks.onConnectionStateChanged(ConnectionType.CON_TYPE_EXT_TO_IMPLANT,
+                                                           ConnectionState.CON_STATE_CONNECTED if connected \
+                                                           else ConnectionState.CON_STATE_DISCONNECTED)
+
+                    stimulation_active = bool(flags[row] & SampleBlock.FLAG_IS_STIMULATION_ACTIVE)
+                    if stimulation_active != is_stimulation_active:
+                        is_stimulation_active = stimulation_active
+                        callbacks.onStimulationStateChanged(stimulation_active)
+
+                    if sample_rate is not None and num_samples % pacing_group == 0:
+                        delay = start_time + num_samples / sample_rate - perf_counter()
+                        if delay > 0:
+                            sleep(delay)
+
+                    memmove(measurement_buffer, address + row * row_bytes, row_bytes)
+                    c_sample.supplyVoltageMilliV = supply_voltages[row]
+                    c_sample.isConnected = connected
+                    c_sample.stimulationId = stimulation_ids[row]
+                    c_sample.isStimulationActive = stimulation_active
+                    c_sample.measurementCounter = counters[row]
+                    on_data(c_sample_pointer)
+                    num_samples += 1
+        finally:
+            # Also if the source failed, e.g. on a damaged file
+            source.close()
+            callbacks.onMeasurementStateChanged(False)
+
+        elapsed = perf_counter() - start_time
+        self.statistics = {"samples": num_samples,
+                           "elapsed_s": elapsed,
+                           "samples_per_s": num_samples / elapsed if elapsed > 0 else 0.}
+        return self.statistics
+
+    def start(self, source: ReplaySource, pacing: PacingMode = PacingMode.PACING_REALTIME, speed: float = 1.):
+        '''Run the replay on a background thread, like the callback 
+            thread of the C api. The parameters are the same as for run.
+        '''
+
+        self._thread = Thread(target=self.run, args=(source, pacing, speed), name="ImplantReplay", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the replay after the current block.'''
+        self._stop.set()
+
+    def join(self, timeout: float = None):
+        '''Wait for a replay started with start() to finish.'''
+
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,231 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring sampleblock
+
+    Block representation of measurement data, i.e. many consecutive
+    samples stored column-wise in NumPy arrays instead of one Sample
+    object per point in time.
+'''
+from typing import List, Sequence
+
+import numpy as np
+
+# Sample.stimulation_id of samples with which no stimulation started
+SAMPLE_NO_STIMULATION = 0
+
+class SampleBlock():
+    '''Measurement data of several consecutive samples.
+
+        An instance holds the following arrays, each with one entry
+        (row) per sample:
+
+        - measurements: 2-D float32 or float64 array of shape
+            (num_samples, num_measurements).
+        - supply_voltage_mV: Supply voltage in mV (uint32).
+        - measurement_counter: Counter of the implant for each sample
+            (uint32).
+        - stimulation_id: Id of the stimulation which starts with the
+            sample or SAMPLE_NO_STIMULATION (uint16).
+        - flags: Bit field (uint8) holding is_connected 
+            (FLAG_IS_CONNECTED) and is_stimulation_active 
+            (FLAG_IS_STIMULATION_ACTIVE). FLAG_IS_GAP_FILL marks
+            placeholders for lost samples, FLAG_IS_DISCONTINUITY a
+            sample following lost samples that were not replaced by
+            placeholders (see gapdetection).
+
+        host_timestamp holds the time.perf_counter() value at which the
+        block was completed on the host.
+
+        Compared to a list of Sample objects a block needs no Python
+        object per sample or channel. Slicing (block[a:b]) and channel
+        access (block.channel(i)) return views without copying.
+    '''
+
+    __slots__ = ('measurements', 'supply_voltage_mV', 'measurement_counter', 'stimulation_id', 'flags',
+                 'host_timestamp')
+
+    FLAG_IS_CONNECTED = 0x01
+    FLAG_IS_STIMULATION_ACTIVE = 0x02
+    FLAG_IS_GAP_FILL = 0x04
+    FLAG_IS_DISCONTINUITY = 0x08
+
+    def __init__(self, measurements: np.ndarray, supply_voltage_mV: np.ndarray, measurement_counter: np.ndarray, \
+                 stimulation_id: np.ndarray, flags: np.ndarray, host_timestamp: float = 0.):
+        self.measurements = measurements
+        self.supply_voltage_mV = supply_voltage_mV
+        self.measurement_counter = measurement_counter
+        self.stimulation_id = stimulation_id
+        self.flags = flags
+        self.host_timestamp = host_timestamp
+
+    @classmethod
+    def empty(cls, num_samples: int, num_measurements: int, dtype=np.float64):
+        '''Create a block with uninitialized arrays.
+
+           @param num_samples      (Type: int) Number of samples.
+           @param num_measurements (Type: int) Number of channels.
+           @param dtype            Data type of the measurements 
+                (numpy.float32 or numpy.float64).
+        '''
+
+        return cls(np.empty((num_samples, num_measurements), dtype=dtype),
+                   np.empty(num_samples, dtype=np.uint32),
+                   np.empty(num_samples, dtype=np.uint32),
+                   np.empty(num_samples, dtype=np.uint16),
+                   np.empty(num_samples, dtype=np.uint8))
+
+    @classmethod
+    def from_samples(cls, samples: Sequence, dtype=np.float64):
+        '''Convert a sequence of Sample objects into a block.
+
+           @param samples (Type: Sequence[Sample]) Samples with equal
+                number of measurements.
+           @param dtype   Data type of the measurements.
+        '''
+
+        num_measurements = samples[0].num_measurements if len(samples) > 0 else 0
+        block = cls.empty(len(samples), num_measurements, dtype)
+        for row, sample in enumerate(samples):
+            block.measurements[row] = sample.measurements
+            block.supply_voltage_mV[row] = sample.supply_voltage_mV
+            block.measurement_counter[row] = sample.measurement_counter
+            block.stimulation_id[row] = sample.stimulation_id
+            block.flags[row] = pack_flags(sample.is_connected, sample.is_stimulation_active)
+        return block
+
+    @classmethod
+    def concatenate(cls, blocks: List['SampleBlock']):
+        '''Join blocks with the same number of channels into a new
+            block. The host timestamp of the last block is kept.
+
+           @param blocks (Type: List[SampleBlock]) Blocks in temporal
+                order.
+        '''
+
+        if len(blocks) == 0:
+            raise ValueError("At least one block is required.")
+
+        return cls(np.concatenate([block.measurements for block in blocks]),
+                   np.concatenate([block.supply_voltage_mV for block in blocks]),
+                   np.concatenate([block.measurement_counter for block in blocks]),
+                   np.concatenate([block.stimulation_id for block in blocks]),
+                   np.concatenate([block.flags for block in blocks]),
+                   blocks[-1].host_timestamp)
+
+    def __len__(self):
+        return self.measurements.shape[0]
+
+    def __getitem__(self, index):
+        '''Select samples of the block.
+
+            Slices return views of the same data, index arrays and 
+            boolean masks return copies (NumPy semantics). Single 
+            integers are not supported, use a slice of length one.
+
+           @param index A slice, an integer array or a boolean mask.
+        '''
+
+        if isinstance(index, (int, np.integer)):
+            raise TypeError("SampleBlock indices must be slices or arrays, not integers.")
+
+        return type(self)(self.measurements[index],
+                          self.supply_voltage_mV[index],
+                          self.measurement_counter[index],
+                          self.stimulation_id[index],
+                          self.flags[index],
+                          self.host_timestamp)
+
+    @property
+    def num_samples(self) -> int:
+        '''Number of samples in the block.'''
+        return self.measurements.shape[0]
+
+    @property
+    def num_measurements(self) -> int:
+        '''Number of channels used for measuring.'''
+        return self.measurements.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        '''Number of bytes used by the arrays of the block.'''
+        return self.measurements.nbytes + self.supply_voltage_mV.nbytes + self.measurement_counter.nbytes \
+            + self.stimulation_id.nbytes + self.flags.nbytes
+
+    @property
+    def is_connected(self) -> np.ndarray:
+        '''Boolean array telling whether the implant was connected.'''
+        return (self.flags & self.FLAG_IS_CONNECTED) != 0
+
+    @property
+    def is_stimulation_active(self) -> np.ndarray:
+        '''Boolean array telling whether a stimulation was active.'''
+        return (self.flags & self.FLAG_IS_STIMULATION_ACTIVE) != 0
+
+    @property
+    def is_gap_fill(self) -> np.ndarray:
+        '''Boolean array telling whether a sample is a placeholder for a
+            lost sample.
+        '''
+        return (self.flags & self.FLAG_IS_GAP_FILL) != 0
+
+    @property
+    def is_discontinuity(self) -> np.ndarray:
+        '''Boolean array telling whether lost samples precede a sample
+            without placeholders in between.
+        '''
+        return (self.flags & self.FLAG_IS_DISCONTINUITY) != 0
+
+    def channel(self, index: int) -> np.ndarray:
+        '''Get the measurements of one channel as a (strided) view.
+
+           @param index (Type: int) The channel index.
+        '''
+        return self.measurements[:, index]
+
+    def channels(self, indices: Sequence[int]) -> np.ndarray:
+        '''Get the measurements of several channels. Contiguous 
+            ranges given as slice are views, other selections are
+            copies.
+
+           @param indices Slice or list of channel indices.
+        '''
+        return self.measurements[:, indices]
+
+    def astype(self, dtype):
+        '''Create a copy of the block with measurements converted to
+            dtype, e.g. numpy.float32 to halve the memory footprint.
+        '''
+
+        return type(self)(self.measurements.astype(dtype), self.supply_voltage_mV.copy(),
+                          self.measurement_counter.copy(), self.stimulation_id.copy(),
+                          self.flags.copy(), self.host_timestamp)
+
+    def copy(self):
+        '''Create a copy of the block owning its data.
+
+            Blocks passed to ImplantListener.on_data_block are views
+            into a ring buffer that is reused, so they need to be copied
+            if they are kept after the callback returned.
+        '''
+        return type(self)(self.measurements.copy(), self.supply_voltage_mV.copy(),
+                          self.measurement_counter.copy(), self.stimulation_id.copy(),
+                          self.flags.copy(), self.host_timestamp)
+
+def pack_flags(is_connected, is_stimulation_active):
+    '''Pack the boolean sample states into the flag representation of
+        SampleBlock. Works on scalars and arrays.
+    '''
+    return np.uint8(is_connected) | (np.uint8(is_stimulation_active) << 1)
@@ -0,0 +1,119 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring samplebuffer
+
+    Preallocated ring buffer collecting the samples delivered by the
+    C api into SampleBlock instances.
+'''
+from ctypes import memmove
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+
+from pythonapi.sampleblock import SampleBlock
+
+class _SampleRingBuffer():
+    '''Ring buffer storing samples column-wise.
+
+        The arrays are allocated once the first sample arrives (and
+        again if the number of measurement channels changes). A block
+        is handed to on_block whenever block_size samples were
+        collected, block_interval_ms elapsed since the first sample of
+        the block or the end of the buffer is reached. Handed out blocks
+        are views into the buffer and are overwritten once the buffer
+        wraps around.
+    '''
+
+    def __init__(self, block_size: int, block_interval_ms: float, on_block: Callable[[SampleBlock], None],
+                 num_blocks: int = 4):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1.")
+
+        self._block_size = block_size
+        self._block_interval = block_interval_ms / 1000. if block_interval_ms else None
+        self._capacity = block_size * num_blocks
+        self._on_block = on_block
+
+        self._num_measurements = None
+        self._write_pos = 0
+        self._block_start_pos = 0
+        self._block_start_time = 0.
+
+    def _allocate(self, num_measurements: int):
+        '''Allocate the buffer arrays for the given number of channels.'''
+
+        self._measurements = np.empty((self._capacity, num_measurements), dtype=np.float64)
+        self._measurements_address = self._measurements.ctypes.data
+        self._row_bytes = self._measurements.strides[0]
+        self._supply_voltage_mV = np.empty(self._capacity, dtype=np.uint32)
+        self._measurement_counter = np.empty(self._capacity, dtype=np.uint32)
+        self._stimulation_id = np.empty(self._capacity, dtype=np.uint16)
+        self._flags = np.empty(self._capacity, dtype=np.uint8)
+
+        self._num_measurements = num_measurements
+        self._write_pos = 0
+        self._block_start_pos = 0
+
+    def append(self, c_sample):
+        '''Copy a sample into the buffer and hand out a block if one is
+            complete.
+
+           @param c_sample (Type: _CtypesSample) The sample received from
+                the C api.
+        '''
+
+        num_measurements = c_sample.numberOfMeasurements
+        if num_measurements != self._num_measurements:
+            self.flush()
+            self._allocate(num_measurements)
+
+        row = self._write_pos
+        if row == self._block_start_pos:
+            self._block_start_time = perf_counter()
+
+        # One bulk copy from the C sample instead of a Python float per channel
+        memmove(self._measurements_address + row * self._row_bytes, c_sample.measurements, self._row_bytes)
+        self._supply_voltage_mV[row] = c_sample.supplyVoltageMilliV
+        self._measurement_counter[row] = c_sample.measurementCounter
+        self._stimulation_id[row] = c_sample.stimulationId
+        self._flags[row] = c_sample.isConnected | (c_sample.isStimulationActive << 1)
+        self._write_pos = row + 1
+
+        if self._write_pos - self._block_start_pos >= self._block_size or self._write_pos == self._capacity \
+                or (self._block_interval is not None and perf_counter() - self._block_start_time >= self._block_interval):
+            self.flush()
+
+    def flush(self):
+        '''Hand out the samples collected since the last block, if any.'''
+
+        start, end = self._block_start_pos, self._write_pos
+        if end == start:
+            return
+
+        block = SampleBlock(self._measurements[start:end],
+                            self._supply_voltage_mV[start:end],
+                            self._measurement_counter[start:end],
+                            self._stimulation_id[start:end],
+                            self._flags[start:end],
+                            perf_counter())
+
+        if end == self._capacity:
+            end = 0
+        self._write_pos = end
+        self._block_start_pos = end
+
+        self._on_block(block)
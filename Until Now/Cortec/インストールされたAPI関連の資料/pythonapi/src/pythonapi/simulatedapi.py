@@ -0,0 +1,1134 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring simulatedapi
+
+    Simulated stand-in for the cimplantapi C library.
+
+    SimulatedImplantAPI provides every C function used by this package
+    as a ctypes function pointer with the C signature of the headers in
+    capi/include. Calls therefore pass the same ctypes conversions as 
+    with the real library. The simulation consists of one external unit
+    with a connected implant. While a measurement is running, the 
+    registered listener is called from a background thread with
+    generated samples at the configured sampling rate.
+
+    The simulation is used instead of the C library if
+    - the environment variable CORTEC_CAPI_SIMULATION is set when the
+        api is loaded, either to "1" or to comma-separated keyword 
+        arguments of SimulatedImplantAPI, e.g. 
+        "num_channels=64,sampling_rate=2000", or
+    - use_simulated_api() is called before the api is used.
+'''
+import os
+from ctypes import CFUNCTYPE, POINTER, Structure, c_bool, c_double, c_int, c_size_t, c_uint16, c_uint32, \
+    c_uint64, c_void_p, cast, create_string_buffer, addressof, memmove, pointer, string_at
+from threading import Event, RLock, Thread, current_thread
+from time import perf_counter, sleep
+from typing import Dict, List
+
+import numpy as np
+
+import pythonapi.pythonapibase as pythonapibase
+from pythonapi.pythonapibase import CAPIStatus, PythonAPIBase, _CAPIUint32Set
+from pythonapi.implantlistener import _CtypesSample, _CTypesImplantListener, ConnectionType, ConnectionState
+from pythonapi.channelinfo import UnitType
+from pythonapi.stimulationatom import AtomType
+
+SIMULATION_ENV_VAR = "CORTEC_CAPI_SIMULATION"
+SIMULATED_LIBRARY_VERSION = "simulated"
+
+# Range of main pulse amplitudes in uA of the simulated implant. Counter
+# pulses have the opposite sign and a quarter of the amplitude.
+_STIMULATION_AMPLITUDE_MIN = -6120.
+_STIMULATION_AMPLITUDE_MAX = 0.
+_COUNTER_AMPLITUDE_MAX = -_STIMULATION_AMPLITUDE_MIN / 4
+
+# Samples arriving later than this are dropped and reported as too slow
+_MAX_BACKLOG_S = 0.5
+
+_handle_t = c_void_p
+_handle_ptr_t = POINTER(c_void_p)
+_function_ptr_t = CFUNCTYPE(c_int)
+
+class _HandleVector(Structure):
+    '''Layout of channelinfovector_t and externalunitinfovector_t.'''
+
+    _fields_ = [("count", c_size_t), 
+                ("vector", POINTER(c_void_p))]
+
+class _SimulationError(Exception):
+    def __init__(self, status: CAPIStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _capi(*argtypes):
+    '''Mark a method as implementation of the C function with the same
+        name and the given C argument types.
+    '''
+
+    def decorate(method):
+        method._capi_argtypes = argtypes
+        return method
+    return decorate
+
+def _write_string(value: str, buffer: int, buffer_length: int, string_length_ptr):
+    '''Copy a string into a C buffer like the string getters of the C
+        api (including the terminating zero).
+    '''
+
+    encoded = value.encode("utf-8")
+    if string_length_ptr:
+        string_length_ptr[0] = len(encoded)
+    if len(encoded) + 1 > buffer_length:
+        raise _SimulationError(CAPIStatus.STATUS_STRING_TOO_LONG, "Buffer too small for string.")
+    memmove(buffer, encoded + b"\0", len(encoded) + 1)
+
+def _read_uint32_set(uint32_set: _CAPIUint32Set) -> List[int]:
+    return [uint32_set.elements[i] for i in range(uint32_set.size)]
+
+def _write_uint32_set(values: List[int], uint32_set: _CAPIUint32Set):
+    if len(values) > uint32_set.size:
+        raise _SimulationError(CAPIStatus.STATUS_SET_TOO_BIG, "Set too small for channels.")
+    for i, value in enumerate(values):
+        uint32_set.elements[i] = value
+    uint32_set.size = len(values)
+
+class _Atom():
+    def __init__(self, atom_type: AtomType, amplitudes: tuple, duration: int):
+        self.atom_type = atom_type
+        self.amplitudes = amplitudes
+        self.duration = duration
+
+    def clone(self):
+        return _Atom(self.atom_type, self.amplitudes, self.duration)
+
+    def __eq__(self, other):
+        return (self.atom_type, self.amplitudes, self.duration) == (other.atom_type, other.amplitudes, other.duration)
+
+class _Function():
+    def __init__(self):
+        self.atoms: List[_Atom] = []
+        self.repetitions = 1
+        self.name = ""
+        self.source_channels: List[int] = []
+        self.destination_channels: List[int] = []
+        self.use_ground_electrode = False
+
+    @property
+    def period(self) -> int:
+        return sum(atom.duration for atom in self.atoms)
+
+    @property
+    def duration(self) -> int:
+        return self.period * self.repetitions
+
+    def clone(self):
+        copy = _Function()
+        copy.atoms = [atom.clone() for atom in self.atoms]
+        copy.repetitions = self.repetitions
+        copy.name = self.name
+        copy.source_channels = list(self.source_channels)
+        copy.destination_channels = list(self.destination_channels)
+        copy.use_ground_electrode = self.use_ground_electrode
+        return copy
+
+class _Command():
+    def __init__(self):
+        self.functions: List[_Function] = []
+        self.name = ""
+        self.tracing_id = 0
+        self.repetitions = 1
+
+    @property
+    def duration(self) -> int:
+        return sum(function.duration for function in self.functions) * self.repetitions
+
+    def clone(self):
+        copy = _Command()
+        copy.functions = [function.clone() for function in self.functions]
+        copy.name = self.name
+        copy.tracing_id = self.tracing_id
+        copy.repetitions = self.repetitions
+        return copy
+
+class _Iterator():
+    def __init__(self, items: list):
+        self.items = items
+        self.position = 0
+
+class _ExternalUnit():
+    def __init__(self, implant_type: str, device_id: str, firmware_version: str):
+        self.implant_type = implant_type
+        self.device_id = device_id
+        self.firmware_version = firmware_version
+
+class _ChannelInfo():
+    def __init__(self, can_measure: bool, can_stimulate: bool):
+        self.can_measure = can_measure
+        self.can_stimulate = can_stimulate
+        self.can_measure_impedance = can_stimulate
+        self.measure_value_min = -0.1
+        self.measure_value_max = 0.1
+        self.stimulation_unit = UnitType.UT_CURRENT if can_stimulate else UnitType.UT_NO_UNIT
+        self.stim_value_min = _STIMULATION_AMPLITUDE_MIN if can_stimulate else 0.
+        self.stim_value_max = _STIMULATION_AMPLITUDE_MAX
+
+class _ImplantInfo():
+    def __init__(self, device_type: str, device_id: str, firmware_version: str, channels: List[_ChannelInfo],
+                 sampling_rate: int):
+        self.device_type = device_type
+        self.device_id = device_id
+        self.firmware_version = firmware_version
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+
+    def clone(self):
+        return _ImplantInfo(self.device_type, self.device_id, self.firmware_version, self.channels,
+                            self.sampling_rate)
+
+class _Listener():
+    def __init__(self, listener):
+        self.listener = listener
+
+class _Implant():
+    '''State and background threads of the simulated implant.'''
+
+    def __init__(self, api: '_Simulation', external_unit: _ExternalUnit, info: _ImplantInfo):
+        self.api = api
+        self.external_unit = external_unit
+        self.info = info
+
+        # Held while calling the listener, so unregistering waits for
+        # running callbacks
+        self.listener_lock = RLock()
+        self.listener = None
+
+        self.is_powered = True
+        self.measurement_counter = 0
+        self.is_stimulating = False
+        self.pending_stimulation_id = 0
+        self.last_stimulation_id = 0
+        self.command = None
+
+        self._measurement_thread = None
+        self._stop_measurement = Event()
+        self._stimulation_thread = None
+        self._stop_stimulation = Event()
+
+    @property
+    def is_measuring(self) -> bool:
+        return self._measurement_thread is not None and self._measurement_thread.is_alive()
+
+    def notify(self, name: str, *args):
+        '''Call a callback of the registered listener, if set.'''
+
+        with self.listener_lock:
+            if self.listener is not None:
+                callback = getattr(self.listener, name)
+                if callback:
+                    callback(*args)
+
+    def push_telemetry(self):
+        api = self.api
+        elapsed = perf_counter() - api.start_time
+        self.notify("onImplantVoltageChanged", api.implant_voltage_V)
+        self.notify("onPrimaryCoilCurrentChanged", api.primary_coil_current_mA)
+        self.notify("onImplantControlValueChanged", api.implant_control_value)
+        self.notify("onTemperatureChanged", api.temperature + 0.05 * np.sin(elapsed / 60.))
+        self.notify("onHumidityChanged", api.humidity)
+
+    def start_measurement(self):
+        if self.is_measuring:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, "Measurement is already running.")
+        if not self.is_powered:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, "Implant is not powered.")
+
+        self._stop_measurement.clear()
+        self._measurement_thread = Thread(target=self._measure, name="SimulatedImplant", daemon=True)
+        self._measurement_thread.start()
+
+    def stop_measurement(self):
+        thread = self._measurement_thread
+        if thread is None:
+            return
+        self._stop_measurement.set()
+        if thread is not current_thread():
+            thread.join()
+
+    def _measure(self):
+        '''Main loop of the measurement thread.'''
+
+        api = self.api
+        num_channels = api.num_channels
+        sampling_rate = api.sampling_rate
+        signal = api.signal
+        signal_length = len(signal)
+        signal_address = signal.ctypes.data
+        row_bytes = signal.strides[0]
+
+        measurements = (c_double * num_channels)()
+        sample = _CtypesSample()
+        sample.numberOfMeasurements = num_channels
+        sample.measurements = cast(measurements, POINTER(c_double))
+        sample.supplyVoltageMilliV = api.supply_voltage_mV
+        sample.isConnected = True
+        sample_pointer = pointer(sample)
+
+        batch_size = max(1, sampling_rate // 1000)
+        max_backlog = int(sampling_rate * _MAX_BACKLOG_S)
+        is_too_slow = False
+        counter = self.measurement_counter
+        num_samples = 0
+
+        self.notify("onMeasurementStateChanged", True)
+        start_time = perf_counter()
+        next_telemetry = start_time
+
+        while not self._stop_measurement.is_set():
+            now = perf_counter()
+            if now >= next_telemetry:
+                self.push_telemetry()
+                next_telemetry = now + api.telemetry_interval_s
+
+            if api.realtime:
+                backlog = int((now - start_time) * sampling_rate) + 1 - num_samples
+                if backlog <= 0:
+                    sleep((num_samples + batch_size) / sampling_rate - (now - start_time))
+                    continue
+
+                if backlog > max_backlog:
+                    # The buffer of the device overflows, the late samples are lost
+                    if not is_too_slow:
+                        is_too_slow = True
+                        self.notify("onDataProcessingTooSlow")
+                    lost = backlog - batch_size
+                    counter += lost
+                    num_samples += lost
+                    backlog = batch_size
+                elif backlog <= batch_size:
+                    is_too_slow = False
+                count = backlog
+            else:
+                count = batch_size
+
+            with self.listener_lock:
+                on_data = self.listener.onData if self.listener is not None else None
+                for _ in range(count):
+                    memmove(measurements, signal_address + (counter % signal_length) * row_bytes, row_bytes)
+                    sample.measurementCounter = counter & 0xFFFFFFFF
+                    sample.stimulationId = self.pending_stimulation_id
+                    sample.isStimulationActive = self.is_stimulating
+                    self.pending_stimulation_id = 0
+                    if on_data:
+                        on_data(sample_pointer)
+                    counter += 1
+            num_samples += count
+            self.measurement_counter = counter
+
+        self.notify("onMeasurementStateChanged", False)
+
+    def start_stimulation(self, command: _Command):
+        if self.is_stimulating:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, "Stimulation is already running.")
+
+        self.last_stimulation_id = self.last_stimulation_id % 0xFFFF + 1
+        self.command = command
+        self.is_stimulating = True
+        self.pending_stimulation_id = self.last_stimulation_id
+        self._stop_stimulation.clear()
+        self._stimulation_thread = Thread(target=self._stimulate, args=(command,), name="SimulatedStimulation",
+                                          daemon=True)
+        self._stimulation_thread.start()
+
+    def stop_stimulation(self):
+        thread = self._stimulation_thread
+        if thread is None:
+            return
+        self._stop_stimulation.set()
+        if thread is not current_thread():
+            thread.join()
+
+    def _stimulate(self, command: _Command):
+        '''Execute the functions of a command in real time.'''
+
+        self.notify("onStimulationStateChanged", True)
+        num_finished = 0
+        for _ in range(command.repetitions):
+            for function in command.functions:
+                if self._stop_stimulation.wait(function.duration / 1e6):
+                    break
+                num_finished += 1
+                self.notify("onStimulationFunctionFinished", num_finished)
+            if self._stop_stimulation.is_set():
+                break
+
+        self.is_stimulating = False
+        self.notify("onStimulationStateChanged", False)
+
+    def shutdown(self):
+        self.stop_stimulation()
+        self.stop_measurement()
+
+class _Simulation():
+    '''Implementation of the C functions. Handles point to small blocks
+        of memory owned by the simulation.
+    '''
+
+    def __init__(self, num_channels: int = 32, sampling_rate: int = 1000, num_stimulation_channels: int = None,
+                 realtime: bool = True, telemetry_interval_s: float = 1., blocking_call_s: float = 0.01,
+                 implant_device_id: str = "SIM-IMPLANT-0001", external_unit_device_id: str = "SIM-EXT-0001",
+                 seed: int = 0):
+        '''Create the simulation.
+
+           @param num_channels             (Type: int) Number of 
+                measurement channels.
+           @param sampling_rate            (Type: int) Samples per second.
+           @param num_stimulation_channels (Type: int) Number of channels
+                able to stimulate (defaults to num_channels).
+           @param realtime                 (Type: bool) Deliver samples at
+                sampling_rate. If False, samples are delivered as fast as
+                the listener processes them.
+           @param telemetry_interval_s     (Type: float) Interval of the
+                temperature, humidity, voltage and current callbacks 
+                during measurement.
+           @param blocking_call_s          (Type: float) Duration of the
+                blocking impedance, temperature and humidity calls.
+           @param implant_device_id        (Type: str) Device id of the
+                implant.
+           @param external_unit_device_id  (Type: str) Device id of the
+                external unit.
+           @param seed                     (Type: int) Seed of the noise
+                of the generated signal.
+        '''
+
+        self.num_channels = int(num_channels)
+        self.sampling_rate = int(sampling_rate)
+        self.realtime = realtime
+        self.telemetry_interval_s = telemetry_interval_s
+        self.blocking_call_s = blocking_call_s
+        self.start_time = perf_counter()
+
+        self.supply_voltage_mV = 3300
+        self.implant_voltage_V = 5.
+        self.primary_coil_current_mA = 150.
+        self.implant_control_value = 50.
+        self.temperature = 37.
+        self.humidity = 20.
+
+        # One second of signal: sine waves of different frequency and
+        # amplitude per channel plus noise, replayed cyclically
+        time = np.arange(self.sampling_rate) / self.sampling_rate
+        channels = np.arange(self.num_channels)
+        rng = np.random.default_rng(seed)
+        self.signal = np.ascontiguousarray(
+            50e-6 * (1 + channels % 4) * np.sin(2 * np.pi * (5 + channels) * time[:, None]) \
+            + 5e-6 * rng.standard_normal((self.sampling_rate, self.num_channels)))
+
+        if num_stimulation_channels is None:
+            num_stimulation_channels = self.num_channels
+        channel_infos = [_ChannelInfo(True, i < num_stimulation_channels) for i in range(self.num_channels)]
+
+        self._lock = RLock()
+        self._objects: Dict[int, tuple] = {}
+        self._handles: Dict[int, int] = {}
+        self._error_message = ""
+
+        self.external_unit = _ExternalUnit("BIC3232H", external_unit_device_id, "sim-1.0")
+        self.implant_info = _ImplantInfo("BIC3232H", implant_device_id, "sim-1.0", channel_infos,
+                                         self.sampling_rate)
+        self.implant = None
+
+    def _wrap(self, method):
+        '''Convert exceptions of an implementation into status codes.'''
+
+        def call(*args):
+            try:
+                method(*args)
+                return CAPIStatus.STATUS_OK
+            except _SimulationError as e:
+                self._error_message = str(e)
+                return e.status
+            except Exception as e:
+                self._error_message = f"{type(e).__name__}: {e}"
+                return CAPIStatus.STATUS_RUNTIME_ERROR
+        return call
+
+    def _handle_of(self, obj) -> int:
+        '''Get the handle of an object, creating one if needed.'''
+
+        with self._lock:
+            handle = self._handles.get(id(obj))
+            if handle is None:
+                memory = create_string_buffer(1)
+                handle = addressof(memory)
+                self._objects[handle] = (memory, obj)
+                self._handles[id(obj)] = handle
+            return handle
+
+    def _object(self, handle: int, object_type: type):
+        '''Get the object of a handle.'''
+
+        entry = self._objects.get(handle) if handle else None
+        if entry is None or not isinstance(entry[1], object_type):
+            raise _SimulationError(CAPIStatus.STATUS_NULL_POINTER_ERROR,
+                                   f"Invalid handle for {object_type.__name__.lstrip('_')}.")
+        return entry[1]
+
+    def _release(self, handle_ptr):
+        '''Destroy the object of a handle and null the handle.'''
+
+        if not handle_ptr or not handle_ptr[0]:
+            raise _SimulationError(CAPIStatus.STATUS_NULL_POINTER_ERROR, "Handle is null.")
+
+        with self._lock:
+            entry = self._objects.pop(handle_ptr[0], None)
+            if entry is not None:
+                self._handles.pop(id(entry[1]), None)
+                for child in getattr(entry[1], "atoms", getattr(entry[1], "functions", [])):
+                    child_handle = self._handles.pop(id(child), None)
+                    self._objects.pop(child_handle, None)
+        handle_ptr[0] = None
+
+    def _output_handle(self, handle_ptr, obj):
+        if not handle_ptr:
+            raise _SimulationError(CAPIStatus.STATUS_NULL_POINTER_ERROR, "Output handle is null.")
+        handle_ptr[0] = self._handle_of(obj)
+
+    # capi.h
+
+    @_capi(c_void_p, c_size_t, POINTER(c_size_t))
+    def capi_getErrorMessage(self, buffer, buffer_length, string_length_ptr):
+        _write_string(self._error_message, buffer, buffer_length, string_length_ptr)
+
+    @_capi(c_void_p, c_size_t, POINTER(c_size_t))
+    def capi_getLibraryVersion(self, buffer, buffer_length, string_length_ptr):
+        _write_string(SIMULATED_LIBRARY_VERSION, buffer, buffer_length, string_length_ptr)
+
+    # implantfactory.h
+
+    @_capi(c_bool, c_void_p, c_size_t)
+    def implantfactory_init(self, enable_logging, file_name, length):
+        pass
+
+    @_capi(_handle_ptr_t)
+    def implantfactory_getFactoryHandle(self, handle_ptr):
+        self._output_handle(handle_ptr, self)
+
+    @_capi(_handle_t, POINTER(_HandleVector))
+    def implantfactory_getExternalUnitInfos(self, factory, vector_ptr):
+        self._object(factory, _Simulation)
+        vector = vector_ptr.contents
+        if self.implant is not None:
+            vector.count = 0
+        elif vector.count < 1:
+            raise _SimulationError(CAPIStatus.STATUS_VECTOR_TOO_LONG, "Vector too small for external units.")
+        else:
+            vector.vector[0] = self._handle_of(self.external_unit)
+            vector.count = 1
+
+    @_capi(_handle_t, _handle_t, _handle_ptr_t)
+    def implantfactory_getImplantInfo(self, factory, external_unit, handle_ptr):
+        self._object(external_unit, _ExternalUnit)
+        if not self.is_implant_powered:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, "No implant connected.")
+        self._output_handle(handle_ptr, self.implant_info.clone())
+
+    @_capi(_handle_t, _handle_t, POINTER(c_bool))
+    def implantfactory_isResponsibleFactory(self, factory, external_unit, result):
+        self._object(external_unit, _ExternalUnit)
+        result[0] = True
+
+    @_capi(_handle_t, _handle_t, _handle_t, _handle_ptr_t)
+    def implantfactory_create(self, factory, external_unit, implant_info, handle_ptr):
+        external_unit = self._object(external_unit, _ExternalUnit)
+        info = self._object(implant_info, _ImplantInfo)
+        if self.implant is not None:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, "Implant was already created.")
+        self.implant = _Implant(self, external_unit, info)
+        self._output_handle(handle_ptr, self.implant)
+
+    @property
+    def is_implant_powered(self) -> bool:
+        return self.implant is None or self.implant.is_powered
+
+    # externalunitinfo.h
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def externalunitinfo_getImplantType(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _ExternalUnit).implant_type, buffer, buffer_length, string_length_ptr)
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def externalunitinfo_getDeviceId(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _ExternalUnit).device_id, buffer, buffer_length, string_length_ptr)
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def externalunitinfo_getFirmwareVersion(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _ExternalUnit).firmware_version, buffer, buffer_length, 
+                      string_length_ptr)
+
+    @_capi(POINTER(_HandleVector))
+    def externalunitinfos_destroy(self, vector_ptr):
+        vector = vector_ptr.contents
+        for i in range(vector.count):
+            vector.vector[i] = None
+        vector.count = 0
+
+    # implantinfo.h
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def implantinfo_getFirmwareVersion(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _ImplantInfo).firmware_version, buffer, buffer_length, 
+                      string_length_ptr)
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def implantinfo_getDeviceType(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _ImplantInfo).device_type, buffer, buffer_length, string_length_ptr)
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def implantinfo_getDeviceId(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _ImplantInfo).device_id, buffer, buffer_length, string_length_ptr)
+
+    @_capi(_handle_t, POINTER(_HandleVector))
+    def implantinfo_getChannelInfo(self, handle, vector_ptr):
+        channels = self._object(handle, _ImplantInfo).channels
+        vector = vector_ptr.contents
+        if vector.count < len(channels):
+            raise _SimulationError(CAPIStatus.STATUS_VECTOR_TOO_LONG, "Vector too small for channel infos.")
+        for i, channel in enumerate(channels):
+            vector.vector[i] = self._handle_of(channel)
+        vector.count = len(channels)
+
+    @_capi(_handle_t, POINTER(c_size_t))
+    def implantinfo_getChannelCount(self, handle, result):
+        result[0] = len(self._object(handle, _ImplantInfo).channels)
+
+    @_capi(_handle_t, POINTER(c_size_t))
+    def implantinfo_getMeasurementChannelCount(self, handle, result):
+        result[0] = sum(channel.can_measure for channel in self._object(handle, _ImplantInfo).channels)
+
+    @_capi(_handle_t, POINTER(c_size_t))
+    def implantinfo_getStimulationChannelCount(self, handle, result):
+        result[0] = sum(channel.can_stimulate for channel in self._object(handle, _ImplantInfo).channels)
+
+    @_capi(_handle_t, POINTER(c_uint32))
+    def implantinfo_getSamplingRate(self, handle, result):
+        result[0] = self._object(handle, _ImplantInfo).sampling_rate
+
+    @_capi(_handle_ptr_t)
+    def implantinfo_destroy(self, handle_ptr):
+        self._release(handle_ptr)
+
+    # channelinfo.h
+
+    @_capi(_handle_t, POINTER(c_bool))
+    def channelinfo_canMeasure(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).can_measure
+
+    @_capi(_handle_t, POINTER(c_double))
+    def channelinfo_getMeasureValueMin(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).measure_value_min
+
+    @_capi(_handle_t, POINTER(c_double))
+    def channelinfo_getMeasureValueMax(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).measure_value_max
+
+    @_capi(_handle_t, POINTER(c_bool))
+    def channelinfo_canStimulate(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).can_stimulate
+
+    @_capi(_handle_t, POINTER(c_int))
+    def channelinfo_getStimulationUnit(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).stimulation_unit
+
+    @_capi(_handle_t, POINTER(c_double))
+    def channelinfo_getStimValueMin(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).stim_value_min
+
+    @_capi(_handle_t, POINTER(c_double))
+    def channelinfo_getStimValueMax(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).stim_value_max
+
+    @_capi(_handle_t, POINTER(c_bool))
+    def channelinfo_canMeasureImpedance(self, handle, result):
+        result[0] = self._object(handle, _ChannelInfo).can_measure_impedance
+
+    # implant.h
+
+    @_capi(POINTER(_CTypesImplantListener), _handle_ptr_t)
+    def implant_createListener(self, listener, handle_ptr):
+        if not listener:
+            raise _SimulationError(CAPIStatus.STATUS_NULL_POINTER_ERROR, "Listener is null.")
+        self._output_handle(handle_ptr, _Listener(listener.contents))
+
+    @_capi(_handle_ptr_t)
+    def implant_destroyListener(self, handle_ptr):
+        listener = self._object(handle_ptr[0] if handle_ptr else None, _Listener)
+        if self.implant is not None and self.implant.listener is listener.listener:
+            with self.implant.listener_lock:
+                self.implant.listener = None
+        self._release(handle_ptr)
+
+    @_capi(_handle_t, _handle_t)
+    def implant_registerListener(self, handle, listener):
+        implant = self._object(handle, _Implant)
+        listener = self._object(listener, _Listener)
+        with implant.listener_lock:
+            implant.listener = listener.listener
+
+    @_capi(_handle_t)
+    def implant_unregisterListener(self, handle):
+        implant = self._object(handle, _Implant)
+        with implant.listener_lock:
+            implant.listener = None
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def implant_getImplantInfo(self, handle, handle_ptr):
+        self._output_handle(handle_ptr, self._object(handle, _Implant).info.clone())
+
+    @_capi(_handle_t, _CAPIUint32Set)
+    def implant_startMeasurement(self, handle, ref_channels):
+        implant = self._object(handle, _Implant)
+        for channel in _read_uint32_set(ref_channels):
+            if channel >= len(implant.info.channels):
+                raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, f"Invalid reference channel {channel}.")
+        implant.start_measurement()
+
+    @_capi(_handle_t)
+    def implant_stopMeasurement(self, handle):
+        self._object(handle, _Implant).stop_measurement()
+
+    def _blocking_call(self, implant: _Implant):
+        '''Simulate a blocking measurement of the implant.'''
+
+        implant.stop_measurement()
+        sleep(self.blocking_call_s)
+
+    @_capi(_handle_t, c_uint32, POINTER(c_double))
+    def implant_getImpedance(self, handle, channel, result):
+        implant = self._object(handle, _Implant)
+        if implant.is_measuring or implant.is_stimulating:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR,
+                                   "Impedance measurement is not possible during measurement or stimulation.")
+        if channel >= len(implant.info.channels) or not implant.info.channels[channel].can_measure_impedance:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, f"Channel {channel} cannot measure impedance.")
+        self._blocking_call(implant)
+        result[0] = 1000. * (1 + channel % 8)
+
+    @_capi(_handle_t, POINTER(c_double))
+    def implant_getTemperature(self, handle, result):
+        self._blocking_call(self._object(handle, _Implant))
+        result[0] = self.temperature
+
+    @_capi(_handle_t, POINTER(c_double))
+    def implant_getHumidity(self, handle, result):
+        self._blocking_call(self._object(handle, _Implant))
+        result[0] = self.humidity
+
+    def _validate_command(self, implant: _Implant, command: _Command) -> str:
+        '''Returns why a command is invalid or an empty string.'''
+
+        channels = implant.info.channels
+        if not command.functions:
+            return "The command contains no functions."
+        for function in command.functions:
+            if not function.atoms:
+                return f"Function '{function.name}' contains no atoms."
+            for channel in function.source_channels + function.destination_channels:
+                if channel >= len(channels) or not channels[channel].can_stimulate:
+                    return f"Channel {channel} of function '{function.name}' cannot stimulate."
+            for atom in function.atoms:
+                for amplitude in atom.amplitudes:
+                    if not _STIMULATION_AMPLITUDE_MIN <= amplitude <= _COUNTER_AMPLITUDE_MAX:
+                        return f"Amplitude {amplitude} of function '{function.name}' is out of range."
+        return ""
+
+    @_capi(_handle_t, _handle_t, POINTER(c_bool), c_void_p, c_size_t, POINTER(c_size_t))
+    def implant_isStimulationCommandValid(self, handle, command, result, buffer, buffer_length, string_length_ptr):
+        message = self._validate_command(self._object(handle, _Implant), self._object(command, _Command))
+        result[0] = not message
+        _write_string(message, buffer, buffer_length, string_length_ptr)
+
+    @_capi(_handle_t, _handle_t)
+    def implant_startStimulation(self, handle, command):
+        implant = self._object(handle, _Implant)
+        command = self._object(command, _Command)
+        message = self._validate_command(implant, command)
+        if message:
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, message)
+        implant.start_stimulation(command)
+
+    @_capi(_handle_t)
+    def implant_stopStimulation(self, handle):
+        self._object(handle, _Implant).stop_stimulation()
+
+    @_capi(_handle_t, c_bool)
+    def implant_setImplantPower(self, handle, enabled):
+        implant = self._object(handle, _Implant)
+        if bool(enabled) == implant.is_powered:
+            return
+        if not enabled:
+            implant.shutdown()
+        implant.is_powered = bool(enabled)
+        implant.notify("onConnectionStateChanged", ConnectionType.CON_TYPE_EXT_TO_IMPLANT,
+                       ConnectionState.CON_STATE_CONNECTED if enabled else ConnectionState.CON_STATE_DISCONNECTED)
+
+    @_capi(_handle_t)
+    def implant_pushState(self, handle):
+        implant = self._object(handle, _Implant)
+        implant.notify("onConnectionStateChanged", ConnectionType.CON_TYPE_PC_TO_EXT,
+                       ConnectionState.CON_STATE_CONNECTED)
+        implant.notify("onConnectionStateChanged", ConnectionType.CON_TYPE_EXT_TO_IMPLANT,
+                       ConnectionState.CON_STATE_CONNECTED if implant.is_powered \
+                       else ConnectionState.CON_STATE_DISCONNECTED)
+        implant.notify("onMeasurementStateChanged", implant.is_measuring)
+        implant.notify("onStimulationStateChanged", implant.is_stimulating)
+        implant.push_telemetry()
+
+    @_capi(_handle_ptr_t)
+    def implant_destroy(self, handle_ptr):
+        implant = self._object(handle_ptr[0] if handle_ptr else None, _Implant)
+        implant.shutdown()
+        if implant is self.implant:
+            self.implant = None
+        self._release(handle_ptr)
+
+    # stimulationcommandfactory.h
+
+    @_capi(_handle_ptr_t)
+    def stimulationcommandfactory_getFactoryHandle(self, handle_ptr):
+        self._output_handle(handle_ptr, self)
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationcommandfactory_createStimulationCommand(self, factory, handle_ptr):
+        self._output_handle(handle_ptr, _Command())
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationcommandfactory_createStimulationFunction(self, factory, handle_ptr):
+        self._output_handle(handle_ptr, _Function())
+
+    @_capi(_handle_t, _handle_ptr_t, c_double, c_uint64)
+    def stimulationcommandfactory_createRectStimulationAtom(self, factory, handle_ptr, value, duration):
+        self._output_handle(handle_ptr, _Atom(AtomType.AT_RECTANGULAR, (value,), duration))
+
+    @_capi(_handle_t, _handle_ptr_t, c_double, c_double, c_double, c_double, c_uint64)
+    def stimulationcommandfactory_create4RectStimulationAtom(self, factory, handle_ptr, amplitude0, amplitude1,
+                                                             amplitude2, amplitude3, duration):
+        self._output_handle(handle_ptr, _Atom(AtomType.AT_RECTANGULAR_4_AMPLITUDE,
+                                              (amplitude0, amplitude1, amplitude2, amplitude3), duration))
+
+    @_capi(_handle_t, _handle_ptr_t, c_uint64)
+    def stimulationcommandfactory_createStimulationPauseAtom(self, factory, handle_ptr, duration):
+        self._output_handle(handle_ptr, _Atom(AtomType.AT_PAUSE, (), duration))
+
+    # stimulationatom.h
+
+    @_capi(_handle_t, POINTER(c_uint64))
+    def stimulationatom_getDuration(self, handle, result):
+        result[0] = self._object(handle, _Atom).duration
+
+    @_capi(_handle_t, POINTER(c_int))
+    def stimulationatom_getType(self, handle, result):
+        result[0] = self._object(handle, _Atom).atom_type
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationatom_clone(self, handle, handle_ptr):
+        self._output_handle(handle_ptr, self._object(handle, _Atom).clone())
+
+    @_capi(_handle_t, _handle_t, POINTER(c_bool))
+    def stimulationatom_isEqual(self, handle, other, result):
+        result[0] = self._object(handle, _Atom) == self._object(other, _Atom)
+
+    @_capi(_handle_ptr_t)
+    def stimulationatom_destroy(self, handle_ptr):
+        self._release(handle_ptr)
+
+    # stimulationatomiterator.h and stimulationfunctioniterator.h
+
+    def _iterator_next(self, handle):
+        self._object(handle, _Iterator).position += 1
+
+    def _iterator_is_done(self, handle, result):
+        iterator = self._object(handle, _Iterator)
+        result[0] = iterator.position >= len(iterator.items)
+
+    def _iterator_current_item(self, handle, handle_ptr):
+        iterator = self._object(handle, _Iterator)
+        if iterator.position >= len(iterator.items):
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, "Iterator is done.")
+        self._output_handle(handle_ptr, iterator.items[iterator.position])
+
+    def _iterator_destroy(self, handle_ptr):
+        if handle_ptr and handle_ptr[0]:
+            self._release(handle_ptr)
+
+    @_capi(_handle_t)
+    def stimulationatomiterator_next(self, handle):
+        self._iterator_next(handle)
+
+    @_capi(_handle_t, POINTER(c_bool))
+    def stimulationatomiterator_isDone(self, handle, result):
+        self._iterator_is_done(handle, result)
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationatomiterator_getCurrentItem(self, handle, handle_ptr):
+        self._iterator_current_item(handle, handle_ptr)
+
+    @_capi(_handle_ptr_t)
+    def stimulationatomiterator_destroy(self, handle_ptr):
+        self._iterator_destroy(handle_ptr)
+
+    @_capi(_handle_t)
+    def stimulationfunctioniterator_next(self, handle):
+        self._iterator_next(handle)
+
+    @_capi(_handle_t, POINTER(c_bool))
+    def stimulationfunctioniterator_isDone(self, handle, result):
+        self._iterator_is_done(handle, result)
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationfunctioniterator_getCurrentItem(self, handle, handle_ptr):
+        self._iterator_current_item(handle, handle_ptr)
+
+    @_capi(_handle_ptr_t)
+    def stimulationfunctioniterator_destroy(self, handle_ptr):
+        self._iterator_destroy(handle_ptr)
+
+    # stimulationfunction.h
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationfunction_append(self, handle, atom_ptr):
+        function = self._object(handle, _Function)
+        atom = self._object(atom_ptr[0] if atom_ptr else None, _Atom)
+        if atom.atom_type == AtomType.AT_NOTYPE or \
+                (function.atoms and function.atoms[0].atom_type != atom.atom_type \
+                 and AtomType.AT_PAUSE not in (function.atoms[0].atom_type, atom.atom_type)):
+            raise _SimulationError(CAPIStatus.STATUS_RUNTIME_ERROR, "Atom type does not match the function.")
+        function.atoms.append(atom)
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationfunction_getAtomIterator(self, handle, handle_ptr):
+        self._output_handle(handle_ptr, _Iterator(self._object(handle, _Function).atoms))
+
+    @_capi(_handle_t, c_uint32)
+    def stimulationfunction_setRepetitions(self, handle, repetitions):
+        self._object(handle, _Function).repetitions = repetitions
+
+    @_capi(_handle_t, POINTER(c_uint32))
+    def stimulationfunction_getRepetitions(self, handle, result):
+        result[0] = self._object(handle, _Function).repetitions
+
+    @_capi(_handle_t, c_void_p, c_size_t)
+    def stimulationfunction_setName(self, handle, name, length):
+        self._object(handle, _Function).name = string_at(name, length).decode("utf-8") if length else ""
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def stimulationfunction_getName(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _Function).name, buffer, buffer_length, string_length_ptr)
+
+    @_capi(_handle_t, POINTER(c_uint64))
+    def stimulationfunction_getDuration(self, handle, result):
+        result[0] = self._object(handle, _Function).duration
+
+    @_capi(_handle_t, POINTER(c_uint64))
+    def stimulationfunction_getPeriod(self, handle, result):
+        result[0] = self._object(handle, _Function).period
+
+    @_capi(_handle_t, POINTER(_CAPIUint32Set), POINTER(_CAPIUint32Set), c_bool)
+    def stimulationfunction_setVirtualStimulationElectrodes(self, handle, source, destination, use_ground):
+        function = self._object(handle, _Function)
+        function.source_channels = _read_uint32_set(source.contents)
+        function.destination_channels = _read_uint32_set(destination.contents)
+        function.use_ground_electrode = bool(use_ground)
+
+    @_capi(_handle_t, POINTER(_CAPIUint32Set), POINTER(_CAPIUint32Set))
+    def stimulationfunction_getVirtualStimulationElectrodes(self, handle, source, destination):
+        function = self._object(handle, _Function)
+        _write_uint32_set(function.source_channels, source.contents)
+        _write_uint32_set(function.destination_channels, destination.contents)
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationfunction_clone(self, handle, handle_ptr):
+        self._output_handle(handle_ptr, self._object(handle, _Function).clone())
+
+    @_capi(_handle_t, _handle_t, POINTER(c_bool))
+    def stimulationfunction_hasEqualSignalForm(self, handle, other, result):
+        result[0] = self._object(handle, _Function).atoms == self._object(other, _Function).atoms
+
+    @_capi(_handle_t, _handle_t, POINTER(c_bool))
+    def stimulationfunction_hasEqualVirtualStimulationElectrodes(self, handle, other, result):
+        function = self._object(handle, _Function)
+        other = self._object(other, _Function)
+        result[0] = (function.source_channels, function.destination_channels, function.use_ground_electrode) == \
+            (other.source_channels, other.destination_channels, other.use_ground_electrode)
+
+    @_capi(_handle_t, POINTER(c_bool))
+    def stimulationfunction_usesGroundElectrode(self, handle, result):
+        result[0] = self._object(handle, _Function).use_ground_electrode
+
+    @_capi(_handle_ptr_t)
+    def stimulationfunction_destroy(self, handle_ptr):
+        self._release(handle_ptr)
+
+    # stimulationcommand.h
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationcommand_append(self, handle, function_ptr):
+        command = self._object(handle, _Command)
+        command.functions.append(self._object(function_ptr[0] if function_ptr else None, _Function))
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationcommand_getFunctionIterator(self, handle, handle_ptr):
+        self._output_handle(handle_ptr, _Iterator(self._object(handle, _Command).functions))
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationcommand_getCommandRepetitionAwareFunctionIterator(self, handle, handle_ptr):
+        command = self._object(handle, _Command)
+        functions = [function for function in command.functions for _ in range(function.repetitions)]
+        self._output_handle(handle_ptr, _Iterator(functions * command.repetitions))
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationcommand_getRepetitionAwareFunctionIterator(self, handle, handle_ptr):
+        command = self._object(handle, _Command)
+        functions = [function for function in command.functions for _ in range(function.repetitions)]
+        self._output_handle(handle_ptr, _Iterator(functions))
+
+    @_capi(_handle_t, POINTER(c_uint64))
+    def stimulationcommand_getDuration(self, handle, result):
+        result[0] = self._object(handle, _Command).duration
+
+    @_capi(_handle_t, c_void_p, c_size_t)
+    def stimulationcommand_setName(self, handle, name, length):
+        self._object(handle, _Command).name = string_at(name, length).decode("utf-8") if length else ""
+
+    @_capi(_handle_t, c_void_p, c_size_t, POINTER(c_size_t))
+    def stimulationcommand_getName(self, handle, buffer, buffer_length, string_length_ptr):
+        _write_string(self._object(handle, _Command).name, buffer, buffer_length, string_length_ptr)
+
+    @_capi(_handle_t, _handle_ptr_t)
+    def stimulationcommand_clone(self, handle, handle_ptr):
+        self._output_handle(handle_ptr, self._object(handle, _Command).clone())
+
+    @_capi(_handle_t, POINTER(c_uint64))
+    def stimulationcommand_getSize(self, handle, result):
+        result[0] = len(self._object(handle, _Command).functions)
+
+    @_capi(_handle_t, POINTER(c_uint16))
+    def stimulationcommand_getTracingId(self, handle, result):
+        result[0] = self._object(handle, _Command).tracing_id
+
+    @_capi(_handle_t, c_uint16)
+    def stimulationcommand_setTracingId(self, handle, tracing_id):
+        self._object(handle, _Command).tracing_id = tracing_id
+
+    @_capi(_handle_t, POINTER(c_uint16))
+    def stimulationcommand_getRepetitions(self, handle, result):
+        result[0] = self._object(handle, _Command).repetitions
+
+    @_capi(_handle_t, c_uint16)
+    def stimulationcommand_setRepetitions(self, handle, repetitions):
+        self._object(handle, _Command).repetitions = repetitions
+
+    @_capi(_handle_ptr_t)
+    def stimulationcommand_destroy(self, handle_ptr):
+        self._release(handle_ptr)
+
+class SimulatedImplantAPI():
+    '''Simulated cimplantapi library.
+
+        The functions of the C api are accessed as attributes, like with
+        a ctypes.CDLL. The state of the simulated devices is available 
+        as simulation, e.g. simulation.implant.measurement_counter.
+    '''
+
+    def __init__(self, **kwargs):
+        '''Create the simulation. The keyword arguments are
+
+            - num_channels (int, 32): Number of measurement channels.
+            - sampling_rate (int, 1000): Samples per second.
+            - num_stimulation_channels (int): Number of channels able to
+                stimulate, defaults to num_channels.
+            - realtime (bool, True): Deliver samples at sampling_rate. 
+                If False, samples are delivered as fast as the listener
+                processes them.
+            - telemetry_interval_s (float, 1.0): Interval of the 
+                temperature, humidity, voltage and current callbacks 
+                during measurement.
+            - blocking_call_s (float, 0.01): Duration of the blocking
+                impedance, temperature and humidity calls.
+            - implant_device_id, external_unit_device_id (str): Device ids.
+            - seed (int, 0): Seed of the noise of the generated signal.
+        '''
+
+        self.simulation = _Simulation(**kwargs)
+
+        # One C function pointer per implemented function
+        self._functions = {}
+        for name in dir(_Simulation):
+            argtypes = getattr(getattr(_Simulation, name), "_capi_argtypes", None)
+            if argtypes is not None:
+                method = getattr(self.simulation, name)
+                self._functions[name] = CFUNCTYPE(c_int, *argtypes)(self.simulation._wrap(method))
+
+    @classmethod
+    def from_environment(cls, value: str = None):
+        '''Create the simulation configured by CORTEC_CAPI_SIMULATION.
+
+           @param value (Type: str) Configuration string, defaults to the
+                value of the environment variable.
+        '''
+
+        value = os.environ.get(SIMULATION_ENV_VAR, "") if value is None else value
+        kwargs = {}
+        for item in value.split(","):
+            if "=" not in item:
+                continue
+            key, setting = (part.strip() for part in item.split("=", 1))
+            if key == "realtime":
+                kwargs[key] = setting.lower() in ("1", "true", "yes")
+            elif key.endswith("_id"):
+                kwargs[key] = setting
+            elif key.endswith("_s"):
+                kwargs[key] = float(setting)
+            else:
+                kwargs[key] = int(setting)
+        return cls(**kwargs)
+
+    def __getattr__(self, name: str):
+        '''Get a C function pointer, cached per name like ctypes.CDLL.'''
+
+        functions = self.__dict__.get("_functions", {})
+        if name not in functions:
+            raise AttributeError(f"function '{name}' not found")
+
+        function = _function_ptr_t(cast(functions[name], c_void_p).value)
+        setattr(self, name, function)
+        return function
+
+def use_simulated_api(simulated_api: SimulatedImplantAPI = None, **kwargs) -> SimulatedImplantAPI:
+    '''Use a simulation instead of the C library. Must be called before
+        the api is used for the first time.
+
+       @param simulated_api (Type: SimulatedImplantAPI) The simulation,
+            created from kwargs if not given.
+    '''
+
+    if pythonapibase._api_base is not None:
+        raise RuntimeError("The C api was already loaded.")
+
+    if simulated_api is None:
+        simulated_api = SimulatedImplantAPI(**kwargs)
+    pythonapibase._api_base = PythonAPIBase(simulated_api)
+    return simulated_api
@@ -25,7 +25,7 @@
 '''
 from ctypes import POINTER, byref, pointer, c_uint64, c_bool, c_int
 
-from pythonapi.pythonapibase import _CAPIEnum, CAPIStatus, opaque_ptr, _Opaque, get_api_base, get_error_message
+from pythonapi.pythonapibase import _CAPIEnum, CAPIStatus, opaque_ptr, _Opaque, get_error_message, _CFunction
 
 class AtomType(_CAPIEnum):
     '''Enumeration with all available stimulation atom types.'''
@@ -40,36 +40,23 @@ class AtomType(_CAPIEnum):
 class StimulationAtom():
     '''Atomic element of a stimulation function.'''
 
-    def __init__(self, handle):
+    # C functions used by this class, bound once per process (see _CFunction)
+    _stimulationatom_getDuration = _CFunction('stimulationatom_getDuration', [opaque_ptr, POINTER(c_uint64)])
+    _stimulationatom_getType = _CFunction('stimulationatom_getType', [opaque_ptr, POINTER(c_int)])
+    _stimulationatom_clone = _CFunction('stimulationatom_clone', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationatom_isEqual = _CFunction('stimulationatom_isEqual', [opaque_ptr, opaque_ptr, POINTER(c_bool)])
+    _stimulationatom_destroy = _CFunction('stimulationatom_destroy', [POINTER(opaque_ptr)])
+
+    def __init__(self, handle, record: tuple = None):
+        '''@param handle Handle of the C atom.
+           @param record (Type: tuple) (AtomType, (a0, a1, a2, a3), 
+                duration) of the atom if known (see atomarrays).
+        '''
+
         self._handle = handle
+        self._record = record
         self.valid = True
 
-        api = get_api_base()
-        self.__registerMethods(api)
-
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-
-        self._stimulationatom_getDuration = api.dll_instance.stimulationatom_getDuration
-        self._stimulationatom_getDuration.restype = CAPIStatus
-        self._stimulationatom_getDuration.argtypes = [opaque_ptr, POINTER(c_uint64)]
-
-        self._stimulationatom_getType = api.dll_instance.stimulationatom_getType
-        self._stimulationatom_getType.restype = CAPIStatus
-        self._stimulationatom_getType.argtypes = [opaque_ptr, POINTER(c_int)]
-
-        self._stimulationatom_clone = api.dll_instance.stimulationatom_clone
-        self._stimulationatom_clone.restype = CAPIStatus
-        self._stimulationatom_clone.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-
-        self._stimulationatom_isEqual = api.dll_instance.stimulationatom_isEqual
-        self._stimulationatom_isEqual.restype = CAPIStatus
-        self._stimulationatom_isEqual.argtypes = [opaque_ptr, opaque_ptr, POINTER(c_bool)]
-
-        self._stimulationatom_destroy = api.dll_instance.stimulationatom_destroy
-        self._stimulationatom_destroy.restype = CAPIStatus
-        self._stimulationatom_destroy.argtypes = [POINTER(opaque_ptr)]
-
     def __del__(self):
         '''Destroy the stimulation atom handle if it was not
             invalidated by appending it to a function.
@@ -105,7 +92,7 @@ class StimulationAtom():
     def __copy__(self):
         '''Create a shallow copy of the atom.'''
 
-        copy = type(self)(self._handle)
+        copy = type(self)(self._handle, self._record)
         copy.valid = self.valid
         return copy
 
@@ -121,7 +108,7 @@ class StimulationAtom():
         status = self._stimulationatom_clone(self._handle, byref(copied_handle))
 
         if status == CAPIStatus.STATUS_OK:
-            copy = type(self)(copied_handle)
+            copy = type(self)(copied_handle, self._record)
             copy.valid = self.valid
             return copy
         else:
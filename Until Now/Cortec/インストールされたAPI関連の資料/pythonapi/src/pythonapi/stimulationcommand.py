@@ -49,9 +49,9 @@
         implant_startStimulation().
 '''
 
-from ctypes import POINTER, byref, pointer, c_uint16, c_uint64, c_bool, c_size_t, create_string_buffer
+from ctypes import POINTER, byref, pointer, c_uint16, c_uint64, c_bool
 
-from pythonapi.pythonapibase import get_api_base, CAPIStatus, opaque_ptr, _Opaque, c_size_t_ptr, get_error_message
+from pythonapi.pythonapibase import CAPIStatus, opaque_ptr, _Opaque, get_error_message, _CFunction, _buffers
 from pythonapi.stimulationfunction import StimulationFunction
 
 class _CommandIterator():
@@ -59,30 +59,16 @@ class _CommandIterator():
         Is unaware of wether it is repetition-aware or not.
     '''
 
+    # C functions used by this class, bound once per process (see _CFunction)
+    _stimulationfunctioniterator_next = _CFunction('stimulationfunctioniterator_next', [opaque_ptr])
+    _stimulationfunctioniterator_isDone = \
+        _CFunction('stimulationfunctioniterator_isDone', [opaque_ptr, POINTER(c_bool)])
+    _stimulationfunctioniterator_getCurrentItem = \
+        _CFunction('stimulationfunctioniterator_getCurrentItem', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationfunctioniterator_destroy = _CFunction('stimulationfunctioniterator_destroy', [POINTER(opaque_ptr)])
+
     def __init__(self, handle):
         self._handle = handle
-        
-        api = get_api_base()
-        self.__registerMethods(api)
-
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-
-        self._stimulationfunctioniterator_next = api.dll_instance.stimulationfunctioniterator_next
-        self._stimulationfunctioniterator_next.restype = CAPIStatus
-        self._stimulationfunctioniterator_next.argtypes = [opaque_ptr]
-        
-        self._stimulationfunctioniterator_isDone = api.dll_instance.stimulationfunctioniterator_isDone
-        self._stimulationfunctioniterator_isDone.restype = CAPIStatus
-        self._stimulationfunctioniterator_isDone.argtypes = [opaque_ptr, POINTER(c_bool)]
-
-        self._stimulationfunctioniterator_getCurrentItem = api.dll_instance.stimulationfunctioniterator_getCurrentItem
-        self._stimulationfunctioniterator_getCurrentItem.restype = CAPIStatus
-        self._stimulationfunctioniterator_getCurrentItem.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-        
-        self._stimulationfunctioniterator_destroy = api.dll_instance.stimulationfunctioniterator_destroy
-        self._stimulationfunctioniterator_destroy.restype = CAPIStatus
-        self._stimulationfunctioniterator_destroy.argtypes = [POINTER(opaque_ptr)]
 
     def __del__(self):
         '''Destroy iterator handle.'''
@@ -153,74 +139,39 @@ class StimulationCommand():
         2) Repetition-aware (i.e.  
             'for function in command.repetition_aware_iterator():')
     '''
+
+    # C functions used by this class, bound once per process (see _CFunction)
+    _stimulationcommand_append = _CFunction('stimulationcommand_append', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationcommand_getFunctionIterator = \
+        _CFunction('stimulationcommand_getFunctionIterator', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationcommand_getCommandRepetitionAwareFunctionIterator = \
+        _CFunction('stimulationcommand_getCommandRepetitionAwareFunctionIterator', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationcommand_getRepetitionAwareFunctionIterator = \
+        _CFunction('stimulationcommand_getRepetitionAwareFunctionIterator', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationcommand_getDuration = _CFunction('stimulationcommand_getDuration', [opaque_ptr, POINTER(c_uint64)])
+    _stimulationcommand_getName = _CFunction('stimulationcommand_getName')
+    _stimulationcommand_setName = _CFunction('stimulationcommand_setName')
+    _stimulationcommand_clone = _CFunction('stimulationcommand_clone', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationcommand_getSize = _CFunction('stimulationcommand_getSize', [opaque_ptr, POINTER(c_uint64)])
+    _stimulationcommand_setTracingId = _CFunction('stimulationcommand_setTracingId', [opaque_ptr, c_uint16])
+    _stimulationcommand_getTracingId = _CFunction('stimulationcommand_getTracingId', [opaque_ptr, POINTER(c_uint16)])
+    _stimulationcommand_setRepetitions = _CFunction('stimulationcommand_setRepetitions', [opaque_ptr, c_uint16])
+    _stimulationcommand_getRepetitions = \
+        _CFunction('stimulationcommand_getRepetitions', [opaque_ptr, POINTER(c_uint16)])
+    _stimulationcommand_destroy = _CFunction('stimulationcommand_destroy', [POINTER(opaque_ptr)])
     
-    def __init__(self, handle):
+    def __init__(self, handle, function_records: list = None):
+        '''@param handle           Handle of the C command.
+           @param function_records (Type: list) One tuple (atom_records,
+                repetitions, electrodes) per function in the command if
+                known, see atomarrays.
+        '''
+
         self._handle = handle
+        self._function_records = function_records
+        self._arrays = None
         self.valid = True
 
-        self._api = get_api_base()
-        self.__registerMethods(self._api)
-
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-
-        self._stimulationcommand_append = api.dll_instance.stimulationcommand_append
-        self._stimulationcommand_append.restype = CAPIStatus
-        self._stimulationcommand_append.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-        
-        self._stimulationcommand_getFunctionIterator = \
-            api.dll_instance.stimulationcommand_getFunctionIterator
-        self._stimulationcommand_getFunctionIterator.restype = CAPIStatus
-        self._stimulationcommand_getFunctionIterator.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-        
-        self._stimulationcommand_getCommandRepetitionAwareFunctionIterator = \
-             api.dll_instance.stimulationcommand_getCommandRepetitionAwareFunctionIterator
-        self._stimulationcommand_getCommandRepetitionAwareFunctionIterator.restype = CAPIStatus
-        self._stimulationcommand_getCommandRepetitionAwareFunctionIterator.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-        
-        self._stimulationcommand_getRepetitionAwareFunctionIterator = \
-             api.dll_instance.stimulationcommand_getRepetitionAwareFunctionIterator
-        self._stimulationcommand_getRepetitionAwareFunctionIterator.restype = CAPIStatus
-        self._stimulationcommand_getRepetitionAwareFunctionIterator.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-
-        self._stimulationcommand_getDuration = api.dll_instance.stimulationcommand_getDuration
-        self._stimulationcommand_getDuration.restype = CAPIStatus
-        self._stimulationcommand_getDuration.argtypes = [opaque_ptr, POINTER(c_uint64)]
-
-        self._stimulationcommand_getName = api.dll_instance.stimulationcommand_getName
-        self._stimulationcommand_getName.restype = CAPIStatus
-        
-        self._stimulationcommand_setName = api.dll_instance.stimulationcommand_setName
-        self._stimulationcommand_setName.restype = CAPIStatus
-
-        self._stimulationcommand_clone = api.dll_instance.stimulationcommand_clone
-        self._stimulationcommand_clone.restype = CAPIStatus
-        self._stimulationcommand_clone.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-
-        self._stimulationcommand_getSize = api.dll_instance.stimulationcommand_getSize
-        self._stimulationcommand_getSize.restype = CAPIStatus
-        self._stimulationcommand_getSize.argtypes = [opaque_ptr, POINTER(c_uint64)]
-
-        self._stimulationcommand_setTracingId = api.dll_instance.stimulationcommand_setTracingId
-        self._stimulationcommand_setTracingId.restype = CAPIStatus
-        self._stimulationcommand_setTracingId.argtypes = [opaque_ptr, c_uint16]
-
-        self._stimulationcommand_getTracingId = api.dll_instance.stimulationcommand_getTracingId
-        self._stimulationcommand_getTracingId.restype = CAPIStatus
-        self._stimulationcommand_getTracingId.argtypes = [opaque_ptr, POINTER(c_uint16)]
-
-        self._stimulationcommand_setRepetitions = api.dll_instance.stimulationcommand_setRepetitions
-        self._stimulationcommand_setRepetitions.restype = CAPIStatus
-        self._stimulationcommand_setRepetitions.argtypes = [opaque_ptr, c_uint16]
-
-        self._stimulationcommand_getRepetitions = api.dll_instance.stimulationcommand_getRepetitions
-        self._stimulationcommand_getRepetitions.restype = CAPIStatus
-        self._stimulationcommand_getRepetitions.argtypes = [opaque_ptr, POINTER(c_uint16)]
-
-        self._stimulationcommand_destroy = api.dll_instance.stimulationcommand_destroy
-        self._stimulationcommand_destroy.restype = CAPIStatus
-        self._stimulationcommand_destroy.argtypes = [POINTER(opaque_ptr)]
-    
     def __del__(self):
         '''Destroy the stimulation command if it was not invalidated by
             running it on an implant.
@@ -231,7 +182,7 @@ class StimulationCommand():
     def __copy__(self):
         '''Create a shallow copy of the command.'''
 
-        copy = type(self)(self._handle)
+        copy = type(self)(self._handle, self._function_records)
         copy.valid = self.valid
         return copy
     
@@ -247,7 +198,8 @@ class StimulationCommand():
         status = self._stimulationcommand_clone(self._handle, byref(copied_handle))
 
         if status == CAPIStatus.STATUS_OK:
-            copy = type(self)(copied_handle)
+            function_records = list(self._function_records) if self._function_records is not None else None
+            copy = type(self)(copied_handle, function_records)
             copy.valid = self.valid
             return copy
         else:
@@ -304,10 +256,16 @@ class StimulationCommand():
                 function to be appended.
         '''
 
+        if self._function_records is not None:
+            record = function._function_record()
+
         status = self._stimulationcommand_append(self._handle, byref(function._handle))
 
         if status == CAPIStatus.STATUS_OK:
             function.valid = False
+            if self._function_records is not None:
+                self._function_records.append(record)
+            self._arrays = None
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -333,14 +291,10 @@ class StimulationCommand():
         '''Get the name of the command. If the command name was not 
             set, empty string is returned'''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._stimulationcommand_getName(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._stimulationcommand_getName, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -420,3 +374,27 @@ class StimulationCommand():
 
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+        self._arrays = None
+
+    def to_arrays(self):
+        '''Get the atoms of all functions as AtomArrays (one row per 
+            atom, repetitions not expanded).
+
+            Commands created with the StimulationCommandFactory need no
+            C call except for the repetitions. The result is cached until
+            the command is changed with append or by setting 
+            repetitions.
+        '''
+
+        from pythonapi.atomarrays import AtomArrays
+
+        arrays = self._arrays
+        if arrays is None or (self._function_records is not None \
+                              and arrays.num_functions != len(self._function_records)):
+            if self._function_records is not None:
+                function_records = self._function_records
+            else:
+                function_records = [function._function_record() for function in self]
+            arrays = AtomArrays.from_records(function_records, self.repetitions)
+            self._arrays = arrays
+        return arrays
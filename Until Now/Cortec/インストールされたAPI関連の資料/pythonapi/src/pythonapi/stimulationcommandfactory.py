@@ -28,21 +28,31 @@
 
 from ctypes import pointer, byref, POINTER, c_double, c_uint64
 
-from pythonapi.pythonapibase import get_api_base, CAPIStatus, _Opaque, opaque_ptr, get_error_message
+from pythonapi.pythonapibase import CAPIStatus, _Opaque, opaque_ptr, get_error_message, _CFunction, _bind
 from pythonapi.stimulationcommand import StimulationCommand
 from pythonapi.stimulationfunction import StimulationFunction
-from pythonapi.stimulationatom import StimulationAtom
+from pythonapi.stimulationatom import StimulationAtom, AtomType
 
 class StimulationCommandFactory():
     '''Factory class for creating stimulation-related object instances.'''
 
-    def __init__(self):
-        api = get_api_base()
+    # C functions used by this class, bound once per process (see _CFunction)
+    _stimulationcommandfactory_createStimulationCommand = \
+        _CFunction('stimulationcommandfactory_createStimulationCommand', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationcommandfactory_createStimulationFunction = \
+        _CFunction('stimulationcommandfactory_createStimulationFunction', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationcommandfactory_createRectStimulationAtom = \
+        _CFunction('stimulationcommandfactory_createRectStimulationAtom',
+                   [opaque_ptr, POINTER(opaque_ptr), c_double, c_uint64])
+    _stimulationcommandfactory_create4RectStimulationAtom = \
+        _CFunction('stimulationcommandfactory_create4RectStimulationAtom',
+                   [opaque_ptr, POINTER(opaque_ptr), c_double, c_double, c_double, c_double, c_uint64])
+    _stimulationcommandfactory_createStimulationPauseAtom = \
+        _CFunction('stimulationcommandfactory_createStimulationPauseAtom', [opaque_ptr, POINTER(opaque_ptr), c_uint64])
 
+    def __init__(self):
         stimulationcommandfactory_getFactoryHandle = \
-            api.dll_instance.stimulationcommandfactory_getFactoryHandle
-        stimulationcommandfactory_getFactoryHandle.restype = CAPIStatus
-        stimulationcommandfactory_getFactoryHandle.argtypes = [POINTER(opaque_ptr)]
+            _bind('stimulationcommandfactory_getFactoryHandle', [POINTER(opaque_ptr)])
 
         self._handle = pointer(_Opaque())
 
@@ -51,39 +61,6 @@ class StimulationCommandFactory():
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"Could not create an stimulation command factory due to error: {status.name}")
 
-        self.__registerMethods(api)
-
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-        
-        self._stimulationcommandfactory_createStimulationCommand = \
-             api.dll_instance.stimulationcommandfactory_createStimulationCommand
-        self._stimulationcommandfactory_createStimulationCommand.restype = CAPIStatus
-        self._stimulationcommandfactory_createStimulationCommand.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-                
-        self._stimulationcommandfactory_createStimulationFunction = \
-             api.dll_instance.stimulationcommandfactory_createStimulationFunction
-        self._stimulationcommandfactory_createStimulationFunction.restype = CAPIStatus
-        self._stimulationcommandfactory_createStimulationFunction.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-
-        self._stimulationcommandfactory_createRectStimulationAtom = \
-            api.dll_instance.stimulationcommandfactory_createRectStimulationAtom
-        self._stimulationcommandfactory_createRectStimulationAtom.restype = CAPIStatus
-        self._stimulationcommandfactory_createRectStimulationAtom.argtypes = \
-            [opaque_ptr, POINTER(opaque_ptr), c_double, c_uint64]
-
-        self._stimulationcommandfactory_create4RectStimulationAtom = \
-            api.dll_instance.stimulationcommandfactory_create4RectStimulationAtom
-        self._stimulationcommandfactory_create4RectStimulationAtom.restype = CAPIStatus
-        self._stimulationcommandfactory_create4RectStimulationAtom.argtypes = \
-            [opaque_ptr, POINTER(opaque_ptr), c_double, c_double, c_double, c_double, c_uint64]
-            
-        self._stimulationcommandfactory_createStimulationPauseAtom = \
-            api.dll_instance.stimulationcommandfactory_createStimulationPauseAtom
-        self._stimulationcommandfactory_createStimulationPauseAtom.restype = CAPIStatus
-        self._stimulationcommandfactory_createStimulationPauseAtom.argtypes = \
-            [opaque_ptr, POINTER(opaque_ptr), c_uint64]
-
     def create_stimulation_command(self):
         '''Creates an empty stimulation command.'''
 
@@ -92,7 +69,7 @@ class StimulationCommandFactory():
         status = self._stimulationcommandfactory_createStimulationCommand(self._handle, byref(command))
 
         if status == CAPIStatus.STATUS_OK:
-            return StimulationCommand(command)
+            return StimulationCommand(command, [])
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -104,7 +81,7 @@ class StimulationCommandFactory():
         status = self._stimulationcommandfactory_createStimulationFunction(self._handle, byref(function))
 
         if status == CAPIStatus.STATUS_OK:
-            return StimulationFunction(function)
+            return StimulationFunction(function, [], ((), (), False))
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -127,7 +104,7 @@ class StimulationCommandFactory():
             self._handle, byref(atom), c_double(value), c_uint64(duration))
 
         if status == CAPIStatus.STATUS_OK:
-            return StimulationAtom(atom)
+            return StimulationAtom(atom, (AtomType.AT_RECTANGULAR, (float(value), 0., 0., 0.), int(duration)))
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -155,7 +132,9 @@ class StimulationCommandFactory():
             c_double(amplitude1), c_double(amplitude2), c_double(amplitude3), c_uint64(duration))
 
         if status == CAPIStatus.STATUS_OK:
-            return StimulationAtom(atom)
+            return StimulationAtom(atom, (AtomType.AT_RECTANGULAR_4_AMPLITUDE,
+                                          (float(amplitude0), float(amplitude1), float(amplitude2), float(amplitude3)),
+                                          int(duration)))
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -172,6 +151,6 @@ class StimulationCommandFactory():
             self._handle, byref(atom), c_uint64(duration))
 
         if status == CAPIStatus.STATUS_OK:
-            return StimulationAtom(atom)
+            return StimulationAtom(atom, (AtomType.AT_PAUSE, (0., 0., 0., 0.), int(duration)))
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
@@ -0,0 +1,299 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring stimulationcompiler
+
+    Compiler building stimulation commands from a declarative 
+    specification.
+
+    A specification is a dict (or its JSON text) of the form
+
+        {"name": "Example",             # optional
+         "repetitions": 1,              # optional
+         "tracing_id": 0,               # optional
+         "functions": [
+            {"name": "PulseExample",    # optional
+             "repetitions": 10,         # optional
+             "electrodes": [[0], [1]],  # optional: source, destination
+             "use_ground_electrode": False,
+             "atoms": [["4rect", 1000., 0., 0., 0., 400],
+                       ["rect", 0., 2550],
+                       ["pause", 30000]]},
+            ...]}
+
+    Atoms are given as lists (type, amplitudes..., duration) with the 
+    types 'rect' (one amplitude), '4rect' (four amplitudes) and 'pause'
+    (no amplitude), as dicts {"type": ..., "amplitudes": [...], 
+    "duration": ...}, or as NumPy structured array with dtype 
+    ATOM_DTYPE (type is an AtomType).
+
+    The command is built in one pass calling the C api directly, 
+    without Python wrapper objects for the atoms. Compiled commands are
+    cached by their specification; compile returns a clone (one C call)
+    of the cached command, which may be run on an implant like any 
+    other command.
+
+    Typical usage:
+
+        compiler = StimulationCompiler()
+        command = compiler.compile(spec)
+        implant.start_stimulation(command)
+'''
+from collections import OrderedDict
+from ctypes import byref, pointer, c_double, c_uint64
+from copy import deepcopy
+import json
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Union
+
+import numpy as np
+
+from pythonapi.pythonapibase import CAPIStatus, _Opaque, get_error_message
+from pythonapi.stimulationatom import AtomType, StimulationAtom
+from pythonapi.stimulationcommand import StimulationCommand
+from pythonapi.stimulationcommandfactory import StimulationCommandFactory
+
+# One record per atom, unused amplitudes are 0
+ATOM_DTYPE = np.dtype([("type", np.uint8), ("amplitudes", np.float64, (4,)), ("duration", np.uint64)])
+
+_ATOM_TYPE_NAMES = {"rect": AtomType.AT_RECTANGULAR,
+                    "4rect": AtomType.AT_RECTANGULAR_4_AMPLITUDE,
+                    "pause": AtomType.AT_PAUSE}
+
+_NUM_AMPLITUDES = {AtomType.AT_RECTANGULAR: 1,
+                   AtomType.AT_RECTANGULAR_4_AMPLITUDE: 4,
+                   AtomType.AT_PAUSE: 0}
+
+def _atom_type(value) -> AtomType:
+    if isinstance(value, str):
+        try:
+            return _ATOM_TYPE_NAMES[value.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown atom type '{value}'.") from None
+    atom_type = AtomType(int(value))
+    if atom_type not in _NUM_AMPLITUDES:
+        raise ValueError(f"Atom type {atom_type.name} cannot be compiled.")
+    return atom_type
+
+def _normalize_atom(atom) -> tuple:
+    '''Convert an atom of the specification to 
+        (AtomType, (a0, a1, a2, a3), duration).
+    '''
+
+    if isinstance(atom, dict):
+        atom_type = _atom_type(atom["type"])
+        amplitudes = tuple(float(value) for value in atom.get("amplitudes", ()))
+        duration = int(atom["duration"])
+    else:
+        atom_type = _atom_type(atom[0])
+        amplitudes = tuple(float(value) for value in atom[1:-1])
+        duration = int(atom[-1])
+
+    num_amplitudes = _NUM_AMPLITUDES[atom_type]
+    if len(amplitudes) > num_amplitudes or (len(amplitudes) < num_amplitudes and len(amplitudes) != 1):
+        raise ValueError(f"Atom of type {atom_type.name} requires {num_amplitudes} amplitude(s), "
+                         f"got {len(amplitudes)}.")
+    # A single amplitude of a 4-rect atom is the first one, the others are 0
+    amplitudes = (amplitudes + (0., 0., 0., 0.))[:4]
+    return atom_type, amplitudes, duration
+
+def _normalize_atoms(atoms) -> tuple:
+    if isinstance(atoms, np.ndarray):
+        if atoms.dtype != ATOM_DTYPE:
+            raise ValueError("Atom arrays must have the dtype ATOM_DTYPE.")
+        return tuple((_atom_type(record["type"]), tuple(float(value) for value in record["amplitudes"]),
+                      int(record["duration"])) for record in atoms)
+    return tuple(_normalize_atom(atom) for atom in atoms)
+
+def _normalize_function(function: dict) -> tuple:
+    electrodes = function.get("electrodes")
+    if electrodes is not None:
+        if len(electrodes) != 2:
+            raise ValueError("electrodes must consist of the source and the destination electrodes.")
+        electrodes = tuple(tuple(int(channel) for channel in channels) for channels in electrodes)
+    return (str(function.get("name", "")),
+            int(function.get("repetitions", 1)),
+            electrodes,
+            bool(function.get("use_ground_electrode", False)),
+            _normalize_atoms(function["atoms"]))
+
+def normalize_spec(spec: Union[dict, str]) -> tuple:
+    '''Convert a specification into its canonical, hashable form 
+        (name, repetitions, tracing_id, functions), which is used as key
+        of the cache. Raises ValueError for invalid specifications.
+
+       @param spec (Type: dict or str) The specification or its JSON 
+            text.
+    '''
+
+    if isinstance(spec, (str, bytes)):
+        spec = json.loads(spec)
+    tracing_id = spec.get("tracing_id")
+    return (str(spec.get("name", "")),
+            int(spec.get("repetitions", 1)),
+            int(tracing_id) if tracing_id is not None else None,
+            tuple(_normalize_function(function) for function in spec["functions"]))
+
+class StimulationCompiler():
+    '''Builds stimulation commands from specifications and caches them.
+
+        The cache holds at most max_entries commands and discards the 
+        least recently used one. compile may be called from several 
+        threads.
+    '''
+
+    def __init__(self, factory: StimulationCommandFactory = None, max_entries: int = 128):
+        '''@param factory     (Type: StimulationCommandFactory) Factory
+                used to create the objects. A new one is created if not
+                given.
+           @param max_entries (Type: int) Maximum number of cached 
+                commands.
+        '''
+
+        self._factory = factory if factory is not None else StimulationCommandFactory()
+        self._max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.compile_time_s = 0.
+
+    def compile(self, spec: Union[dict, str]) -> StimulationCommand:
+        '''Get a new command for the specification. 
+
+           @param spec (Type: dict, str or tuple) The specification, 
+                its JSON text (see module documentation) or its 
+                normalized form (see normalize_spec).
+        '''
+
+        key = spec if isinstance(spec, tuple) else normalize_spec(spec)
+
+        with self._lock:
+            command = self._cache.get(key)
+            if command is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return deepcopy(command)
+
+        start = perf_counter()
+        command = self._build(key)
+        elapsed = perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self.compile_time_s += elapsed
+            self._cache[key] = command
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+        return deepcopy(command)
+
+    def clear(self):
+        '''Remove all cached commands.'''
+
+        with self._lock:
+            self._cache.clear()
+
+    @property
+    def statistics(self) -> Dict[str, float]:
+        '''Counters of the compiler.
+
+            - hits:           Commands cloned from the cache.
+            - misses:         Commands built from scratch.
+            - entries:        Currently cached commands.
+            - compile_time_s: Total time spent building commands.
+        '''
+
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "entries": len(self._cache),
+                    "compile_time_s": self.compile_time_s}
+
+    def _build(self, key: tuple) -> StimulationCommand:
+        '''Create the command described by a normalized specification.'''
+
+        name, repetitions, tracing_id, functions = key
+        factory = self._factory
+
+        command = factory.create_stimulation_command()
+        for function_name, function_repetitions, electrodes, use_ground_electrode, atoms in functions:
+            function = factory.create_stimulation_function()
+            if function_name:
+                function.name = function_name
+            function.repetitions = function_repetitions
+            if electrodes is not None:
+                function.set_virtual_stim_electrodes(electrodes, use_ground_electrode)
+            for atom_type, amplitudes, duration in atoms:
+                self._append_atom(function, atom_type, amplitudes, duration)
+            command.append(function)
+
+        if name:
+            command.name = name
+        if repetitions != 1:
+            command.repetitions = repetitions
+        if tracing_id is not None:
+            command.tracing_id = tracing_id
+        return command
+
+    def _append_atom(self, function, atom_type: AtomType, amplitudes: tuple, duration: int):
+        '''Create an atom and append it to the function without creating
+            a StimulationAtom object.
+        '''
+
+        factory = self._factory
+        atom = pointer(_Opaque())
+
+        if atom_type == AtomType.AT_RECTANGULAR_4_AMPLITUDE:
+            status = factory._stimulationcommandfactory_create4RectStimulationAtom(
+                factory._handle, byref(atom), c_double(amplitudes[0]), c_double(amplitudes[1]),
+                c_double(amplitudes[2]), c_double(amplitudes[3]), c_uint64(duration))
+        elif atom_type == AtomType.AT_RECTANGULAR:
+            status = factory._stimulationcommandfactory_createRectStimulationAtom(
+                factory._handle, byref(atom), c_double(amplitudes[0]), c_uint64(duration))
+        else:
+            status = factory._stimulationcommandfactory_createStimulationPauseAtom(
+                factory._handle, byref(atom), c_uint64(duration))
+
+        if status != CAPIStatus.STATUS_OK:
+            raise RuntimeError(f"{status.name}: {get_error_message()}")
+
+        status = function._stimulationfunction_append(function._handle, byref(atom))
+
+        if status != CAPIStatus.STATUS_OK:
+            # The atom is still owned here and destroyed with the wrapper
+            StimulationAtom(atom)
+            raise RuntimeError(f"{status.name}: {get_error_message()}")
+
+        function._atom_records.append((atom_type, amplitudes, duration))
+        function._arrays = None
+
+_default_compiler: StimulationCompiler = None
+_default_compiler_lock = Lock()
+
+def compile_stimulation_command(spec: Union[dict, str]) -> StimulationCommand:
+    '''Compile a specification with a module-wide StimulationCompiler.
+
+       @param spec (Type: dict or str) The specification or its JSON 
+            text (see module documentation).
+    '''
+
+    global _default_compiler
+    with _default_compiler_lock:
+        if _default_compiler is None:
+            _default_compiler = StimulationCompiler()
+    return _default_compiler.compile(spec)
@@ -0,0 +1,240 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring stimulationevents
+
+    Index of the stimulations found in the sample stream.
+
+    A stimulation starts with the sample whose stimulation_id is set
+    (not SAMPLE_NO_STIMULATION) and lasts while is_stimulation_active is
+    set. The StimulationEventIndex records onset, offset and id of each
+    stimulation as the data arrives, so stimulations can be looked up 
+    with a binary search instead of scanning the samples again.
+
+    Samples are addressed by their stream position: the number of 
+    samples received or lost before them. Unlike the measurement 
+    counter it does not wrap around and keeps increasing when the 
+    measurement is restarted, so it is sorted. The listener of an 
+    implant maintains an index (Implant.stimulation_events) with the
+    positions given by its CounterTracker.
+'''
+from threading import Lock
+
+import numpy as np
+
+from pythonapi.gapdetection import COUNTER_MODULO
+from pythonapi.sampleblock import SampleBlock, SAMPLE_NO_STIMULATION
+
+# Offset of stimulations which are still active
+OFFSET_OPEN = -1
+
+_HALF_MODULO = COUNTER_MODULO // 2
+
+STIMULATION_EVENT_DTYPE = np.dtype([("onset", np.int64),
+                                    ("offset", np.int64),
+                                    ("onset_counter", np.uint32),
+                                    ("offset_counter", np.uint32),
+                                    ("stimulation_id", np.uint16)])
+
+class StimulationEventIndex():
+    '''Growable array of stimulation events sorted by onset.
+
+        Each event holds the stream position and measurement counter of
+        its first (onset) and last active (offset) sample and the 
+        stimulation id. The offset is OFFSET_OPEN while the stimulation
+        is active. A stimulation without active samples ends with its 
+        onset sample.
+
+        Events are added by one thread (the callback thread) and can be
+        queried from others.
+    '''
+
+    def __init__(self, capacity: int = 256):
+        '''@param capacity (Type: int) Initial number of events that fit
+                into the array.
+        '''
+
+        self._events = np.zeros(max(capacity, 1), dtype=STIMULATION_EVENT_DTYPE)
+        self._count = 0
+        self._lock = Lock()
+
+        self.is_active = False
+        self._last_position = None
+        self._last_counter = None
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def events(self) -> np.ndarray:
+        '''Read-only view of all events (dtype STIMULATION_EVENT_DTYPE).'''
+
+        with self._lock:
+            events = self._events[:self._count]
+        events.flags.writeable = False
+        return events
+
+    def clear(self):
+        '''Remove all events.'''
+
+        with self._lock:
+            self._count = 0
+        self.is_active = False
+
+    def _append(self, position: int, counter: int, stimulation_id: int):
+        '''Add a new open event. Requires the lock.'''
+
+        if self._count == len(self._events):
+            events = np.zeros(2 * len(self._events), dtype=STIMULATION_EVENT_DTYPE)
+            events[:self._count] = self._events[:self._count]
+            self._events = events
+
+        self._events[self._count] = (position, OFFSET_OPEN, counter, 0, stimulation_id)
+        self._count += 1
+
+    def _close(self, position: int, counter: int):
+        '''Set the offset of the last event if it is open. Requires the 
+            lock.
+        '''
+
+        if self._count > 0 and self._events[self._count - 1]["offset"] == OFFSET_OPEN:
+            self._events[self._count - 1]["offset"] = position
+            self._events[self._count - 1]["offset_counter"] = counter
+
+    def add_sample(self, position: int, counter: int, stimulation_id: int, is_stimulation_active: bool):
+        '''Process one sample. Only needs to be called for samples with
+            a stimulation id or with is_stimulation_active differing 
+            from the is_active attribute, others are ignored anyway.
+
+           @param position              (Type: int)  Stream position.
+           @param counter               (Type: int)  Measurement counter.
+           @param stimulation_id        (Type: int)  Stimulation id of 
+                the sample.
+           @param is_stimulation_active (Type: bool) Whether a 
+                stimulation is active.
+        '''
+
+        # A stimulation ends with the sample preceding the current one
+        previous_counter = (counter - 1) % COUNTER_MODULO
+
+        with self._lock:
+            if stimulation_id != SAMPLE_NO_STIMULATION:
+                if self.is_active:
+                    self._close(position - 1, previous_counter)
+                self._append(position, counter, stimulation_id)
+                if not is_stimulation_active:
+                    self._close(position, counter)
+            elif self.is_active and not is_stimulation_active:
+                self._close(position - 1, previous_counter)
+
+        self.is_active = bool(is_stimulation_active) and self._count > 0
+        self._last_position = position
+        self._last_counter = counter
+
+    def add_block(self, block: SampleBlock, first_position: int, missing: np.ndarray = None):
+        '''Process the samples of a block.
+
+           @param block          (Type: SampleBlock) The samples.
+           @param first_position (Type: int) Stream position of the 
+                first sample (or of the first lost sample before it).
+           @param missing        (Type: numpy.ndarray) Number of samples
+                lost before each sample (see 
+                CounterTracker.update_block) or None if the block is 
+                continuous.
+        '''
+
+        num_samples = len(block)
+        if num_samples == 0:
+            return
+
+        active = block.is_stimulation_active
+        onsets = np.flatnonzero(block.stimulation_id != SAMPLE_NO_STIMULATION)
+        # Samples whose active state differs from the preceding one
+        changes = np.flatnonzero(active != np.concatenate([[self.is_active], active[:-1]]))
+
+        if missing is not None:
+            first_position += int(missing[0])
+            positions = first_position + np.arange(num_samples) + np.cumsum(missing) - missing[0]
+        else:
+            positions = None
+
+        def position_of(index):
+            return int(positions[index]) if positions is not None else first_position + index
+
+        if len(onsets) > 0 or len(changes) > 0:
+            counters = block.measurement_counter
+            for index in np.union1d(onsets, changes):
+                self.add_sample(position_of(index), int(counters[index]), int(block.stimulation_id[index]),
+                                bool(active[index]))
+
+        self._last_position = position_of(num_samples - 1)
+        self._last_counter = int(block.measurement_counter[-1])
+
+    def position_of_counter(self, counter: int) -> int:
+        '''Map a measurement counter to a stream position relative to 
+            the last processed sample with a stimulation (in block mode:
+            the last sample of the last block). The counter must lie 
+            within 2^31 samples of that sample and the counter must not
+            have been reset in between. Returns None if no such sample 
+            was processed yet.
+
+           @param counter (Type: int) The measurement counter.
+        '''
+
+        if self._last_position is None:
+            return None
+        difference = (counter - self._last_counter + _HALF_MODULO) % COUNTER_MODULO - _HALF_MODULO
+        return self._last_position + difference
+
+    def find(self, start: int, stop: int) -> np.ndarray:
+        '''Get the events with onsets in the stream positions start to
+            stop - 1 (binary search).
+
+           @param start (Type: int) First stream position.
+           @param stop  (Type: int) Stream position after the last one.
+        '''
+
+        events = self.events
+        onsets = events["onset"]
+        return events[np.searchsorted(onsets, start, 'left'):np.searchsorted(onsets, stop, 'left')]
+
+    def find_counters(self, first_counter: int, last_counter: int) -> np.ndarray:
+        '''Get the events with onsets between two measurement counters
+            (both inclusive), see position_of_counter.
+
+           @param first_counter (Type: int) Counter of the first sample.
+           @param last_counter  (Type: int) Counter of the last sample.
+        '''
+
+        start = self.position_of_counter(first_counter)
+        if start is None:
+            return self.events[:0]
+        stop = start + (last_counter - first_counter) % COUNTER_MODULO + 1
+        return self.find(start, stop)
+
+    def event_at(self, position: int):
+        '''Get the event active at a stream position or None.
+
+           @param position (Type: int) The stream position.
+        '''
+
+        events = self.events
+        index = np.searchsorted(events["onset"], position, 'right') - 1
+        if index < 0:
+            return None
+        event = events[index]
+        if event["offset"] != OFFSET_OPEN and event["offset"] < position:
+            return None
+        return event
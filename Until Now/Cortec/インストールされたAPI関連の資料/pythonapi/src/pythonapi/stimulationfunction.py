@@ -102,10 +102,11 @@
     By adding the constant SRC_CHANNEL_GROUND_ELECTRODE to the destination
     electrodes, stimulation to ground is enabled.
 '''
-from ctypes import POINTER, byref, pointer, c_bool, c_uint32, c_uint64, c_size_t, create_string_buffer
+from ctypes import POINTER, byref, pointer, c_bool, c_uint32, c_uint64, c_size_t
+from math import nan
 from typing import Tuple, List
 
-from pythonapi.pythonapibase import get_api_base, _CAPIEnum, CAPIStatus, opaque_ptr, _Opaque, c_size_t_ptr, _CAPIUint32Set, get_error_message
+from pythonapi.pythonapibase import _CAPIEnum, CAPIStatus, opaque_ptr, _Opaque, _CAPIUint32Set, get_error_message, _CFunction, _buffers
 from pythonapi.stimulationatom import StimulationAtom
 
 class StimulationFunction():
@@ -114,100 +115,58 @@ class StimulationFunction():
         Atoms in the function can be iterated.
     '''
 
-    def __init__(self, handle):
+    # C functions used by this class, bound once per process (see _CFunction)
+
+    ### Functions for stimulation function
+
+    _stimulationfunction_append = _CFunction('stimulationfunction_append', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationfunction_getAtomIterator = \
+        _CFunction('stimulationfunction_getAtomIterator', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationfunction_setRepetitions = _CFunction('stimulationfunction_setRepetitions', [opaque_ptr, c_uint32])
+    _stimulationfunction_getRepetitions = \
+        _CFunction('stimulationfunction_getRepetitions', [opaque_ptr, POINTER(c_uint32)])
+    _stimulationfunction_getName = _CFunction('stimulationfunction_getName')
+    _stimulationfunction_setName = _CFunction('stimulationfunction_setName')
+    _stimulationfunction_getDuration = _CFunction('stimulationfunction_getDuration', [opaque_ptr, POINTER(c_uint64)])
+    _stimulationfunction_getPeriod = _CFunction('stimulationfunction_getPeriod', [opaque_ptr, POINTER(c_uint64)])
+    _stimulationfunction_setVirtualStimulationElectrodes = \
+        _CFunction('stimulationfunction_setVirtualStimulationElectrodes',
+                   [opaque_ptr, POINTER(_CAPIUint32Set), POINTER(_CAPIUint32Set), c_bool])
+    _stimulationfunction_getVirtualStimulationElectrodes = \
+        _CFunction('stimulationfunction_getVirtualStimulationElectrodes',
+                   [opaque_ptr, POINTER(_CAPIUint32Set), POINTER(_CAPIUint32Set)])
+    _stimulationfunction_clone = _CFunction('stimulationfunction_clone', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationfunction_hasEqualSignalForm = \
+        _CFunction('stimulationfunction_hasEqualSignalForm', [opaque_ptr, opaque_ptr, POINTER(c_bool)])
+    _stimulationfunction_hasEqualVirtualStimulationElectrodes = \
+        _CFunction('stimulationfunction_hasEqualVirtualStimulationElectrodes',
+                   [opaque_ptr, opaque_ptr, POINTER(c_bool)])
+    _stimulationfunction_usesGroundElectrode = \
+        _CFunction('stimulationfunction_usesGroundElectrode', [opaque_ptr, POINTER(c_bool)])
+    _stimulationfunction_destroy = _CFunction('stimulationfunction_destroy', [POINTER(opaque_ptr)])
+
+    ### Functions for stimulation atom iterator
+
+    _stimulationatomiterator_next = _CFunction('stimulationatomiterator_next', [opaque_ptr])
+    _stimulationatomiterator_isDone = _CFunction('stimulationatomiterator_isDone', [opaque_ptr, POINTER(c_bool)])
+    _stimulationatomiterator_getCurrentItem = \
+        _CFunction('stimulationatomiterator_getCurrentItem', [opaque_ptr, POINTER(opaque_ptr)])
+    _stimulationatomiterator_destroy = _CFunction('stimulationatomiterator_destroy', [POINTER(opaque_ptr)])
+
+    def __init__(self, handle, atom_records: list = None, electrodes: tuple = None):
+        '''@param handle       Handle of the C function.
+           @param atom_records (Type: list) Records of the atoms in the 
+                function if known, see atomarrays.
+           @param electrodes   (Type: tuple) (source, destination, 
+                use_ground_electrode) if known.
+        '''
+
         self._handle = handle
         self._iterator_handle = None
+        self._atom_records = atom_records
+        self._electrodes = electrodes
+        self._arrays = None
         self.valid = True
-        
-        api = get_api_base()
-        self.__registerMethods(api)
-
-    def __registerMethods(self, api):
-        '''Register DLL methods used by this class.'''
-
-        ### Functions for stimulation function
-
-        self._stimulationfunction_append = api.dll_instance.stimulationfunction_append
-        self._stimulationfunction_append.restype = CAPIStatus
-        self._stimulationfunction_append.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-
-        self._stimulationfunction_getAtomIterator = api.dll_instance.stimulationfunction_getAtomIterator
-        self._stimulationfunction_getAtomIterator.restype = CAPIStatus
-        self._stimulationfunction_getAtomIterator.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-
-        self._stimulationfunction_setRepetitions = api.dll_instance.stimulationfunction_setRepetitions
-        self._stimulationfunction_setRepetitions.restype = CAPIStatus
-        self._stimulationfunction_setRepetitions.argtypes = [opaque_ptr, c_uint32]
-        
-        self._stimulationfunction_getRepetitions = api.dll_instance.stimulationfunction_getRepetitions
-        self._stimulationfunction_getRepetitions.restype = CAPIStatus
-        self._stimulationfunction_getRepetitions.argtypes = [opaque_ptr, POINTER(c_uint32)]
-
-        self._stimulationfunction_getName = api.dll_instance.stimulationfunction_getName
-        self._stimulationfunction_getName.restype = CAPIStatus
-        
-        self._stimulationfunction_setName = api.dll_instance.stimulationfunction_setName
-        self._stimulationfunction_setName.restype = CAPIStatus
-                
-        self._stimulationfunction_getDuration = api.dll_instance.stimulationfunction_getDuration
-        self._stimulationfunction_getDuration.restype = CAPIStatus
-        self._stimulationfunction_getDuration.argtypes = [opaque_ptr, POINTER(c_uint64)]
-                
-        self._stimulationfunction_getPeriod = api.dll_instance.stimulationfunction_getPeriod
-        self._stimulationfunction_getPeriod.restype = CAPIStatus
-        self._stimulationfunction_getPeriod.argtypes = [opaque_ptr, POINTER(c_uint64)]
-                
-        self._stimulationfunction_setVirtualStimulationElectrodes = \
-            api.dll_instance.stimulationfunction_setVirtualStimulationElectrodes
-        self._stimulationfunction_setVirtualStimulationElectrodes.restype = CAPIStatus
-        self._stimulationfunction_setVirtualStimulationElectrodes.argtypes = \
-         [opaque_ptr, POINTER(_CAPIUint32Set), POINTER(_CAPIUint32Set), c_bool]
-                
-        self._stimulationfunction_getVirtualStimulationElectrodes = \
-            api.dll_instance.stimulationfunction_getVirtualStimulationElectrodes
-        self._stimulationfunction_getVirtualStimulationElectrodes.restype = CAPIStatus
-        self._stimulationfunction_getVirtualStimulationElectrodes.argtypes = \
-            [opaque_ptr, POINTER(_CAPIUint32Set), POINTER(_CAPIUint32Set)]
-            
-        self._stimulationfunction_clone = api.dll_instance.stimulationfunction_clone
-        self._stimulationfunction_clone.restype = CAPIStatus
-        self._stimulationfunction_clone.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-                    
-        self._stimulationfunction_hasEqualSignalForm = api.dll_instance.stimulationfunction_hasEqualSignalForm
-        self._stimulationfunction_hasEqualSignalForm.restype = CAPIStatus
-        self._stimulationfunction_hasEqualSignalForm.argtypes = [opaque_ptr, opaque_ptr, POINTER(c_bool)]
-        
-        self._stimulationfunction_hasEqualVirtualStimulationElectrodes = \
-            api.dll_instance.stimulationfunction_hasEqualVirtualStimulationElectrodes
-        self._stimulationfunction_hasEqualVirtualStimulationElectrodes.restype = CAPIStatus
-        self._stimulationfunction_hasEqualVirtualStimulationElectrodes.argtypes = \
-            [opaque_ptr, opaque_ptr, POINTER(c_bool)]
-            
-        self._stimulationfunction_usesGroundElectrode = api.dll_instance.stimulationfunction_usesGroundElectrode
-        self._stimulationfunction_usesGroundElectrode.restype = CAPIStatus
-        self._stimulationfunction_usesGroundElectrode.argtypes = [opaque_ptr, POINTER(c_bool)]
-
-        self._stimulationfunction_destroy = api.dll_instance.stimulationfunction_destroy
-        self._stimulationfunction_destroy.restype = CAPIStatus
-        self._stimulationfunction_destroy.argtypes = [POINTER(opaque_ptr)]
-
-        ### Functions for stimulation atom iterator
-
-        self._stimulationatomiterator_next = api.dll_instance.stimulationatomiterator_next
-        self._stimulationatomiterator_next.restype = CAPIStatus
-        self._stimulationatomiterator_next.argtypes = [opaque_ptr]
-        
-        self._stimulationatomiterator_isDone = api.dll_instance.stimulationatomiterator_isDone
-        self._stimulationatomiterator_isDone.restype = CAPIStatus
-        self._stimulationatomiterator_isDone.argtypes = [opaque_ptr, POINTER(c_bool)]
-
-        self._stimulationatomiterator_getCurrentItem = api.dll_instance.stimulationatomiterator_getCurrentItem
-        self._stimulationatomiterator_getCurrentItem.restype = CAPIStatus
-        self._stimulationatomiterator_getCurrentItem.argtypes = [opaque_ptr, POINTER(opaque_ptr)]
-        
-        self._stimulationatomiterator_destroy = api.dll_instance.stimulationatomiterator_destroy
-        self._stimulationatomiterator_destroy.restype = CAPIStatus
-        self._stimulationatomiterator_destroy.argtypes = [POINTER(opaque_ptr)]
 
     def __del__(self):
         '''Destroy the stimulation function handle if it was not 
@@ -221,7 +180,7 @@ class StimulationFunction():
     def __copy__(self):
         '''Create a shallow copy of the function.'''
         
-        copy = type(self)(self._handle)
+        copy = type(self)(self._handle, self._atom_records, self._electrodes)
         copy._iterator_handle = self._iterator_handle
         copy.valid = self.valid
         return copy
@@ -238,7 +197,8 @@ class StimulationFunction():
         status = self._stimulationfunction_clone(self._handle, byref(copied_handle))
 
         if status == CAPIStatus.STATUS_OK:
-            copy = type(self)(copied_handle)
+            atom_records = list(self._atom_records) if self._atom_records is not None else None
+            copy = type(self)(copied_handle, atom_records, self._electrodes)
             copy.valid = self.valid
             return copy
         else:
@@ -324,10 +284,17 @@ class StimulationFunction():
                 appended.
         '''
 
+        record = atom._record
+        if record is None and self._atom_records is not None:
+            record = (atom.atom_type, (nan, nan, nan, nan), atom.duration)
+
         status = self._stimulationfunction_append(self._handle, byref(atom._handle))
 
         if status == CAPIStatus.STATUS_OK:
             atom.valid = False
+            if self._atom_records is not None:
+                self._atom_records.append(record)
+            self._arrays = None
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -359,19 +326,16 @@ class StimulationFunction():
         
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+        self._arrays = None
 
     @property
     def name(self) -> str:
         '''Get the name of the function.'''
 
-        buffer_size = 128
-        buffer = create_string_buffer(buffer_size)
-        string_length_ptr = c_size_t_ptr(c_size_t(0))
-                
-        status = self._stimulationfunction_getName(self._handle, buffer, buffer_size, string_length_ptr)
+        status, result = _buffers.call_string(self._stimulationfunction_getName, self._handle)
 
         if status == CAPIStatus.STATUS_OK:
-            return buffer.value.decode("utf-8")
+            return result
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -425,16 +389,11 @@ class StimulationFunction():
     def virtual_stim_electrodes(self) -> Tuple[List[int], List[int]]:
         '''Get the virtual electrodes for the stimulation function.'''
 
-        vector_size = 127
-        ctypes_vector_t = c_uint32 * vector_size
-        source = _CAPIUint32Set(c_size_t(vector_size), ctypes_vector_t())
-        destination = _CAPIUint32Set(c_size_t(vector_size), ctypes_vector_t())
-
-        status = self._stimulationfunction_getVirtualStimulationElectrodes( \
-            self._handle, byref(source), byref(destination))
+        status, (source, destination) = \
+            _buffers.call_uint32_sets(self._stimulationfunction_getVirtualStimulationElectrodes, self._handle)
         
         if status == CAPIStatus.STATUS_OK:
-            return source.elements[:source.size], destination.elements[:destination.size]
+            return source, destination
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
 
@@ -463,6 +422,8 @@ class StimulationFunction():
         
         if status != CAPIStatus.STATUS_OK:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+        self._electrodes = (tuple(channels_sets[0]), tuple(channels_sets[1]), bool(use_ground_electrode))
+        self._arrays = None
         
     def has_equal_signal_form(self, other) -> bool:
         '''Check if another function has the same form (i.e., consist
@@ -510,3 +471,40 @@ class StimulationFunction():
             return result.value
         else:
             raise RuntimeError(f"{status.name}: {get_error_message()}")
+
+    def _records(self) -> tuple:
+        '''Records of the atoms (see atomarrays). Atom types and 
+            durations are read from the C api if the content of the 
+            function is not known.
+        '''
+
+        if self._atom_records is not None:
+            return tuple(self._atom_records)
+        return tuple((atom.atom_type, (nan, nan, nan, nan), atom.duration) for atom in self)
+
+    def _function_record(self) -> tuple:
+        '''Record (atom_records, repetitions, electrodes) of the 
+            function (see atomarrays).
+        '''
+
+        electrodes = self._electrodes
+        if electrodes is None:
+            source, destination = self.virtual_stim_electrodes
+            electrodes = (tuple(source), tuple(destination), self.uses_ground_electrode())
+        return self._records(), self.repetitions, electrodes
+
+    def to_arrays(self):
+        '''Get the atoms of the function as AtomArrays (one row per 
+            atom, repetitions not expanded).
+
+            The result is cached until the function is changed with
+            append, by setting repetitions or the electrodes.
+        '''
+
+        from pythonapi.atomarrays import AtomArrays
+
+        arrays = self._arrays
+        if arrays is None or (self._atom_records is not None and arrays.num_atoms != len(self._atom_records)):
+            arrays = AtomArrays.from_records([self._function_record()])
+            self._arrays = arrays
+        return arrays
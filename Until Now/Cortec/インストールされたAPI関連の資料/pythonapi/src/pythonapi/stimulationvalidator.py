@@ -0,0 +1,399 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring stimulationvalidator
+
+    Local pre-validation of stimulation pulses.
+
+    Implant.is_stimulation_command_valid needs a complete command and a
+    C call per candidate. The StimulationValidator checks a whole batch
+    of candidate pulses at once with NumPy against the rules documented
+    in stimulationfunction (amplitude and duration ranges, their 
+    granularity, the shape of the counter pulse) and against the 
+    stimulation capabilities of the channels (ImplantInfo.channel_table).
+    Only candidates passing these checks need to be confirmed by the 
+    implant, see StimulationValidator.select_valid.
+
+    A batch of candidates is a structured array with dtype PULSE_DTYPE
+    (see make_pulses), one row per pulse, plus the source and 
+    destination electrodes of each pulse.
+
+    The documented main amplitudes below -3060 uA ([-6120, -6096, ..., 
+    -3084, -3060]) do not fit a single grid of 24 uA: -6120 is a 
+    multiple of 24 from 0, -3084 is 24 uA below -3060. Both grids are 
+    accepted there, so no documented value is rejected locally; the 
+    implant decides in select_valid.
+'''
+from enum import IntFlag
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from pythonapi.channelinfo import CHANNEL_TABLE_DTYPE
+
+# One pulse (five 4-rect atoms) per record, amplitudes in uA, durations in us
+PULSE_DTYPE = np.dtype([("main_amplitude", np.float64),
+                        ("main_duration", np.int64),
+                        ("dead_zone_0", np.int64),
+                        ("counter_amplitude", np.float64),
+                        ("counter_duration", np.int64),
+                        ("dead_zone_1", np.int64)])
+
+# Rules of stimulationfunction
+MAIN_AMPLITUDE_MIN = -6120.
+MAIN_AMPLITUDE_MAX = 0.
+FINE_AMPLITUDE_MIN = -3060.
+FINE_AMPLITUDE_STEP = 12.
+COARSE_AMPLITUDE_STEP = 24.
+PULSE_DURATION_MIN = 10
+PULSE_DURATION_MAX = 2550
+PULSE_DURATION_STEP = 10
+DEAD_ZONE_1_MIN = 10
+DEAD_ZONE_1_MAX = 20400
+DEAD_ZONE_1_STEP = 80
+COUNTER_AMPLITUDE_FACTOR = -0.25
+COUNTER_DURATION_FACTOR = 4
+
+# Relative tolerance when comparing amplitudes
+_AMPLITUDE_TOLERANCE = 1e-9
+
+class Violation(IntFlag):
+    '''Bit flags telling why a candidate was rejected.
+
+        - MAIN_AMPLITUDE_RANGE:  Main amplitude outside of -6120..0 uA.
+        - MAIN_AMPLITUDE_STEP:   Main amplitude not a multiple of 12 uA
+            (>= -3060 uA) or, below -3060 uA, neither a multiple of 24 uA
+            nor -3060 uA minus a multiple of 24 uA.
+        - MAIN_DURATION:         Main duration not in 10..2550 us in 
+            steps of 10 us.
+        - DEAD_ZONE_0:           Dead zone 0 not in 10..2550 us in steps
+            of 10 us.
+        - COUNTER_AMPLITUDE:     Counter amplitude not -1/4 of the main
+            amplitude.
+        - COUNTER_DURATION:      Counter duration not 4 times the main
+            duration.
+        - DEAD_ZONE_1:           Dead zone 1 not 10 us or a multiple of
+            80 us up to 20400 us.
+        - NO_SOURCE:             No source electrode.
+        - NO_DESTINATION:        No destination electrode and no ground
+            electrode.
+        - ELECTRODE_OVERLAP:     An electrode is source and destination.
+        - UNKNOWN_ELECTRODE:     An electrode index exceeds the channels
+            of the implant.
+        - CANNOT_STIMULATE:      An electrode cannot stimulate.
+        - CHANNEL_LIMIT:         Main amplitude outside of the 
+            stimulation limits of a source electrode.
+    '''
+
+    NONE = 0
+    MAIN_AMPLITUDE_RANGE = 0x0001
+    MAIN_AMPLITUDE_STEP = 0x0002
+    MAIN_DURATION = 0x0004
+    DEAD_ZONE_0 = 0x0008
+    COUNTER_AMPLITUDE = 0x0010
+    COUNTER_DURATION = 0x0020
+    DEAD_ZONE_1 = 0x0040
+    NO_SOURCE = 0x0080
+    NO_DESTINATION = 0x0100
+    ELECTRODE_OVERLAP = 0x0200
+    UNKNOWN_ELECTRODE = 0x0400
+    CANNOT_STIMULATE = 0x0800
+    CHANNEL_LIMIT = 0x1000
+
+def make_pulses(main_amplitude, main_duration, dead_zone_0=PULSE_DURATION_MIN, dead_zone_1=DEAD_ZONE_1_MIN,
+                counter_amplitude=None, counter_duration=None) -> np.ndarray:
+    '''Create a PULSE_DTYPE array from scalars or arrays (broadcast 
+        against each other). Counter amplitude and duration are derived
+        from the main pulse if not given.
+
+       @param main_amplitude    Main amplitude in uA.
+       @param main_duration     Main duration in us.
+       @param dead_zone_0       Duration of the dead zones around the 
+            counter pulse in us.
+       @param dead_zone_1       Duration of the pause after the pulse in
+            us.
+       @param counter_amplitude Counter amplitude in uA.
+       @param counter_duration  Counter duration in us.
+    '''
+
+    main_amplitude, main_duration, dead_zone_0, dead_zone_1 = \
+        np.broadcast_arrays(np.atleast_1d(main_amplitude), main_duration, dead_zone_0, dead_zone_1)
+    if counter_amplitude is None:
+        counter_amplitude = COUNTER_AMPLITUDE_FACTOR * main_amplitude
+    if counter_duration is None:
+        counter_duration = COUNTER_DURATION_FACTOR * main_duration
+
+    pulses = np.empty(main_amplitude.shape, dtype=PULSE_DTYPE)
+    pulses["main_amplitude"] = main_amplitude
+    pulses["main_duration"] = main_duration
+    pulses["dead_zone_0"] = dead_zone_0
+    pulses["counter_amplitude"] = counter_amplitude
+    pulses["counter_duration"] = counter_duration
+    pulses["dead_zone_1"] = dead_zone_1
+    return pulses
+
+def pulse_function_spec(pulse, source: Sequence[int], destination: Sequence[int],
+                        use_ground_electrode: bool = False, repetitions: int = 1) -> dict:
+    '''Create the stimulationcompiler specification of a stimulation
+        function for one pulse.
+
+       @param pulse                A record of a PULSE_DTYPE array.
+       @param source               (Type: Sequence[int]) Source 
+            electrodes.
+       @param destination          (Type: Sequence[int]) Destination
+            electrodes.
+       @param use_ground_electrode (Type: bool) Stimulate to ground.
+       @param repetitions          (Type: int) Repetitions of the pulse.
+    '''
+
+    dead_zone_0 = int(pulse["dead_zone_0"])
+    return {"repetitions": repetitions,
+            "electrodes": [[int(channel) for channel in source], [int(channel) for channel in destination]],
+            "use_ground_electrode": use_ground_electrode,
+            "atoms": [["4rect", float(pulse["main_amplitude"]), int(pulse["main_duration"])],
+                      ["4rect", 0., dead_zone_0],
+                      ["4rect", float(pulse["counter_amplitude"]), int(pulse["counter_duration"])],
+                      ["4rect", 0., dead_zone_0],
+                      ["4rect", 0., int(pulse["dead_zone_1"])]]}
+
+def _is_multiple(values: np.ndarray, step: float) -> np.ndarray:
+    quotient = values / step
+    return np.abs(quotient - np.round(quotient)) <= _AMPLITUDE_TOLERANCE * np.maximum(np.abs(quotient), 1.)
+
+def _pulse_duration_violations(durations: np.ndarray) -> np.ndarray:
+    return (durations < PULSE_DURATION_MIN) | (durations > PULSE_DURATION_MAX) | (durations % PULSE_DURATION_STEP != 0)
+
+def check_pulse_shapes(pulses: np.ndarray) -> np.ndarray:
+    '''Check the pulse rules of stimulationfunction, independent of the
+        implant. Returns an array of Violation flags (0 if valid).
+
+       @param pulses (Type: numpy.ndarray) Array with dtype PULSE_DTYPE.
+    '''
+
+    main_amplitude = pulses["main_amplitude"]
+    main_duration = pulses["main_duration"]
+    dead_zone_1 = pulses["dead_zone_1"]
+
+    violations = np.zeros(pulses.shape, dtype=np.uint32)
+
+    def flag(mask, violation):
+        violations[mask] |= np.uint32(violation)
+
+    flag((main_amplitude < MAIN_AMPLITUDE_MIN) | (main_amplitude > MAIN_AMPLITUDE_MAX) | np.isnan(main_amplitude),
+         Violation.MAIN_AMPLITUDE_RANGE)
+    is_fine = main_amplitude >= FINE_AMPLITUDE_MIN
+    on_grid = np.where(is_fine, _is_multiple(main_amplitude, FINE_AMPLITUDE_STEP),
+                       _is_multiple(main_amplitude, COARSE_AMPLITUDE_STEP)
+                       | _is_multiple(main_amplitude - FINE_AMPLITUDE_MIN, COARSE_AMPLITUDE_STEP))
+    flag(~on_grid, Violation.MAIN_AMPLITUDE_STEP)
+    flag(_pulse_duration_violations(main_duration), Violation.MAIN_DURATION)
+    flag(_pulse_duration_violations(pulses["dead_zone_0"]), Violation.DEAD_ZONE_0)
+
+    expected_counter = COUNTER_AMPLITUDE_FACTOR * main_amplitude
+    flag(~np.isclose(pulses["counter_amplitude"], expected_counter, rtol=_AMPLITUDE_TOLERANCE, atol=1e-6),
+         Violation.COUNTER_AMPLITUDE)
+    flag(pulses["counter_duration"] != COUNTER_DURATION_FACTOR * main_duration, Violation.COUNTER_DURATION)
+
+    # Steps start from 0 while the minimum is 10: [10, 80, 160, ..., 20400]
+    flag((dead_zone_1 != DEAD_ZONE_1_MIN) & ((dead_zone_1 < DEAD_ZONE_1_STEP) | (dead_zone_1 > DEAD_ZONE_1_MAX)
+                                             | (dead_zone_1 % DEAD_ZONE_1_STEP != 0)),
+         Violation.DEAD_ZONE_1)
+    return violations
+
+def _electrode_masks(electrodes, num_candidates: int, num_channels: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Convert electrodes to a boolean array (num_candidates, 
+        num_channels). Returns the mask and a boolean array telling
+        which candidates use unknown electrodes.
+
+        electrodes is a boolean mask (one row or one per candidate), a 
+        list of indices used by all candidates or a list with one list
+        of indices per candidate.
+    '''
+
+    if isinstance(electrodes, np.ndarray) and electrodes.dtype == np.bool_:
+        if electrodes.shape[-1] > num_channels:
+            unknown = np.any(electrodes[..., num_channels:], axis=-1)
+            electrodes = electrodes[..., :num_channels]
+        else:
+            unknown = np.zeros(electrodes.shape[:-1], dtype=bool)
+            electrodes = np.pad(electrodes, [(0, 0)] * (electrodes.ndim - 1) + [(0, num_channels - electrodes.shape[-1])])
+        return np.broadcast_to(electrodes, (num_candidates, num_channels)), \
+            np.broadcast_to(unknown, (num_candidates,))
+
+    electrodes = list(electrodes)
+    if len(electrodes) == 0 or np.ndim(electrodes[0]) == 0:
+        electrodes = [electrodes]
+    elif len(electrodes) != num_candidates:
+        raise ValueError("One set of electrodes per candidate or one set for all candidates is required.")
+
+    masks = np.zeros((len(electrodes), num_channels), dtype=bool)
+    unknown = np.zeros(len(electrodes), dtype=bool)
+    for row, channels in enumerate(electrodes):
+        channels = np.asarray(channels, dtype=np.int64)
+        known = (channels >= 0) & (channels < num_channels)
+        unknown[row] = not np.all(known)
+        masks[row, channels[known]] = True
+    return np.broadcast_to(masks, (num_candidates, num_channels)), np.broadcast_to(unknown, (num_candidates,))
+
+class StimulationValidator():
+    '''Checks batches of candidate pulses without calling the C api.
+
+        The validator only implements the documented rules. It rejects
+        no valid pulse that follows them, but the implant may reject 
+        candidates that passed, so the result has to be confirmed with
+        Implant.is_stimulation_command_valid (see select_valid).
+    '''
+
+    def __init__(self, channel_table: np.ndarray):
+        '''@param channel_table (Type: numpy.ndarray) Channel table of the
+                implant (ImplantInfo.channel_table).
+        '''
+
+        if channel_table.dtype != CHANNEL_TABLE_DTYPE:
+            raise ValueError("channel_table must have the dtype CHANNEL_TABLE_DTYPE.")
+
+        self._can_stimulate = np.asarray(channel_table["can_stimulate"], dtype=bool)
+        # Non-stimulating channels get an empty range, they are reported as CANNOT_STIMULATE
+        self._value_min = np.where(self._can_stimulate, channel_table["stimulation_value_min"], np.inf)
+        self._value_max = np.where(self._can_stimulate, channel_table["stimulation_value_max"], -np.inf)
+
+        self.checked = 0
+        self.rejected_locally = 0
+        self.confirmed = 0
+        self.rejected_by_implant = 0
+
+    @classmethod
+    def from_implant_info(cls, implant_info):
+        '''Create a validator for an implant.
+
+           @param implant_info (Type: ImplantInfo) Information of the 
+                implant.
+        '''
+        return cls(implant_info.channel_table)
+
+    @property
+    def num_channels(self) -> int:
+        '''Number of channels of the implant.'''
+        return len(self._can_stimulate)
+
+    def check(self, pulses: np.ndarray, source, destination, use_ground_electrode: bool = False) -> np.ndarray:
+        '''Check a batch of candidates. Returns an array of Violation 
+            flags with one entry per pulse (0 if the pulse passed).
+
+           @param pulses               (Type: numpy.ndarray) Array with 
+                dtype PULSE_DTYPE.
+           @param source               Source electrodes, either one 
+                list of channel indices for all pulses, one list per 
+                pulse, or a boolean array of shape (num_channels,) or 
+                (num_pulses, num_channels).
+           @param destination          Destination electrodes in the 
+                same forms as source.
+           @param use_ground_electrode (Type: bool) Stimulate to ground,
+                which allows an empty destination.
+        '''
+
+        pulses = np.atleast_1d(pulses)
+        num_candidates = len(pulses)
+        num_channels = self.num_channels
+
+        violations = check_pulse_shapes(pulses)
+
+        def flag(mask, violation):
+            violations[mask] |= np.uint32(violation)
+
+        source, unknown_source = _electrode_masks(source, num_candidates, num_channels)
+        destination, unknown_destination = _electrode_masks(destination, num_candidates, num_channels)
+
+        flag(~np.any(source, axis=1) & ~unknown_source, Violation.NO_SOURCE)
+        if not use_ground_electrode:
+            flag(~np.any(destination, axis=1) & ~unknown_destination, Violation.NO_DESTINATION)
+        flag(np.any(source & destination, axis=1), Violation.ELECTRODE_OVERLAP)
+        flag(unknown_source | unknown_destination, Violation.UNKNOWN_ELECTRODE)
+        flag(np.any((source | destination) & ~self._can_stimulate, axis=1), Violation.CANNOT_STIMULATE)
+
+        # The main amplitude must lie within the limits of all source channels
+        lower = np.max(np.where(source, self._value_min, -np.inf), axis=1)
+        upper = np.min(np.where(source, self._value_max, np.inf), axis=1)
+        main_amplitude = pulses["main_amplitude"]
+        flag((main_amplitude < lower) | (main_amplitude > upper), Violation.CHANNEL_LIMIT)
+
+        self.checked += num_candidates
+        self.rejected_locally += int(np.count_nonzero(violations))
+        return violations
+
+    def select_valid(self, implant, pulses: np.ndarray, source, destination, use_ground_electrode: bool = False,
+                     compiler=None) -> np.ndarray:
+        '''Check a batch of candidates locally and confirm the remaining
+            ones with Implant.is_stimulation_command_valid. Returns a 
+            boolean array telling which pulses are valid.
+
+           @param implant  (Type: Implant) The implant confirming the 
+                candidates.
+           @param compiler (Type: StimulationCompiler) Compiler building
+                the commands of the confirmed candidates. A new one is 
+                created if not given.
+
+            The other parameters are those of check.
+        '''
+
+        from pythonapi.stimulationcompiler import StimulationCompiler
+
+        if compiler is None:
+            compiler = StimulationCompiler()
+
+        pulses = np.atleast_1d(pulses)
+        valid = self.check(pulses, source, destination, use_ground_electrode) == 0
+        source_lists = _electrode_lists(source, len(pulses))
+        destination_lists = _electrode_lists(destination, len(pulses))
+
+        for index in np.flatnonzero(valid):
+            spec = {"functions": [pulse_function_spec(pulses[index], source_lists[index], destination_lists[index],
+                                                      use_ground_electrode)]}
+            is_valid, _ = implant.is_stimulation_command_valid(compiler.compile(spec))
+            self.confirmed += 1
+            if not is_valid:
+                valid[index] = False
+                self.rejected_by_implant += 1
+        return valid
+
+    @property
+    def statistics(self) -> Dict[str, int]:
+        '''Counters of the validator.
+
+            - checked:             Candidates checked locally.
+            - rejected_locally:    Candidates rejected by the local check.
+            - confirmed:           Candidates passed to the implant.
+            - rejected_by_implant: Candidates the implant rejected 
+                although they passed the local check.
+        '''
+
+        return {"checked": self.checked,
+                "rejected_locally": self.rejected_locally,
+                "confirmed": self.confirmed,
+                "rejected_by_implant": self.rejected_by_implant}
+
+def _electrode_lists(electrodes, num_candidates: int) -> List[List[int]]:
+    '''Convert electrodes given in any form accepted by 
+        StimulationValidator.check to one list of indices per candidate.
+    '''
+
+    if isinstance(electrodes, np.ndarray) and electrodes.dtype == np.bool_:
+        electrodes = np.broadcast_to(electrodes, (num_candidates, electrodes.shape[-1]))
+        return [np.flatnonzero(row).tolist() for row in electrodes]
+
+    electrodes = list(electrodes)
+    if len(electrodes) == 0 or np.ndim(electrodes[0]) == 0:
+        return [electrodes] * num_candidates
+    return [list(channels) for channels in electrodes]
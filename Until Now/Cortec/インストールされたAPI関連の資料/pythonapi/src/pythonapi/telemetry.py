@@ -0,0 +1,213 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring telemetry
+
+    Store of the telemetry values reported by the listener callbacks.
+
+    Implant.temperature and Implant.humidity are blocking calls that 
+    stop running measurements. The same values (and the implant 
+    voltage, primary coil current and control value) are reported 
+    through the listener callbacks without interrupting the acquisition.
+    The listener of an implant records them in a TelemetryStore 
+    (Implant.telemetry), from which monitoring code can read the latest
+    values and their (downsampled) history at any time.
+
+    Timestamps are time.perf_counter() values of the callback, like 
+    SampleBlock.host_timestamp.
+'''
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Names of the recorded quantities, in the order of the listener callbacks
+TELEMETRY_NAMES = ('implant_voltage_V', 'primary_coil_current_mA', 'implant_control_value', 'temperature',
+                   'humidity')
+
+TELEMETRY_DTYPE = np.dtype([("timestamp", np.float64), ("value", np.float64)])
+
+TELEMETRY_HISTORY_DTYPE = np.dtype([("timestamp", np.float64),
+                                    ("mean", np.float64),
+                                    ("min", np.float64),
+                                    ("max", np.float64),
+                                    ("count", np.uint32)])
+
+class _TelemetrySeries():
+    '''Ring buffer of the most recent values of one quantity.'''
+
+    __slots__ = ('_records', '_num_written', '_lock')
+
+    def __init__(self, capacity: int):
+        self._records = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        self._num_written = 0
+        self._lock = Lock()
+
+    def record(self, timestamp: float, value: float):
+        with self._lock:
+            self._records[self._num_written % len(self._records)] = (timestamp, value)
+            self._num_written += 1
+
+    def latest(self):
+        with self._lock:
+            if self._num_written == 0:
+                return None
+            timestamp, value = self._records[(self._num_written - 1) % len(self._records)]
+        return float(timestamp), float(value)
+
+    def records(self) -> np.ndarray:
+        '''Copy of the buffered records in temporal order.'''
+
+        with self._lock:
+            capacity = len(self._records)
+            if self._num_written <= capacity:
+                return self._records[:self._num_written].copy()
+            start = self._num_written % capacity
+            return np.concatenate([self._records[start:], self._records[:start]])
+
+    def __len__(self):
+        return min(self._num_written, len(self._records))
+
+class TelemetryStore():
+    '''Timestamped telemetry values by name (see TELEMETRY_NAMES).
+
+        Each quantity keeps its capacity most recent values. Recording 
+        is a few operations, so it can be done on the callback thread.
+    '''
+
+    def __init__(self, capacity: int = 4096):
+        '''@param capacity (Type: int) Number of values kept per 
+                quantity.
+        '''
+
+        self._series = {name: _TelemetrySeries(capacity) for name in TELEMETRY_NAMES}
+
+    def _get_series(self, name: str) -> _TelemetrySeries:
+        try:
+            return self._series[name]
+        except KeyError:
+            raise ValueError(f"Unknown telemetry quantity '{name}'.") from None
+
+    def record(self, name: str, value: float, timestamp: float = None):
+        '''Add a value.
+
+           @param name      (Type: str)   Name of the quantity.
+           @param value     (Type: float) The value.
+           @param timestamp (Type: float) perf_counter() time of the 
+                value, now if not given.
+        '''
+
+        self._get_series(name).record(perf_counter() if timestamp is None else timestamp, value)
+
+    def latest(self, name: str) -> Tuple[float, float]:
+        '''Get (timestamp, value) of the most recent value or None.
+
+           @param name (Type: str) Name of the quantity.
+        '''
+        return self._get_series(name).latest()
+
+    def latest_value(self, name: str, max_age_s: float = None) -> float:
+        '''Get the most recent value or None if there is none (younger 
+            than max_age_s).
+
+           @param name      (Type: str)   Name of the quantity.
+           @param max_age_s (Type: float) Maximum age of the value.
+        '''
+
+        latest = self.latest(name)
+        if latest is None or (max_age_s is not None and perf_counter() - latest[0] > max_age_s):
+            return None
+        return latest[1]
+
+    @property
+    def snapshot(self) -> Dict[str, float]:
+        '''Most recent value of each quantity (None if not reported).'''
+        return {name: self.latest_value(name) for name in TELEMETRY_NAMES}
+
+    @property
+    def temperature(self) -> float:
+        '''Most recent temperature or None.'''
+        return self.latest_value('temperature')
+
+    @property
+    def humidity(self) -> float:
+        '''Most recent humidity or None.'''
+        return self.latest_value('humidity')
+
+    @property
+    def implant_voltage_V(self) -> float:
+        '''Most recent implant voltage in V or None.'''
+        return self.latest_value('implant_voltage_V')
+
+    @property
+    def primary_coil_current_mA(self) -> float:
+        '''Most recent primary coil current in mA or None.'''
+        return self.latest_value('primary_coil_current_mA')
+
+    @property
+    def implant_control_value(self) -> float:
+        '''Most recent implant control value or None.'''
+        return self.latest_value('implant_control_value')
+
+    def records(self, name: str, since: float = None) -> np.ndarray:
+        '''Get the buffered values (dtype TELEMETRY_DTYPE) in temporal 
+            order.
+
+           @param name  (Type: str)   Name of the quantity.
+           @param since (Type: float) Only values with a timestamp at or
+                after this perf_counter() time.
+        '''
+
+        records = self._get_series(name).records()
+        if since is not None:
+            records = records[np.searchsorted(records["timestamp"], since, 'left'):]
+        return records
+
+    def history(self, name: str, bucket_s: float, since: float = None) -> np.ndarray:
+        '''Get the values downsampled into buckets of bucket_s seconds
+            (dtype TELEMETRY_HISTORY_DTYPE, one row per non-empty 
+            bucket, timestamp is the start of the bucket).
+
+           @param name     (Type: str)   Name of the quantity.
+           @param bucket_s (Type: float) Length of the buckets in s.
+           @param since    (Type: float) Only values with a timestamp at
+                or after this perf_counter() time.
+        '''
+
+        if bucket_s <= 0:
+            raise ValueError("bucket_s must be positive.")
+
+        records = self.records(name, since)
+        if len(records) == 0:
+            return np.zeros(0, dtype=TELEMETRY_HISTORY_DTYPE)
+
+        timestamps = records["timestamp"]
+        values = records["value"]
+        origin = timestamps[0] if since is None else since
+        buckets = np.floor((timestamps - origin) / bucket_s).astype(np.int64)
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        counts = np.diff(np.append(starts, len(records)))
+
+        history = np.zeros(len(starts), dtype=TELEMETRY_HISTORY_DTYPE)
+        history["timestamp"] = origin + buckets[starts] * bucket_s
+        history["mean"] = np.add.reduceat(values, starts) / counts
+        history["min"] = np.minimum.reduceat(values, starts)
+        history["max"] = np.maximum.reduceat(values, starts)
+        history["count"] = counts
+        return history
+
+    def __len__(self):
+        return sum(len(series) for series in self._series.values())
@@ -0,0 +1,366 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring triggeredaverage
+
+    Online stimulus-triggered averaging of the measurement data.
+
+    The TriggeredAverager keeps the most recent samples in a ring 
+    buffer. Each sample with a stimulation id (the onset of a 
+    stimulation) triggers the extraction of a window of pre_samples 
+    before and post_samples from the onset on, as soon as the window is
+    complete. Mean and variance of each lag and channel are updated with
+    all windows completed by a block at once (parallel Welford update),
+    so no recording has to be read again to get the average.
+
+    Typical usage:
+    1. Create the averager: averager = TriggeredAverager(num_channels,
+        pre_samples=50, post_samples=200, on_update=plot)
+    2. Register a listener feeding it: implant.register_listener(
+        TriggeredAveragingListener(averager), block_size=64)
+    3. Start measurement and stimulations, plot is called with a 
+        TriggeredAverage whenever windows were added.
+
+    Wrap the TriggeredAveragingListener in a DispatchingListener to 
+    keep the averaging off the callback thread of the C api.
+'''
+from threading import Lock
+from typing import Callable, Dict, Sequence
+
+import numpy as np
+
+from pythonapi.implantlistener import ImplantListener, ConnectionType, ConnectionState, Sample
+from pythonapi.sampleblock import SampleBlock, SAMPLE_NO_STIMULATION
+from pythonapi.gapdetection import COUNTER_MODULO
+
+class TriggeredAverage():
+    '''Snapshot of the stimulus-triggered average.
+
+        - lags:     Offset of each row to the onset in samples 
+            (-pre_samples .. post_samples - 1).
+        - mean:     2-D array (num_lags, num_channels).
+        - variance: 2-D array (num_lags, num_channels), unbiased sample
+            variance (NaN for less than two windows).
+        - count:    Number of averaged windows.
+        - channels: Channel index of each column.
+    '''
+
+    __slots__ = ('lags', 'mean', 'variance', 'count', 'channels')
+
+    def __init__(self, lags: np.ndarray, mean: np.ndarray, variance: np.ndarray, count: int, channels: np.ndarray):
+        self.lags = lags
+        self.mean = mean
+        self.variance = variance
+        self.count = count
+        self.channels = channels
+
+    @property
+    def standard_error(self) -> np.ndarray:
+        '''Standard error of the mean of each lag and channel.'''
+        return np.sqrt(self.variance / self.count) if self.count > 0 else np.full_like(self.mean, np.nan)
+
+class TriggeredAverager():
+    '''Running stimulus-triggered average over a stream of samples.
+
+        Windows spanning lost samples are discarded: windows containing
+        placeholders (SampleBlock.FLAG_IS_GAP_FILL) or a discontinuity
+        of the measurement counter, provided the counters or flags are
+        passed to add. Windows containing non-finite values and windows
+        whose pre-onset part was not received are discarded as well. 
+        All discarded windows are counted in statistics.
+    '''
+
+    def __init__(self, num_channels: int, pre_samples: int, post_samples: int, channels: Sequence[int] = None,
+                 on_update: Callable[[TriggeredAverage], None] = None):
+        '''@param num_channels (Type: int) Number of measurements per 
+                sample.
+           @param pre_samples  (Type: int) Number of samples before the
+                onset in each window.
+           @param post_samples (Type: int) Number of samples from the 
+                onset on in each window (at least 1).
+           @param channels     (Type: Sequence[int]) Channels to 
+                average. All channels if not given.
+           @param on_update    (Type: Callable) Called with a 
+                TriggeredAverage after windows were added.
+        '''
+
+        if pre_samples < 0 or post_samples < 1:
+            raise ValueError("pre_samples must not be negative and post_samples must be at least 1.")
+
+        self._num_channels = num_channels
+        self._channels = np.arange(num_channels) if channels is None else np.asarray(channels, dtype=np.int64)
+        self._pre_samples = pre_samples
+        self._post_samples = post_samples
+        self._window_length = pre_samples + post_samples
+        self.on_update = on_update
+
+        # Ring buffer holding at least two windows, a power of two for cheap index arithmetic
+        self._capacity = 1 << max(2 * self._window_length - 1, 1).bit_length()
+        self._ring = np.zeros((self._capacity, len(self._channels)))
+        # Placeholder samples and samples not continuing their predecessor
+        self._is_gap_fill = np.zeros(self._capacity, dtype=bool)
+        self._follows_gap = np.zeros(self._capacity, dtype=bool)
+        self._window_offsets = np.arange(-pre_samples, post_samples)
+
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        '''Discard the buffered samples, pending onsets and averages.'''
+
+        with self._lock:
+            self._num_written = 0
+            self._last_counter = None
+            self._pending = np.empty(0, dtype=np.int64)
+            self._count = 0
+            self._mean = np.zeros((self._window_length, len(self._channels)))
+            self._m2 = np.zeros((self._window_length, len(self._channels)))
+
+            self.num_onsets = 0
+            self.discarded_incomplete = 0
+            self.discarded_gaps = 0
+            self.discarded_non_finite = 0
+
+    def restart(self):
+        '''Discard the buffered samples and pending onsets but keep the
+            averages, e.g. when a new measurement is started.
+        '''
+
+        with self._lock:
+            self.discarded_incomplete += len(self._pending)
+            self._num_written = 0
+            self._last_counter = None
+            self._pending = np.empty(0, dtype=np.int64)
+
+    def add_block(self, block: SampleBlock):
+        '''Process the samples of a block.
+
+           @param block (Type: SampleBlock) Consecutive samples.
+        '''
+
+        self.add(block.measurements, block.stimulation_id, block.measurement_counter, block.flags)
+
+    def add_sample(self, sample: Sample):
+        '''Process a single sample.
+
+           @param sample (Type: Sample) The sample.
+        '''
+
+        self.add(np.asarray(sample.measurements).reshape(1, -1), np.array([sample.stimulation_id]),
+                 np.array([sample.measurement_counter], dtype=np.uint32))
+
+    def add(self, measurements: np.ndarray, stimulation_id: np.ndarray, measurement_counter: np.ndarray = None,
+            flags: np.ndarray = None):
+        '''Process consecutive samples.
+
+            Without measurement_counter and flags the samples are 
+            assumed to be continuous.
+
+           @param measurements        (Type: numpy.ndarray) 2-D array 
+                (num_samples, num_channels).
+           @param stimulation_id      (Type: numpy.ndarray) Stimulation
+                id of each sample.
+           @param measurement_counter (Type: numpy.ndarray) Counter of
+                each sample (optional).
+           @param flags               (Type: numpy.ndarray) 
+                SampleBlock.flags of each sample (optional).
+        '''
+
+        num_samples = len(measurements)
+        is_gap_fill = np.zeros(num_samples, dtype=bool) if flags is None \
+            else (flags & SampleBlock.FLAG_IS_GAP_FILL) != 0
+
+        # Chunks are small enough that no pending window is overwritten before it is complete
+        chunk = self._capacity - self._window_length
+        updated = False
+        with self._lock:
+            follows_gap = np.zeros(num_samples, dtype=bool)
+            if measurement_counter is not None and num_samples > 0:
+                counters = measurement_counter.astype(np.int64)
+                previous = self._last_counter if self._last_counter is not None else counters[0] - 1
+                follows_gap = (np.diff(counters, prepend=previous) % COUNTER_MODULO) != 1
+                self._last_counter = int(counters[-1])
+            if flags is not None:
+                follows_gap |= (flags & SampleBlock.FLAG_IS_DISCONTINUITY) != 0
+
+            for start in range(0, num_samples, chunk):
+                stop = start + chunk
+                updated |= self._add_chunk(measurements[start:stop], stimulation_id[start:stop],
+                                           is_gap_fill[start:stop], follows_gap[start:stop])
+            result = self._snapshot() if updated and self.on_update is not None else None
+
+        if result is not None:
+            self.on_update(result)
+
+    def _add_chunk(self, measurements: np.ndarray, stimulation_id: np.ndarray, is_gap_fill: np.ndarray,
+                   follows_gap: np.ndarray) -> bool:
+        '''Write samples to the ring buffer and average the completed 
+            windows. Requires the lock. Returns True if windows were 
+            added.
+        '''
+
+        num_samples = len(measurements)
+        first = self._num_written
+        positions = (first + np.arange(num_samples)) & (self._capacity - 1)
+        self._ring[positions] = measurements[:, self._channels]
+        self._is_gap_fill[positions] = is_gap_fill
+        self._follows_gap[positions] = follows_gap
+        self._num_written = first + num_samples
+
+        onsets = first + np.flatnonzero(stimulation_id != SAMPLE_NO_STIMULATION)
+        if len(onsets) > 0:
+            self.num_onsets += len(onsets)
+            incomplete = onsets < self._pre_samples
+            self.discarded_incomplete += int(np.count_nonzero(incomplete))
+            self._pending = np.concatenate([self._pending, onsets[~incomplete]])
+
+        num_complete = np.searchsorted(self._pending, self._num_written - self._post_samples, 'right')
+        if num_complete == 0:
+            return False
+
+        complete = self._pending[:num_complete]
+        self._pending = self._pending[num_complete:]
+
+        indices = (complete[:, np.newaxis] + self._window_offsets) & (self._capacity - 1)
+        # The first sample of a window may follow a gap, the others not
+        continuous = ~np.any(self._is_gap_fill[indices], axis=1) & ~np.any(self._follows_gap[indices[:, 1:]], axis=1)
+        self.discarded_gaps += int(np.count_nonzero(~continuous))
+        indices = indices[continuous]
+
+        windows = self._ring[indices]
+        finite = np.all(np.isfinite(windows), axis=(1, 2))
+        self.discarded_non_finite += int(np.count_nonzero(~finite))
+        windows = windows[finite]
+        if len(windows) == 0:
+            return False
+
+        # Chan et al. combination of the running and the batch statistics
+        batch_count = len(windows)
+        batch_mean = windows.mean(axis=0)
+        batch_m2 = ((windows - batch_mean) ** 2).sum(axis=0)
+        total = self._count + batch_count
+        delta = batch_mean - self._mean
+        self._mean += delta * (batch_count / total)
+        self._m2 += batch_m2 + delta ** 2 * (self._count * batch_count / total)
+        self._count = total
+        return True
+
+    def _snapshot(self) -> TriggeredAverage:
+        '''Copy of the current average. Requires the lock.'''
+
+        variance = self._m2 / (self._count - 1) if self._count > 1 else np.full_like(self._m2, np.nan)
+        return TriggeredAverage(self._window_offsets.copy(), self._mean.copy(), variance, self._count,
+                                self._channels.copy())
+
+    @property
+    def result(self) -> TriggeredAverage:
+        '''The current average.'''
+
+        with self._lock:
+            return self._snapshot()
+
+    @property
+    def statistics(self) -> Dict[str, int]:
+        '''Counters of the averager.
+
+            - onsets:               Onsets found in the samples.
+            - averaged:             Windows in the average.
+            - pending:              Onsets waiting for their window to 
+                be complete.
+            - discarded_incomplete: Onsets without enough samples before
+                them.
+            - discarded_gaps:       Windows spanning lost samples.
+            - discarded_non_finite: Windows containing NaN or infinity.
+        '''
+
+        with self._lock:
+            return {"onsets": self.num_onsets,
+                    "averaged": self._count,
+                    "pending": len(self._pending),
+                    "discarded_incomplete": self.discarded_incomplete,
+                    "discarded_gaps": self.discarded_gaps,
+                    "discarded_non_finite": self.discarded_non_finite}
+
+class TriggeredAveragingListener(ImplantListener):
+    '''ImplantListener passing the measurement data to a 
+        TriggeredAverager. All events are additionally forwarded to the
+        wrapped listener, if one is given. The buffered samples of the 
+        averager are discarded when a measurement is started.
+    '''
+
+    def __init__(self, averager: TriggeredAverager, listener: ImplantListener = None):
+        '''@param averager (Type: TriggeredAverager) The averager.
+           @param listener (Type: ImplantListener) Listener receiving all
+                events (optional).
+        '''
+
+        self.averager = averager
+        self._listener = listener
+
+    def on_stimulation_state_changed(self, is_stimulating: bool):
+        if self._listener is not None:
+            self._listener.on_stimulation_state_changed(is_stimulating)
+
+    def on_measurement_state_changed(self, is_measuring: bool):
+        if is_measuring:
+            self.averager.restart()
+        if self._listener is not None:
+            self._listener.on_measurement_state_changed(is_measuring)
+
+    def on_connection_state_changed(self, connection_type: ConnectionType, connection_state: ConnectionState):
+        if self._listener is not None:
+            self._listener.on_connection_state_changed(connection_type, connection_state)
+
+    def on_data(self, sample: Sample):
+        self.averager.add_sample(sample)
+        if self._listener is not None:
+            self._listener.on_data(sample)
+
+    def on_data_block(self, block: SampleBlock):
+        self.averager.add_block(block)
+        if self._listener is not None:
+            self._listener.on_data_block(block)
+
+    def on_implant_voltage_changed(self, voltage_V: float):
+        if self._listener is not None:
+            self._listener.on_implant_voltage_changed(voltage_V)
+
+    def on_primary_coil_current_changed(self, current_mA: float):
+        if self._listener is not None:
+            self._listener.on_primary_coil_current_changed(current_mA)
+
+    def on_implant_control_value_changed(self, control_value: float):
+        if self._listener is not None:
+            self._listener.on_implant_control_value_changed(control_value)
+
+    def on_temperature_changed(self, temperature: float):
+        if self._listener is not None:
+            self._listener.on_temperature_changed(temperature)
+
+    def on_humidity_changed(self, humidity: float):
+        if self._listener is not None:
+            self._listener.on_humidity_changed(humidity)
+
+    def on_error(self, error_description: str):
+        if self._listener is not None:
+            self._listener.on_error(error_description)
+
+    def on_data_processing_too_slow(self):
+        if self._listener is not None:
+            self._listener.on_data_processing_too_slow()
+
+    def on_stimulation_function_finished(self, num_executed_functions: int):
+        if self._listener is not None:
+            self._listener.on_stimulation_function_finished(num_executed_functions)
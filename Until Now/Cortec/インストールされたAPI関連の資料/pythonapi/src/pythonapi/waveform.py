@@ -0,0 +1,226 @@
+#######################################################################
+# Copyright 2015-2019, CorTec GmbH
+# All rights reserved.
+#
+# Redistribution, modification, adaptation or translation is not permitted.
+#
+# CorTec shall be liable a) for any damage caused by a willful, fraudulent or grossly 
+# negligent act, or resulting in injury to life, body or health, or covered by the 
+# Product Liability Act, b) for any reasonably foreseeable damage resulting from 
+# its breach of a fundamental contractual obligation up to the amount of the 
+# licensing fees agreed under this Agreement. 
+# All other claims shall be excluded. 
+# CorTec excludes any liability for any damage caused by Licensee's 
+# use of the Software for regular medical treatment of patients.
+#######################################################################
+'''@doctring waveform
+
+    Rendering of stimulation commands into sampled current waveforms 
+    and their charge metrics.
+
+    The waveform is computed from the atoms of the command (see 
+    StimulationCommand.to_arrays) with all function and command 
+    repetitions expanded, without iterating the command in the C api.
+    Each sample holds the mean current of one interval of resolution_us
+    (so the sum of a column times resolution_us equals the delivered 
+    charge exactly), with one column per electrode used by the command.
+
+    Current model: the first amplitude of an atom is the current of its
+    function. It is divided equally among the source electrodes and 
+    flows back (negated) through the destination electrodes. Current 
+    returning through the ground electrode is not rendered. The meaning
+    of the other amplitudes of 4-rect atoms depends on the implant,
+    they are ignored.
+
+    Results are cached per AtomArrays object, so rendering the same 
+    unchanged command again is free.
+'''
+from typing import Dict, Tuple
+from weakref import WeakKeyDictionary
+from threading import Lock
+
+import numpy as np
+
+from pythonapi.atomarrays import AtomArrays
+
+# Default limit of the number of samples of a waveform
+MAX_SAMPLES = 10_000_000
+
+_cache = WeakKeyDictionary()
+_cache_lock = Lock()
+
+class StimulationWaveform():
+    '''Sampled current waveform of a stimulation command.
+
+        - current:       2-D float64 array of shape (num_samples, 
+            num_electrodes) with the mean current in uA of each 
+            interval.
+        - electrodes:    Channel index of each column.
+        - resolution_us: Length of the intervals in us.
+        - metrics:       Charge metrics of the command (see 
+            charge_metrics).
+
+        The arrays are read-only, since they are cached.
+    '''
+
+    __slots__ = ('current', 'electrodes', 'resolution_us', 'metrics')
+
+    def __init__(self, current: np.ndarray, electrodes: Tuple[int, ...], resolution_us: float, metrics: dict):
+        self.current = current
+        self.electrodes = electrodes
+        self.resolution_us = resolution_us
+        self.metrics = metrics
+
+    def __len__(self):
+        return self.current.shape[0]
+
+    @property
+    def time_us(self) -> np.ndarray:
+        '''Start time of each interval in us.'''
+        return np.arange(self.current.shape[0]) * self.resolution_us
+
+    def electrode(self, channel: int) -> np.ndarray:
+        '''Get the current of one electrode.
+
+           @param channel (Type: int) Channel index of the electrode.
+        '''
+        return self.current[:, self.electrodes.index(channel)]
+
+def _arrays_of(command) -> AtomArrays:
+    return command if isinstance(command, AtomArrays) else command.to_arrays()
+
+def _cache_entry(arrays: AtomArrays) -> dict:
+    with _cache_lock:
+        entry = _cache.get(arrays)
+        if entry is None:
+            entry = {}
+            _cache[arrays] = entry
+        return entry
+
+def _expanded_atoms(arrays: AtomArrays) -> np.ndarray:
+    '''Atom indices in the order of execution with all repetitions.'''
+
+    starts = np.searchsorted(arrays.function_index, np.arange(arrays.num_functions))
+    ends = np.append(starts[1:], arrays.num_atoms)
+    period = np.concatenate([np.tile(np.arange(start, end), int(repetitions))
+                             for start, end, repetitions in zip(starts, ends, arrays.function_repetitions)]) \
+        if arrays.num_functions > 0 else np.empty(0, dtype=np.int64)
+    return np.tile(period, arrays.command_repetitions)
+
+def _electrode_weights(arrays: AtomArrays) -> Tuple[Tuple[int, ...], np.ndarray]:
+    '''Electrodes used by the command and the share of the function 
+        current of each electrode (num_functions, num_electrodes).
+    '''
+
+    electrodes = tuple(sorted({channel for source, destination, _ in arrays.function_electrodes
+                               for channel in source + destination}))
+    column = {channel: index for index, channel in enumerate(electrodes)}
+
+    weights = np.zeros((arrays.num_functions, len(electrodes)))
+    for function, (source, destination, _) in enumerate(arrays.function_electrodes):
+        for channel in source:
+            weights[function, column[channel]] += 1. / len(source)
+        for channel in destination:
+            weights[function, column[channel]] -= 1. / len(destination)
+    return electrodes, weights
+
+def charge_metrics(command) -> Dict:
+    '''Compute the charge metrics of a command. Charges are given in 
+        pC (uA * us) and refer to the first amplitude of the atoms.
+
+        - phase_charge_pC:         Charge of each phase, i.e. of each 
+            run of consecutive atoms with equal sign of the current, in
+            one period of its function.
+        - phase_function:          Function index of each phase.
+        - net_charge_per_period_pC: Net charge of one period of each 
+            function.
+        - net_charge_pC:           Net charge of the whole command.
+        - total_charge_pC:         Sum of the absolute charges of the 
+            whole command.
+        - peak_amplitude_uA:       Largest absolute amplitude.
+        - duration_us:             Duration of the command.
+        - is_charge_balanced:      True if the net charge of each 
+            function period is zero.
+
+       @param command (Type: StimulationCommand, StimulationFunction or
+            AtomArrays) The command.
+    '''
+
+    arrays = _arrays_of(command)
+    entry = _cache_entry(arrays)
+    metrics = entry.get("metrics")
+    if metrics is not None:
+        return metrics
+
+    amplitude = arrays.amplitudes[:, 0]
+    charge = amplitude * arrays.duration
+    sign = np.sign(amplitude)
+
+    # A phase starts at each non-zero atom whose sign or function differs from its predecessor
+    previous_sign = np.concatenate([[0.], sign[:-1]])
+    previous_function = np.concatenate([[-1], arrays.function_index[:-1].astype(np.int64)])
+    starts = np.flatnonzero((sign != 0) & ((sign != previous_sign) | (arrays.function_index != previous_function)))
+    phase_charge = np.add.reduceat(np.where(sign != 0, charge, 0.), starts) if len(starts) > 0 else np.empty(0)
+
+    net_per_period = np.bincount(arrays.function_index, weights=charge, minlength=arrays.num_functions)
+    absolute_per_period = np.bincount(arrays.function_index, weights=np.abs(charge), minlength=arrays.num_functions)
+    repetitions = arrays.function_repetitions.astype(np.float64) * arrays.command_repetitions
+    total_charge = float(np.sum(absolute_per_period * repetitions))
+
+    metrics = {"phase_charge_pC": phase_charge,
+               "phase_function": arrays.function_index[starts],
+               "net_charge_per_period_pC": net_per_period,
+               "net_charge_pC": float(np.sum(net_per_period * repetitions)),
+               "total_charge_pC": total_charge,
+               "peak_amplitude_uA": float(np.max(np.abs(amplitude))) if arrays.num_atoms > 0 else 0.,
+               "duration_us": arrays.duration_total,
+               "is_charge_balanced": bool(np.all(np.abs(net_per_period) <= 1e-9 * max(total_charge, 1.)))}
+    for value in metrics.values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    entry["metrics"] = metrics
+    return metrics
+
+def render_waveform(command, resolution_us: float = 10., max_samples: int = MAX_SAMPLES) -> StimulationWaveform:
+    '''Render the current waveform of a command.
+
+       @param command       (Type: StimulationCommand, 
+            StimulationFunction or AtomArrays) The command.
+       @param resolution_us (Type: float) Length of one sample in us.
+       @param max_samples   (Type: int) Maximum number of samples, a 
+            ValueError is raised for longer waveforms.
+    '''
+
+    if resolution_us <= 0:
+        raise ValueError("resolution_us must be positive.")
+
+    arrays = _arrays_of(command)
+    entry = _cache_entry(arrays)
+    key = ("waveform", float(resolution_us))
+    waveform = entry.get(key)
+    if waveform is not None:
+        return waveform
+
+    duration = arrays.duration_total
+    num_samples = int(np.ceil(duration / resolution_us))
+    if num_samples > max_samples:
+        raise ValueError(f"The waveform would have {num_samples} samples, more than max_samples ({max_samples}).")
+
+    electrodes, weights = _electrode_weights(arrays)
+    atoms = _expanded_atoms(arrays)
+
+    # Cumulative charge of each electrode at the atom boundaries, interpolated at the sample boundaries
+    atom_edges = np.concatenate([[0.], np.cumsum(arrays.duration[atoms], dtype=np.float64)])
+    atom_charge = (arrays.amplitudes[atoms, 0] * arrays.duration[atoms])[:, np.newaxis] \
+        * weights[arrays.function_index[atoms]]
+    cumulative = np.vstack([np.zeros((1, len(electrodes))), np.cumsum(atom_charge, axis=0)])
+    sample_edges = np.arange(num_samples + 1) * float(resolution_us)
+
+    current = np.empty((num_samples, len(electrodes)))
+    for column in range(len(electrodes)):
+        current[:, column] = np.diff(np.interp(sample_edges, atom_edges, cumulative[:, column])) / resolution_us
+    current.flags.writeable = False
+
+    waveform = StimulationWaveform(current, electrodes, resolution_us, charge_metrics(arrays))
+    entry[key] = waveform
+    return waveform